@@ -5,15 +5,32 @@ from flask_cors import CORS  # تأكد من استيراد CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
 from models import RoomPlayer, db, ChatMessage, Room  # تأكد من استيراد ChatMessage بشكل صحيح
 from config import Config
+from database.room_search import setup_room_search, include_object
+from database.migrations import upgrade_database
+from services.scheduler import TimerScheduler
+from services.metrics import register_metrics
+from services.presence_store import create_presence_store
+from services.player_broadcast import PlayerListBroadcaster
+from services.chat_buffer import ChatWriteBuffer
+from services.chat_history import message_to_dict
+from services.liveness import LivenessTable
+from services.typing_indicator import TypingAggregator
+from services.players_cache import RoomPlayersCache
+from services.socket_metrics import SocketEventMetrics
+from services.socket_serializer import NegotiatedPacket, enable_msgpack_negotiation
+from services.sharding import ShardRouter
+from services.db_writer import DatabaseWriter, configure_sqlite
+from services.chat_retention import ChatRetention, RedisRunLock, schedule_purges
 from routes.auth import auth_bp
-from routes.rooms import rooms_bp
+from routes.rooms import rooms_bp, membership, chat_history, room_shards, load_recent_messages, room_to_dict
+from services.membership import hub_name_for
 from routes.friends import friends_bp  # استيراد وحدة الأصدقاء
+from routes.metrics import metrics_bp
 from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
-import sqlalchemy.exc
+from sqlalchemy import func, or_, exists
 import time
 import threading
-import requests
 import atexit
 from datetime import datetime, timedelta
 
@@ -33,117 +50,231 @@ CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 # Initialize Database
 db.init_app(app)
 
+# WAL وإعدادات SQLite على كل اتصال، وكل معاملات الكتابة الخلفية تمر عبر كاتب واحد بالترتيب
+with app.app_context():
+    configure_sqlite(db.engine)
+db_writer = DatabaseWriter(db, max_queue=int(os.getenv('DB_WRITER_QUEUE', '10000')))
+db_writer.init_app(app)
+
 # Initialize Flask-Migrate
-migrate = Migrate(app, db)
+# نفس الترحيلات لـ SQLite وPostgreSQL: SQLite لا يدعم ALTER إلا بوضع batch (إعادة إنشاء الجدول)
+# include_object يستثني جدول البحث النصي وفهرسه لأنهما يُنشآن في setup_room_search وليس في النماذج
+migrate = Migrate(app, db, compare_type=True, include_object=include_object,
+                  render_as_batch=app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'))
 
 # Enable WebSocket
-socketio = SocketIO(app, cors_allowed_origins="*", logger=True)
+# عند تشغيل عدة عمليات يتم توزيع الأحداث عبر طابور رسائل مشترك (مثل Redis)
+# سجل Socket.IO يكتب سطراً لكل حدث (بما فيها النبضات)، لذلك يُفعّل عند الحاجة فقط
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    logger=os.getenv('SOCKETIO_LOGGER', 'false').lower() in ('true', '1', 'yes'),
+                    message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE'),
+                    serializer=NegotiatedPacket)
+
+# ترميز MessagePack اختياري للعملاء الذين يطلبونه عند الاتصال (والباقون يستمرون بـ JSON)
+if os.getenv('SOCKETIO_MSGPACK', 'false').lower() in ('true', '1', 'yes'):
+    if enable_msgpack_negotiation(socketio.server):
+        print("📦 تم تفعيل ترميز MessagePack لاتصالات Socket.IO")
+    else:
+        print("⚠️ مكتبة msgpack غير مثبتة، سيتم استخدام JSON فقط")
+
+# قياس زمن وأخطاء وحجم بيانات كل حدث Socket.IO ومعدل الأحداث لكل غرفة
+socket_metrics = SocketEventMetrics(payload_sample_rate=int(os.getenv('SOCKET_METRICS_PAYLOAD_SAMPLE', '10')),
+                                    rate_window=float(os.getenv('SOCKET_METRICS_RATE_WINDOW', '60')))
+register_metrics("socketio", socket_metrics.stats)
+
+def socket_event(event):
+    """بديل @socketio.on يسجل قياسات المعالج"""
+    def decorator(handler):
+        return socketio.on(event)(socket_metrics.instrument(event, handler))
+    return decorator
+
+# حالة الحضور (الجلسات واللاعبين المنقطعين) في مخزن مشترك بين العمليات
+presence = create_presence_store(os.getenv('PRESENCE_STORE_URL'))
+register_metrics("presence", presence.counts)
+
+# أي تغيير في العضوية يجعل الغرفة مرشحة للتنظيف التدريجي التالي
+membership.subscribe(lambda event, room_id, username: presence.mark_room_dirty(room_id))
+
+# أسماء لاعبي الغرف في ذاكرة LRU تُحدّث مع كل تغيير في العضوية
+# (تُستخدم فقط للغرف التي تخدمها هذه العملية وحدها، انظر get_players_for_room)
+players_cache = RoomPlayersCache(max_rooms=int(os.getenv('PLAYERS_CACHE_ROOMS', '1024')))
+register_metrics("players_cache", players_cache.stats)
+
+def update_players_cache(event, room_id, username):
+    if event == "joined":
+        players_cache.add(room_id, username)
+    elif event == "left":
+        players_cache.remove(room_id, username)
+    else:
+        players_cache.invalidate(room_id)
 
-# Dictionary to track disconnected players and their timers
-disconnected_players = {}
+membership.subscribe(update_players_cache)
 
-# Dictionary to track player sessions (sid -> (room_id, username))
-player_sessions = {}
+# تغييرات قائمة اللاعبين تُجمع لكل غرفة وتُرسل كفرق واحد بدلاً من القائمة كاملة مع كل حدث
+player_broadcaster = PlayerListBroadcaster(
+    lambda room_id, payload: socketio.emit('players_delta', payload, room=room_id),
+    presence,
+    window=float(os.getenv('PLAYER_BROADCAST_WINDOW', '0.2'))
+)
+membership.subscribe(player_broadcaster.record)
+register_metrics("player_broadcast", player_broadcaster.stats)
 
-# آخر وقت تم فيه تنظيف الغرف
-last_cleanup_time = datetime.now()
+# حذف سجل الرسائل وحالة الكتابة من الذاكرة عند حذف الغرفة
+def drop_room_state(event, room_id, username):
+    if event == "room_deleted":
+        chat_history.drop(room_id)
+        typing_indicators.clear_room(room_id)
+
+membership.subscribe(drop_room_state)
+
+# قائمة الغرف لعملاء الصالة: قائمة كاملة عند subscribe_lobby ثم تحديث الغرف التي تغيرت فقط
+LOBBY_ROOM = 'lobby'
 
-# تنظيف الغرف الفارغة
-def cleanup_empty_rooms():
+def publish_lobby_room(room_id):
+    # قد يُستدعى من خيط بدون app context (مثلاً أحداث موجهة من عملية أخرى)
+    with app.app_context():
+        room = db.session.get(Room, int(room_id))
+        if room:
+            socketio.emit('room_changed', {'room': room_to_dict(room)}, room=LOBBY_ROOM)
+        else:
+            socketio.emit('room_removed', {'room_id': int(room_id)}, room=LOBBY_ROOM)
+
+membership.subscribe(lambda event, room_id, username: publish_lobby_room(room_id))
+
+# عند تقسيم الغرف على عدة عمليات تُرسل أحداث العضوية إلى العملية المالكة للغرفة فقط،
+# فتبقى حالة كل غرفة (الذاكرة المؤقتة، البث، الكتابة) في عملية واحدة
+if room_shards.enabled:
+    # قناة كل جزء تصل لكل نسخه، فيُعالج الحدث الموجه أكثر من مرة
+    if room_shards.shared:
+        raise ValueError("SHARD_COUNT > 1 cannot be combined with APP_REPLICAS > 1 (--scale app=N)")
+    shard_router_url = os.getenv('SHARD_ROUTER_URL') or os.getenv('SOCKETIO_MESSAGE_QUEUE')
+    if not shard_router_url:
+        raise ValueError("SHARD_ROUTER_URL or SOCKETIO_MESSAGE_QUEUE is required when SHARD_COUNT > 1")
+    shard_router = ShardRouter(room_shards, shard_router_url, membership.notify)
+    membership.set_router(shard_router.route)
+    shard_router.start()
+    register_metrics("sharding", shard_router.stats)
+    print(f"🧩 العملية {room_shards.index} من {room_shards.count} لخدمة الغرف")
+
+# آخر وقت تم فيه تنظيف الغرف، والتنظيف التدريجي رخيص فيمكن تكراره كثيراً
+last_cleanup_time = datetime.now()
+CLEANUP_INTERVAL = timedelta(seconds=int(os.getenv('CLEANUP_INTERVAL', '60')))
+# فحص كل الغرف عند أول تنظيف بعد التشغيل (تغييرات فترة التوقف ليست في سجل التغييرات) ثم بشكل متباعد
+last_full_cleanup_time = None
+FULL_CLEANUP_INTERVAL = timedelta(hours=int(os.getenv('FULL_CLEANUP_INTERVAL_HOURS', '24')))
+
+# تصحيح عدادات اللاعبين وحذف الغرف الفارغة (تُنفذ في خيط الكاتب كمعاملة واحدة)
+def clean_rooms(room_ids=None):
+    # استعلام تجميعي واحد يجد الغرف الفارغة والغرف التي لا يطابق عدادها عدد لاعبيها
+    players_count = func.count(RoomPlayer.id)
+    query = db.session.query(Room.id, Room.current_players, players_count) \
+        .outerjoin(RoomPlayer, RoomPlayer.room_id == Room.id) \
+        .group_by(Room.id, Room.current_players) \
+        .having(or_(players_count == 0, players_count != Room.current_players))
+    if room_ids is not None:
+        query = query.filter(Room.id.in_(room_ids))
+    rows = [row for row in query if room_shards.is_local(row[0])]
+
+    corrections = [(room_id, current, count) for room_id, current, count in rows if count > 0]
+    if corrections:
+        db.session.bulk_update_mappings(Room, [
+            {"id": room_id, "current_players": count} for room_id, current, count in corrections
+        ])
+
+    empty_ids = [room_id for room_id, current, count in rows if count == 0]
+    if empty_ids:
+        # شرط عدم وجود لاعبين يُعاد داخل الحذف حتى لا تُحذف غرفة انضم إليها لاعب بعد الاستعلام
+        Room.query.filter(
+            Room.id.in_(empty_ids),
+            ~exists().where(RoomPlayer.room_id == Room.id)
+        ).delete(synchronize_session=False)
+        remaining = {room_id for (room_id,) in db.session.query(Room.id).filter(Room.id.in_(empty_ids))}
+        empty_ids = [room_id for room_id in empty_ids if room_id not in remaining]
+        # رسائل الغرف المحذوفة تُحذف لاحقاً على دفعات في الخلفية
+        schedule_purges(db.session, empty_ids)
+    return corrections, empty_ids
+
+# تنظيف الغرف الفارغة: الغرف التي تغيرت عضويتها منذ آخر تنظيف (سجل التغييرات في presence)، وكل الغرف عند full_scan
+def cleanup_empty_rooms(full_scan=False):
+    global last_full_cleanup_time
     with app.app_context():
         try:
-            print("🧹 بدء عملية تنظيف الغرف الفارغة...")
-            # البحث عن الغرف
-            rooms = Room.query.all()
-            cleaned_rooms = 0
-            
-            for room in rooms:
-                # التحقق من عدد اللاعبين في الغرفة
-                players_count = RoomPlayer.query.filter_by(room_id=room.id).count()
-                
-                # إذا كانت الغرفة فارغة، نقوم بتنظيفها
-                if players_count == 0 or players_count != room.current_players:
-                    # تصحيح عدد اللاعبين إذا كان غير متطابق
-                    if players_count != room.current_players and players_count > 0:
-                        print(f"⚠️ تصحيح عدد اللاعبين في الغرفة {room.id}: {room.current_players} -> {players_count}")
-                        room.current_players = players_count
-                        db.session.commit()
-                    
-                    # إذا كانت الغرفة فارغة فعلاً، نقوم بحذفها
-                    if players_count == 0:
-                        print(f"🗑️ حذف الغرفة الفارغة: {room.id} ({room.name})")
-                        # حذف هاب VPN والتحقق من المحولات
-                        try:
-                            from services.softether import SoftEtherVPN
-                            vpn = SoftEtherVPN()
-                            hub_name = f"room_{room.id}"
-                            
-                            # التحقق من المحولات المرتبطة بالغرفة وتركها إذا كانت موجودة ومستخدمة
-                            adapter_name = "VPN"  # استخدام اسم ثابت "VPN" مطابق للعميل
-                            if vpn.adapter_exists(adapter_name):
-                                # يمكن تنفيذ منطق إضافي هنا للتحقق مما إذا كان المحول مستخدمًا من قبل غرف أخرى
-                                # إذا كان غير مستخدم، يمكن حذفه
-                                # في هذه الحالة، نقرر تركه للاستخدام المستقبلي
-                                print(f"🔌 تم العثور على المحول {adapter_name}، سيتم الاحتفاظ به للاستخدام مستقبلاً")
-                            
-                            vpn.delete_hub(hub_name)
-                            print(f"✅ تم حذف هاب VPN: {hub_name}")
-                        except Exception as e:
-                            print(f"❌ خطأ أثناء حذف هاب VPN: {e}")
-                        
-                        # حذف رسائل الدردشة والغرفة
-                        ChatMessage.query.filter_by(room_id=room.id).delete()
-                        db.session.delete(room)
-                        cleaned_rooms += 1
-            
-            # حفظ التغييرات
-            db.session.commit()
-            print(f"✅ اكتملت عملية التنظيف: تم حذف {cleaned_rooms} غرفة فارغة")
-            
-            # تنظيف بيانات الجلسات غير المستخدمة
-            cleanup_inactive_sessions()
-            
+            if last_full_cleanup_time is None or datetime.now() - last_full_cleanup_time > FULL_CLEANUP_INTERVAL:
+                full_scan = True
+            if full_scan:
+                last_full_cleanup_time = datetime.now()
+
+            dirty_rooms = presence.take_dirty_rooms()
+            room_ids = None if full_scan else [int(room_id) for room_id in dirty_rooms if room_id.isdigit()]
+            if room_ids == []:
+                corrections, deleted_ids = [], []
+            else:
+                print(f"🧹 بدء عملية تنظيف الغرف الفارغة ({'كل الغرف' if full_scan else f'{len(room_ids)} غرفة متغيرة'})...")
+                corrections, deleted_ids = db_writer.run(clean_rooms, room_ids)
+
+            for room_id, current, count in corrections:
+                print(f"⚠️ تصحيح عدد اللاعبين في الغرفة {room_id}: {current} -> {count}")
+                publish_lobby_room(room_id)
+
+            if deleted_ids:
+                # حذف هابات VPN لكل الغرف المحذوفة في عملية vpncmd واحدة
+                hub_names = [hub_name_for(room_id) for room_id in deleted_ids]
+                if membership.vpn.run_commands([(None, f"HubDelete {hub_name}") for hub_name in hub_names]):
+                    print(f"✅ تم حذف هابات VPN: {', '.join(hub_names)}")
+                else:
+                    print(f"❌ خطأ أثناء حذف هابات VPN: {', '.join(hub_names)}")
+
+            for room_id in deleted_ids:
+                print(f"🗑️ تم حذف الغرفة الفارغة: {room_id}")
+                dirty_rooms.add(str(room_id))
+                chat_history.drop(room_id)
+                players_cache.invalidate(room_id)
+                publish_lobby_room(room_id)
+            if room_ids != []:
+                print(f"✅ اكتملت عملية التنظيف: تم حذف {len(deleted_ids)} غرفة فارغة")
+
+            # تنظيف بيانات الجلسات غير المستخدمة في نفس الغرف
+            cleanup_inactive_sessions(dirty_rooms)
+
         except Exception as e:
             print(f"❌ خطأ أثناء تنظيف الغرف الفارغة: {e}")
-            db.session.rollback()
 
 # تنظيف بيانات الجلسات غير المستخدمة
-def cleanup_inactive_sessions():
+def cleanup_inactive_sessions(dirty_rooms):
     try:
-        print("🧹 بدء عملية تنظيف الجلسات غير المستخدمة...")
-        
-        # جمع معرّفات الجلسات التي لها لاعبين في قاعدة البيانات
-        active_players = {}
-        players = RoomPlayer.query.all()
-        for player in players:
-            active_players[(str(player.room_id), player.player_username)] = True
-        
-        # حذف بيانات الجلسات المنقطعة التي لم تعد موجودة في قاعدة البيانات
-        disconnected_to_remove = []
-        for (room_id, username) in disconnected_players:
-            if (room_id, username) not in active_players:
-                disconnected_to_remove.append((room_id, username))
-        
-        for key in disconnected_to_remove:
-            sid = disconnected_players[key]
-            print(f"🗑️ حذف المستخدم المنقطع: {key[1]} من الغرفة {key[0]}")
-            del disconnected_players[key]
-            # إذا كان معرّف الجلسة موجودًا في player_sessions، قم بحذفه أيضًا
-            if sid in player_sessions:
-                del player_sessions[sid]
+        # نفحص فقط الغرف التي تغيرت عضويتها أو جلساتها منذ آخر تنظيف
+        if not dirty_rooms:
+            return
+        print(f"🧹 بدء عملية تنظيف الجلسات غير المستخدمة في {len(dirty_rooms)} غرفة...")
         
-        # حذف بيانات الجلسات النشطة التي لم تعد موجودة في قاعدة البيانات
-        sessions_to_remove = []
-        for sid, (room_id, username) in player_sessions.items():
-            if (room_id, username) not in active_players:
-                sessions_to_remove.append(sid)
+        # جمع اللاعبين الموجودين في قاعدة البيانات لهذه الغرف فقط
+        room_ids = [int(room_id) for room_id in dirty_rooms if room_id.isdigit()]
+        active_players = set()
+        if room_ids:
+            rows = db.session.query(RoomPlayer.room_id, RoomPlayer.player_username) \
+                .filter(RoomPlayer.room_id.in_(room_ids)).all()
+            active_players = {(str(room_id), username) for room_id, username in rows}
         
-        for sid in sessions_to_remove:
-            room_id, username = player_sessions[sid]
-            print(f"🗑️ حذف جلسة غير مستخدمة: {username} من الغرفة {room_id}")
-            del player_sessions[sid]
+        disconnected_removed = 0
+        sessions_removed = 0
+        for room_id in dirty_rooms:
+            # حذف بيانات الجلسات المنقطعة التي لم تعد موجودة في قاعدة البيانات
+            for username, sid in presence.room_disconnected(room_id):
+                if (room_id, username) not in active_players:
+                    print(f"🗑️ حذف المستخدم المنقطع: {username} من الغرفة {room_id}")
+                    presence.clear_disconnected(room_id, username)
+                    # إذا كان معرّف الجلسة موجودًا في الجلسات، قم بحذفه أيضًا
+                    presence.remove_session(sid)
+                    disconnected_removed += 1
+            
+            # حذف بيانات الجلسات النشطة التي لم تعد موجودة في قاعدة البيانات
+            for sid, username in presence.room_sessions(room_id):
+                if (room_id, username) not in active_players:
+                    print(f"🗑️ حذف جلسة غير مستخدمة: {username} من الغرفة {room_id}")
+                    presence.remove_session(sid)
+                    sessions_removed += 1
         
-        print(f"✅ اكتملت عملية تنظيف الجلسات: {len(disconnected_to_remove)} منقطعة، {len(sessions_to_remove)} غير مستخدمة")
+        print(f"✅ اكتملت عملية تنظيف الجلسات: {disconnected_removed} منقطعة، {sessions_removed} غير مستخدمة")
     
     except Exception as e:
         print(f"❌ خطأ أثناء تنظيف الجلسات غير المستخدمة: {e}")
@@ -152,287 +283,221 @@ def cleanup_inactive_sessions():
 @app.before_request
 def check_cleanup_needed():
     global last_cleanup_time
-    # تنظيف كل 15 دقيقة
-    if datetime.now() - last_cleanup_time > timedelta(minutes=15):
+    # تنظيف تدريجي كل CLEANUP_INTERVAL
+    if datetime.now() - last_cleanup_time > CLEANUP_INTERVAL:
         last_cleanup_time = datetime.now()
         # تشغيل التنظيف في خيط منفصل لعدم تأخير الطلب الحالي
         threading.Thread(target=cleanup_empty_rooms, daemon=True).start()
 
 # تنظيف عند إيقاف الخادم
-@atexit.register
 def cleanup_on_shutdown():
     print("🔴 تنظيف الغرف قبل إيقاف الخادم...")
-    cleanup_empty_rooms()
+    cleanup_empty_rooms(full_scan=True)
 
 def initialize_database():
-    db_path = os.path.join('dbdata', 'app.db')
-    if not os.path.exists(db_path):
-        print("🔵 Database not found. Creating new database...")
-        with app.app_context():
-            db.create_all()
+    # نفس الترحيلات (migrations/) لـ SQLite وPostgreSQL، وقاعدة البيانات الجديدة تُنشأ بـ create_all
+    with app.app_context():
+        result = upgrade_database(db)
+    if result == "created":
         print("✅ Database created successfully!")
+    elif result == "upgraded":
+        print("✅ Database schema upgraded to the latest migration.")
     else:
         print("🟢 Database already exists.")
 
-
 initialize_database()
 
+# تهيئة فهرس البحث النصي للغرف
+with app.app_context():
+    setup_room_search(db.engine)
+
 # Register Blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(rooms_bp)
 app.register_blueprint(friends_bp, url_prefix='/friends')  # تسجيل وحدة الأصدقاء
+app.register_blueprint(metrics_bp)
+
+@socket_event('subscribe_lobby')
+def handle_subscribe_lobby(data=None):
+    """متابعة قائمة الغرف: القائمة كاملة لهذا العميل فقط، ثم room_changed و room_removed"""
+    join_room(LOBBY_ROOM)
+    emit('rooms_updated', {'rooms': [room_to_dict(room) for room in Room.query.all()]}, room=request.sid)
+
+
+@socket_event('unsubscribe_lobby')
+def handle_unsubscribe_lobby(data=None):
+    """إيقاف تحديثات قائمة الغرف أثناء وجود العميل داخل غرفة"""
+    leave_room(LOBBY_ROOM)
 
-players_in_rooms = {}  # Dictionary to حفظ اللاعبين حسب room_id
 
 # استماع لحدث "get_players" في الـ namespace '/game'
-@socketio.on('get_players')
+@socket_event('get_players')
   # استخدام namespace عند استقبال البيانات
 def handle_get_players(data):
-    room_id = data['room_id']
-    players = get_players_for_room(room_id)
-    if players:
-        print(f"Players for room {room_id}: {players}")
-    else:
-        print(f"No players found for room {room_id}")
-    emit('update_players', {'players': players}, room=room_id)
+    # مزامنة كاملة للعميل الذي طلبها فقط (عند الدخول أو عند اكتشاف فجوة في الإصدارات)
+    room_id = str(data['room_id'])
+    emit('update_players', players_snapshot(room_id), room=request.sid)
 
 
 # دالة لاسترجاع اللاعبين من قاعدة البيانات بناءً على room_id
-def get_players_for_room(room_id):
+def load_players_for_room(room_id):
     players = RoomPlayer.query.filter_by(room_id=room_id).all()
     return [p.player_username for p in players]  # استرجاع أسماء اللاعبين
 
 
-# دالة للتعامل مع الـ commit مع محاولات إعادة في حالة قفل قاعدة البيانات
-def commit_with_retry(max_retries=5, retry_delay=0.5):
-    """Commit database changes with retry for locked database."""
-    for attempt in range(max_retries):
-        try:
-            db.session.commit()
-            return True  # نجاح
-        except sqlalchemy.exc.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                db.session.rollback()  # التراجع عن العملية
-                time.sleep(retry_delay * (attempt + 1))  # انتظار متزايد
-                continue
-            else:
+# دالة لاسترجاع اللاعبين من الذاكرة المؤقتة (أو من قاعدة البيانات عند عدم وجودهم)
+def get_players_for_room(room_id):
+    # الذاكرة تُحدّث من أحداث هذه العملية فقط، فلا تُستخدم إذا كانت عمليات أخرى تغير عضوية نفس الغرفة
+    if not room_shards.owns(room_id):
+        return load_players_for_room(room_id)
+    return players_cache.get(room_id, load_players_for_room)
+
+
+# قائمة اللاعبين كاملة مع إصدارها
+def players_snapshot(room_id):
+    # نقرأ الإصدار قبل القائمة حتى تغطي الفروق اللاحقة أي تغيير لم تتضمنه القائمة
+    version = presence.room_version(room_id)
+    return {'players': get_players_for_room(room_id), 'version': version}
+
+
+# مهلة السماح قبل إزالة اللاعب المنقطع (بالثواني)
+DISCONNECT_GRACE_PERIOD = 60
+
+# دالة لإزالة اللاعبين المنقطعين الذين انقضت مهلتهم (تُستدعى من المجدول على دفعات)
+def remove_players_after_timeout(batch):
+    with app.app_context():
+        for room_id, username, sid in batch:
+            try:
+                remove_player_after_timeout(room_id, username, sid)
+            except Exception as e:
+                print(f"❌ خطأ أثناء إزالة اللاعب المنقطع {username} من الغرفة {room_id}: {e}")
                 db.session.rollback()
-                raise  # إعادة رفع الخطأ إذا لم يكن متعلق بالقفل أو استنفدنا المحاولات
-    return False  # فشل بعد كل المحاولات
 
 # دالة لإزالة اللاعب من الغرفة بعد انقطاع الاتصال
 def remove_player_after_timeout(room_id, username, sid):
-    print(f"⏱️ انتظار 60 ثانية قبل إزالة اللاعب {username} من الغرفة {room_id}")
-    time.sleep(60)  # انتظار 60 ثانية
-    
     # تحقق مما إذا كان اللاعب لا يزال في قائمة المنقطعين
     # (إذا عاد للاتصال، سيتم إزالته من القائمة)
-    if (room_id, username) in disconnected_players:
-        with app.app_context():
-            print(f"🔴 انقضت المهلة، إزالة اللاعب {username} من الغرفة {room_id}")
-            # حذف اللاعب من قاعدة البيانات
-            player = RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first()
-            if player:
-                # استخدام API الخاص بنا لمغادرة الغرفة
-                try:
-                    # تحقق من عدد اللاعبين المتبقين
-                    is_host = player.is_host  # حفظ قيمة is_host قبل حذف اللاعب
-                    db.session.delete(player)
-                    db.session.flush()
-                    
-                    players_left = RoomPlayer.query.filter_by(room_id=room_id).count()
-                    room = Room.query.get(room_id)
-                    is_last_player = players_left == 0
-                    
-                    # استدعاء API مع معلومة ما إذا كان هذا آخر لاعب
-                    api_url = f"{os.getenv('API_BASE_URL', 'http://localhost:5000')}/leave_room"
-                    response = requests.post(
-                        api_url, 
-                        json={
-                            "room_id": room_id,
-                            "username": username,
-                            "is_last_player": is_last_player
-                        },
-                        timeout=5  # timeout de 5 segundos para evitar bloqueos
-                    )
-                    
-                    if is_last_player:
-                        print(f"✅ غرفة {room_id} فارغة وتم تنظيفها")
-                    else:
-                        print(f"✅ تم إخراج اللاعب {username} من الغرفة {room_id} والـ VPN hub")
-                        
-                        # إذا كان اللاعب هو المضيف، نقوم بتعيين مضيف جديد
-                        if is_host and room:
-                            new_host = RoomPlayer.query.filter_by(room_id=room_id).first()
-                            if new_host:
-                                new_host.is_host = True
-                                room.owner_username = new_host.player_username
-                                db.session.commit()
-                                print(f"New host assigned: {new_host.player_username}")
-                
-                except Exception as e:
-                    print(f"❌ خطأ أثناء استدعاء API لإزالة اللاعب: {e}")
-                    # إذا فشل استدعاء API، نحذف اللاعب مباشرة من قاعدة البيانات
-                    try:
-                        # التحقق مما إذا كان اللاعب لا يزال موجودًا في قاعدة البيانات
-                        player_still_exists = RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first()
-                        if player_still_exists:
-                            db.session.delete(player_still_exists)
-                        
-                        # تحقق من عدد اللاعبين المتبقين
-                        players_left = RoomPlayer.query.filter_by(room_id=room_id).count()
-                        room = Room.query.get(room_id)
-                        if players_left == 0 and room:
-                            ChatMessage.query.filter_by(room_id=room_id).delete()
-                            db.session.delete(room)
-                        elif is_host and room:  # Si era host y no es el último jugador
-                            new_host = RoomPlayer.query.filter_by(room_id=room_id).first()
-                            if new_host:
-                                new_host.is_host = True
-                                room.owner_username = new_host.player_username
-                        
-                        commit_with_retry()
-                    except Exception as inner_e:
-                        print(f"❌❌ خطأ ثانوي أثناء تنظيف البيانات: {inner_e}")
-                        db.session.rollback()
-                
-                # إزالة اللاعب من قائمة المنقطعين
-                del disconnected_players[(room_id, username)]
-                
-                # تنظيف بيانات الجلسة إذا كانت لا تزال موجودة
-                if sid in player_sessions:
-                    del player_sessions[sid]
-                
-                # إخطار جميع اللاعبين في الغرفة
-                socketio.emit('user_left', {'username': username}, room=room_id)
-                
-                # تحديث قائمة اللاعبين
-                players = get_players_for_room(room_id)
-                socketio.emit('update_players', {'players': players}, room=room_id)
+    # (إذا انقطع مجدداً بجلسة أخرى، يتولى المؤقت الأحدث إزالته)
+    if presence.get_disconnected(room_id, username) != sid:
+        return
+
+    print(f"🔴 انقضت المهلة، إزالة اللاعب {username} من الغرفة {room_id}")
+    # مغادرة الغرفة مباشرة عبر خدمة العضوية (معاملة واحدة ودفعة VPN واحدة)
+    result = membership.leave(room_id, username)
+
+    # إزالة اللاعب من قائمة المنقطعين
+    presence.clear_disconnected(room_id, username)
+
+    # تنظيف بيانات الجلسة إذا كانت لا تزال موجودة
+    presence.remove_session(sid)
+
+    if not result or not result["left"]:
+        return
+
+    if result["room_deleted"]:
+        print(f"✅ غرفة {room_id} فارغة وتم تنظيفها")
+        socketio.emit('rooms_updated', broadcast=True)
+        return
+
+    print(f"✅ تم إخراج اللاعب {username} من الغرفة {room_id} والـ VPN hub")
+    if result["new_host"]:
+        socketio.emit('host_changed', {'new_host': result["new_host"]}, room=room_id)
+    # خروج اللاعب يصل لبقية الغرفة عبر players_delta
+
+# مجدول واحد لكل مهل السماح بدلاً من خيط نائم لكل لاعب منقطع
+grace_timers = TimerScheduler(remove_players_after_timeout, name="disconnect-grace")
+register_metrics("disconnect_grace", lambda: {"pending": len(grace_timers), "expired_total": grace_timers.expired_total})
+
+# قطع الجلسات التي توقفت نبضاتها، فيتولى handle_disconnect مهلة السماح كالمعتاد
+def disconnect_stale_sessions(sids):
+    print(f"💤 {len(sids)} جلسة بدون نبضات، سيتم قطع اتصالها")
+    for sid in sids:
+        try:
+            socketio.server.disconnect(sid)
+        except Exception as e:
+            print(f"❌ خطأ أثناء قطع الجلسة المتوقفة {sid}: {e}")
+
+# آخر ظهور لكل جلسة (النبضات كل 30 ثانية، والجلسة تعتبر متوقفة بعد 3 نبضات فائتة)
+liveness = LivenessTable(
+    disconnect_stale_sessions,
+    timeout=int(os.getenv('HEARTBEAT_TIMEOUT', '90')),
+    sweep_interval=int(os.getenv('HEARTBEAT_SWEEP_INTERVAL', '15'))
+)
+register_metrics("liveness", liveness.stats)
 
 # إعدادات الاتصال بالـ WebSocket
-@socketio.on('join')
+@socket_event('join')
 def handle_join(data):
     room_id = str(data['room_id'])
     username = data['username']
+    if not room_shards.is_local(room_id):
+        # العميل متصل بعملية لا تملك الغرفة، فيعيد الاتصال بالعملية الصحيحة
+        emit('error', {'message': 'Room is served by another shard', 'shard': room_shards.owner(room_id)},
+             room=request.sid)
+        return
     join_room(room_id)
     
     # Store the player's session ID
-    player_sessions[request.sid] = (room_id, username)
+    presence.set_session(request.sid, room_id, username)
+    liveness.register(request.sid)
 
     # إذا كان اللاعب في قائمة المنقطعين، نزيله منها
-    if (room_id, username) in disconnected_players:
+    if presence.clear_disconnected(room_id, username):
         print(f"🟢 اللاعب {username} عاد للاتصال بالغرفة {room_id}")
-        del disconnected_players[(room_id, username)]
+        grace_timers.cancel((room_id, username))
 
     # أولاً: حفظ اللاعب في قاعدة البيانات إذا مش موجود
-    existing_player = RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first()
-    if not existing_player:
-        new_player = RoomPlayer(room_id=room_id, player_username=username, is_host=False, username=username)
-        db.session.add(new_player)
-        try:
-            commit_with_retry()
+    try:
+        if username not in get_players_for_room(room_id) and membership.add_player(room_id, username):
             print(f"Added player {username} to RoomPlayer table.")
-        except Exception as e:
-            print(f"Error adding player to database: {e}")
-            emit('error', {'message': 'Database error'}, room=room_id)
-            return
+    except Exception as e:
+        print(f"Error adding player to database: {e}")
+        emit('error', {'message': 'Database error'}, room=room_id)
+        return
 
-    emit('user_joined', {'username': username}, room=room_id)
+    # بقية الغرفة تستلم الانضمام عبر players_delta، واللاعب الجديد يستلم القائمة كاملة
+    emit('update_players', players_snapshot(room_id), room=request.sid)
 
-    # الآن لما نحدث اللاعبين، نسترجعهم من القاعدة مو من الرام
-    players = get_players_for_room(room_id)
-    print(f"Players for room {room_id}: {players}")
-    emit('update_players', {'players': players}, room=room_id)
+    # آخر رسائل الغرفة من الذاكرة إذا كانت هذه العملية وحدها تخدمها، وإلا من قاعدة البيانات
+    if room_shards.owns(room_id):
+        rows = chat_history.recent(room_id)
+    else:
+        rows = load_recent_messages(room_id, chat_history.size)
+    messages = [message_to_dict(row) for row in rows]
+    emit('chat_history', {'room_id': room_id, 'messages': messages}, room=request.sid)
 
 
 # مغادرة الغرفة
-@socketio.on('leave')
+@socket_event('leave')
 def handle_leave(data):
     room_id = str(data['room_id'])
     username = data['username']
-    is_last_player = data.get('is_last_player', False)
     
-    print(f"[DEBUG] Player {username} leaving room {room_id}, is_last_player: {is_last_player}")
+    print(f"[DEBUG] Player {username} leaving room {room_id}")
     
     # Remove the player's session
-    if request.sid in player_sessions:
-        del player_sessions[request.sid]
-
-    # حذف اللاعب من قاعدة البيانات
-    player = RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first()
-    if player:
-        is_host = player.is_host  # حفظ قيمة is_host قبل حذف اللاعب
-        db.session.delete(player)
-        try:
-            db.session.flush()  # نستخدم flush بدلاً من commit للتحقق من عدد اللاعبين المتبقين
-            print(f"Removed player {username} from RoomPlayer table.")
-            
-            # التحقق من عدد اللاعبين المتبقين
-            players_left = RoomPlayer.query.filter_by(room_id=room_id).count()
-            room = Room.query.get(room_id)
-            
-            if room:
-                room.current_players = players_left
-                
-                if is_last_player or players_left == 0:
-                    # حذف هاب VPN عند خروج آخر لاعب
-                    hub_name = f"room_{room_id}"
-                    print(f"Deleting VPN hub: {hub_name} - Room is empty")
-                    
-                    try:
-                        # استخدام API للتنظيف الكامل
-                        api_url = f"{os.getenv('API_BASE_URL', 'http://localhost:5000')}/leave_room"
-                        response = requests.post(
-                            api_url, 
-                            json={
-                                "room_id": room_id,
-                                "username": username,
-                                "is_last_player": True
-                            },
-                            timeout=5
-                        )
-                        print(f"✅ Room {room_id} cleaned up via API, status: {response.status_code}")
-                        
-                        # حذف الغرفة من قاعدة البيانات
-                        ChatMessage.query.filter_by(room_id=room_id).delete()
-                        db.session.delete(room)
-                        print(f"✅ Room {room_id} deleted from database")
-                    except Exception as e:
-                        print(f"❌ Error calling cleanup API: {e}")
-                        # يمكن إضافة تنظيف يدوي هنا
-                        try:
-                            ChatMessage.query.filter_by(room_id=room_id).delete()
-                            db.session.delete(room)
-                            print(f"✅ Manual cleanup of room {room_id} successful")
-                        except Exception as inner_e:
-                            print(f"❌❌ Error during manual cleanup: {inner_e}")
-                else:
-                    # إذا كان اللاعب هو المضيف، نقوم بتعيين مضيف جديد
-                    if is_host:
-                        new_host = RoomPlayer.query.filter_by(room_id=room_id).first()
-                        if new_host:
-                            new_host.is_host = True
-                            room.owner_username = new_host.player_username
-                            print(f"New host assigned: {new_host.player_username}")
-            
-            commit_with_retry()
-        except Exception as e:
-            print(f"Error removing player from database: {e}")
-            db.session.rollback()
-            emit('error', {'message': 'Database error'}, room=room_id)
-            return
+    presence.remove_session(request.sid)
+    liveness.release(request.sid)
+    typing_indicators.record(room_id, username, False)
 
-    # إرسال إشعارات للاعبين الآخرين
-    emit('user_left', {'username': username}, room=room_id)
+    # حذف اللاعب من قاعدة البيانات والـ VPN عبر خدمة العضوية
+    try:
+        result = membership.leave(room_id, username)
+    except Exception as e:
+        print(f"Error removing player from room: {e}")
+        emit('error', {'message': 'Database error'}, room=room_id)
+        return
+
+    leave_room(room_id)
 
-    # تحديث قائمة اللاعبين
-    players = get_players_for_room(room_id)
-    print(f"Players for room {room_id}: {players}")
-    emit('update_players', {'players': players}, room=room_id)
+    if result and result["new_host"]:
+        print(f"New host assigned: {result['new_host']}")
+        emit('host_changed', {'new_host': result["new_host"]}, room=room_id)
+
+    # اللاعبون الآخرون يستلمون المغادرة عبر players_delta
     
     # إذا كانت الغرفة فارغة، نقوم بتحديث قائمة الغرف للجميع
-    if is_last_player or (room and room.current_players == 0):
+    if result and result["room_deleted"]:
         emit('rooms_updated', broadcast=True)
         
     # إرسال تأكيد للمستخدم الذي غادر
@@ -440,36 +505,100 @@ def handle_leave(data):
 
 
 # حدث انقطاع الاتصال
-@socketio.on('disconnect')
+@socket_event('disconnect')
 def handle_disconnect():
     print(f"🔌 انقطاع اتصال من المستخدم SID: {request.sid}")
+    liveness.release(request.sid)
     
     # Check if this session belongs to a player
-    if request.sid in player_sessions:
-        room_id, username = player_sessions[request.sid]
-        print(f"🟡 اللاعب {username} انقطع اتصاله من الغرفة {room_id}, سيتم الانتظار 60 ثانية قبل الإزالة")
+    session = presence.get_session(request.sid)
+    if session:
+        room_id, username = session
+        print(f"🟡 اللاعب {username} انقطع اتصاله من الغرفة {room_id}, سيتم الانتظار {DISCONNECT_GRACE_PERIOD} ثانية قبل الإزالة")
         
         # تأكد من أن اللاعب لا يزال في قاعدة البيانات (قد يكون غادر بالفعل)
         player = RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first()
         if player:
             # Add to disconnected players list
-            disconnected_players[(room_id, username)] = request.sid
+            presence.mark_disconnected(room_id, username, request.sid)
             
-            # Start a timer to remove the player after 60 seconds
-            timer_thread = threading.Thread(
-                target=remove_player_after_timeout,
-                args=(room_id, username, request.sid)
-            )
-            timer_thread.daemon = True
-            timer_thread.start()
+            # Schedule the player's removal after the grace period
+            grace_timers.schedule((room_id, username), DISCONNECT_GRACE_PERIOD, (room_id, username, request.sid))
         else:
             print(f"🔵 اللاعب {username} قد غادر الغرفة {room_id} بالفعل، لن يتم إطلاق مؤقت")
             # تنظيف البيانات
-            if request.sid in player_sessions:
-                del player_sessions[request.sid]
+            presence.remove_session(request.sid)
+
+# إضافة دفعة من رسائل الدردشة (تُنفذ في خيط الكاتب كمعاملة واحدة)
+def insert_chat_messages(rows):
+    # تجاهل رسائل الغرف التي حُذفت قبل حفظ الدفعة
+    room_ids = {row['room_id'] for row in rows}
+    existing = {room_id for (room_id,) in db.session.query(Room.id).filter(Room.id.in_(room_ids))}
+    rows = [row for row in rows if row['room_id'] in existing]
+    if rows:
+        # return_defaults يضع معرّف كل رسالة في قاموسها المشترك مع سجل الذاكرة
+        db.session.bulk_insert_mappings(ChatMessage, rows, return_defaults=True)
+
+# دالة لحفظ دفعة من رسائل الدردشة (تُستدعى من خيط الحفظ)
+def persist_chat_messages(rows):
+    db_writer.run(insert_chat_messages, rows)
+
+# رسائل الدردشة تُبث فوراً وتُحفظ على دفعات في الخلفية
+chat_buffer = ChatWriteBuffer(
+    persist_chat_messages,
+    max_batch=int(os.getenv('CHAT_FLUSH_BATCH', '100')),
+    flush_interval=float(os.getenv('CHAT_FLUSH_INTERVAL', '0.5')),
+    max_queue=int(os.getenv('CHAT_BUFFER_SIZE', '10000'))
+)
+register_metrics("chat_buffer", chat_buffer.stats)
+register_metrics("db_writer", db_writer.stats)
+# atexit ينفذ بالترتيب العكسي: يُفرغ طابور الرسائل، ثم تُحذف الغرف الفارغة عبر الكاتب، ثم يُغلق الكاتب
+atexit.register(db_writer.close)
+atexit.register(cleanup_on_shutdown)
+atexit.register(chat_buffer.close)
+
+# الرسائل القديمة أو الزائدة عن الحد في كل غرفة تُنقل إلى أرشيف مضغوط، ورسائل الغرف المغلقة تُحذف،
+# على دفعات صغيرة في خيط الكاتب. مع Redis تأخذ عملية واحدة قفلاً لكل دورة (يشمل --scale app=N)،
+# وبدونه تعمل المهمة في العملية 0 فقط، ويمكن إيقافها تماماً بـ CHAT_RETENTION_ENABLED=false
+# واختيار الغرف التي تحتاج ذلك قراءة واحدة خارج الكاتب
+def run_read(func, *args):
+    with app.app_context():
+        return func(*args)
+
+chat_retention = ChatRetention(
+    db_writer.run,
+    run_read,
+    max_per_room=int(os.getenv('CHAT_MAX_PER_ROOM', '10000')) or None,
+    retention_days=int(os.getenv('CHAT_RETENTION_DAYS', '90')) or None,
+    chunk_size=int(os.getenv('CHAT_RETENTION_CHUNK', '500')),
+    interval=float(os.getenv('CHAT_RETENTION_INTERVAL', '600'))
+)
+register_metrics("chat_retention", chat_retention.stats)
+if os.getenv('CHAT_RETENTION_ENABLED', 'true').lower() in ('true', '1', 'yes'):
+    chat_retention_lock_url = os.getenv('CHAT_RETENTION_LOCK_URL') or os.getenv('SOCKETIO_MESSAGE_QUEUE')
+    if chat_retention_lock_url:
+        chat_retention.lock = RedisRunLock(chat_retention_lock_url, ttl=chat_retention.interval * 0.9)
+        chat_retention.start()
+    elif room_shards.index == 0 and not room_shards.shared:
+        chat_retention.start()
+    else:
+        print("⚠️ أرشفة الرسائل معطلة: عدة نسخ بدون Redis، عيّن CHAT_RETENTION_LOCK_URL")
+
+# حالة الكتابة تُجمع لكل غرفة وتُرسل كقائمة "من يكتب الآن" مرة كل ثانية على الأكثر
+typing_indicators = TypingAggregator(
+    lambda room_id, payload: socketio.emit('typing', payload, room=room_id),
+    interval=float(os.getenv('TYPING_INTERVAL', '1.0')),
+    ttl=float(os.getenv('TYPING_TTL', '5.0'))
+)
+register_metrics("typing", typing_indicators.stats)
+
+# لما لاعب يكتب (typing)، ويرسل typing: false عند التوقف
+@socket_event('typing')
+def handle_typing(data):
+    typing_indicators.record(str(data['room_id']), data['username'], data.get('typing', True))
 
 # # كتابة رسالة
-@socketio.on('send_message')
+@socket_event('send_message')
 def handle_send_message(data):
     room_id = str(data['room_id'])
     sender = data.get('sender') or data.get('username')
@@ -480,49 +609,65 @@ def handle_send_message(data):
         emit('error', {'message': 'Message or sender cannot be empty'}, room=room_id)
         return
 
-    # نسجل الرسالة في قاعدة البيانات
-    msg = ChatMessage(
-        room_id=room_id,
-        sender=sender,
-        message=message
-    )
-    db.session.add(msg)
-    try:
-        commit_with_retry()
-    except Exception as e:
-        print(f"Error saving message to database: {e}")
-        emit('error', {'message': 'Database error'}, room=room_id)
+    # رقم الغرفة يأتي من العميل، والرسائل تُقبل فقط لغرفة موجودة يكون المرسل من لاعبيها
+    # (قائمة اللاعبين من الذاكرة المؤقتة، وتصبح فارغة عند حذف الغرفة)
+    if not room_id.isdigit():
+        emit('error', {'message': 'Invalid room_id'}, room=request.sid)
         return
+    if sender not in get_players_for_room(room_id):
+        emit('error', {'message': 'Room not found or sender is not in the room'}, room=request.sid)
+        return
+
+    # نسجل الرسالة في طابور الحفظ، وإذا كان ممتلئاً نبلغ المرسل فقط
+    timestamp = datetime.utcnow()
+    row = {'room_id': int(room_id), 'sender': sender, 'message': message, 'timestamp': timestamp}
+    if not chat_buffer.submit(row):
+        emit('error', {'message': 'Server is busy, message not sent'}, room=request.sid)
+        return
+    # نفس القاموس يأخذ معرّفه عند حفظ الدفعة
+    if room_shards.owns(room_id):
+        chat_history.append(room_id, row)
+    # إرسال الرسالة ينهي حالة الكتابة
+    typing_indicators.record(room_id, sender, False)
 
     # نرسل الرسالة لكل الموجودين بالغرفة
     emit('new_message', {
         'sender': sender,
         'message': message,
-        'time': msg.timestamp.strftime("%H:%M:%S")
+        'time': timestamp.strftime("%H:%M:%S")
     }, room=room_id)
 
 # حدث الـ heartbeat للتأكد من اتصال اللاعب
-@socketio.on('heartbeat')
+@socket_event('heartbeat')
 def handle_heartbeat(data):
+    # المسار السريع: جلسة معروفة، نحدّث آخر ظهور فقط
+    slot = liveness.slot_of(request.sid)
+    if slot is not None:
+        liveness.touch(slot)
+        return
+
+    # جلسة غير مسجلة (مثلاً بعد إعادة الاتصال دون join)
     room_id = str(data['room_id'])
     username = data['username']
     
     # إذا كان اللاعب في قائمة المنقطعين، نزيله منها لأنه أرسل نبضة
-    if (room_id, username) in disconnected_players:
+    if presence.clear_disconnected(room_id, username):
         print(f"💓 استلام نبضة من اللاعب {username} في الغرفة {room_id} - إعادة الاتصال")
-        del disconnected_players[(room_id, username)]
+        grace_timers.cancel((room_id, username))
     else:
         print(f"💓 استلام نبضة من اللاعب {username} في الغرفة {room_id}")
         
     # تحديث معرف الجلسة في حالة تغيره
-    player_sessions[request.sid] = (room_id, username)
+    presence.set_session(request.sid, room_id, username)
+    liveness.register(request.sid)
 
 # تشغيل الخادم
 if __name__ == '__main__':
     # تشغيل مهمة مجدولة لتنظيف الاتصالات غير النشطة واللاعبين المنقطعين
     def check_inactive_connections():
         current_time = time.time()
-        print(f"🔍 فحص الاتصالات غير النشطة - {len(player_sessions)} اتصال نشط، {len(disconnected_players)} اتصال منقطع")
+        counts = presence.counts()
+        print(f"🔍 فحص الاتصالات غير النشطة - {counts['sessions']} اتصال نشط، {counts['disconnected']} اتصال منقطع")
         
         # تنظيف قاعدة البيانات من الغرف الفارغة
         cleanup_empty_rooms()
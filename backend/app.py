@@ -12,9 +12,13 @@ from routes.friends import friends_bp
 import requests
 import logging
 from sqlalchemy import func
-from datetime import datetime, timedelta
-import threading
-import queue
+from datetime import datetime, UTC
+import atexit
+from services.chat_buffer import ChatWriteBuffer
+from services.lobby import lobby, LOBBY_ROOM
+from services.broadcast import BroadcastPipeline
+from services.players_cache import players_cache
+from services.db_writer import db_writer, configure_sqlite
 
 # إعداد السجلات
 logging.basicConfig(level=logging.INFO)
@@ -32,25 +36,25 @@ CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 # Initialize Database
 db.init_app(app)
 
+# WAL and tuned pragmas on every SQLite connection; write transactions go through one writer thread
+with app.app_context():
+    configure_sqlite(db.engine)
+db_writer.init_app(app)
+
 # Enable WebSocket with async mode
 socketio = SocketIO(app, cors_allowed_origins="*", logger=True, async_mode='gevent')
 
-# Message queue for broadcasting
-message_queue = queue.Queue()
-
-def broadcast_worker():
-    """Worker thread for handling broadcasts"""
-    while True:
-        try:
-            event, data = message_queue.get()
-            socketio.emit(event, data)
-            message_queue.task_done()
-        except Exception as e:
-            logger.error(f"Error in broadcast worker: {e}")
+# Batched broadcast pipeline running as greenlets under the gevent async mode
+broadcaster = BroadcastPipeline(
+    socketio,
+    max_pending=int(os.getenv('BROADCAST_MAX_PENDING', '10000')),
+    emitters=int(os.getenv('BROADCAST_EMITTERS', '2')),
+    tick=float(os.getenv('BROADCAST_TICK', '0.05'))
+)
+broadcaster.start()
 
-# Start broadcast worker thread
-broadcast_thread = threading.Thread(target=broadcast_worker, daemon=True)
-broadcast_thread.start()
+# Lobby updates go through the broadcast pipeline
+lobby.init_app(broadcaster.publish)
 
 def initialize_database():
     db_path = os.path.join('dbdata', 'app.db')
@@ -69,27 +73,14 @@ app.register_blueprint(auth_bp)
 app.register_blueprint(rooms_bp)
 app.register_blueprint(friends_bp, url_prefix='/friends')
 
-# Cache for room players
-room_players_cache = {}
-CACHE_TIMEOUT = 5  # seconds
+def load_players_for_room(room_id):
+    """Query the players of a room from the database"""
+    players = RoomPlayer.query.filter_by(room_id=room_id).all()
+    return [p.player_username for p in players]
 
 def get_players_for_room(room_id):
-    """Get players for a room with caching"""
-    current_time = datetime.now()
-    cache_key = str(room_id)
-    
-    if cache_key in room_players_cache:
-        cache_time, players = room_players_cache[cache_key]
-        if current_time - cache_time < timedelta(seconds=CACHE_TIMEOUT):
-            return players
-    
-    # If not in cache or cache expired, query database
-    players = RoomPlayer.query.filter_by(room_id=room_id).all()
-    player_list = [p.player_username for p in players]
-    
-    # Update cache
-    room_players_cache[cache_key] = (current_time, player_list)
-    return player_list
+    """Get players for a room from the membership cache"""
+    return players_cache.get(room_id, load_players_for_room)
 
 @socketio.on('join')
 def handle_join(data):
@@ -106,38 +97,27 @@ def handle_join(data):
             return {'error': 'Room not found'}
             
         # التحقق من امتلاء الغرفة
-        current_players = len(get_players_for_room(room_id))
+        players = get_players_for_room(room_id)
+        current_players = len(players)
         if current_players >= room.max_players:
             logger.error(f"Room {room_id} is full")
             return {'error': 'Room is full'}
         
         # التحقق من وجود اللاعب (باستثناء المالك)
-        if room.owner_username != username:
-            existing_player = RoomPlayer.query.filter_by(
-                room_id=room_id,
-                player_username=username
-            ).first()
-            
-            if existing_player:
-                logger.error(f"Player {username} already exists in room {room_id}")
-                return {'error': 'Player already in room'}
+        already_in_room = username in players
+        if room.owner_username != username and already_in_room:
+            logger.error(f"Player {username} already exists in room {room_id}")
+            return {'error': 'Player already in room'}
         
-        # إنشاء لاعب جديد إذا لم يكن موجوداً
-        if not RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first():
-            new_player = RoomPlayer(
-                room_id=room_id,
-                player_username=username,
-                is_host=(room.owner_username == username),
-                username=username
-            )
-            db.session.add(new_player)
+        # إنشاء لاعب جديد إذا لم يكن موجوداً (في خيط الكاتب)
+        if not already_in_room:
+            if not db_writer.run(add_player_transaction, room_id, username):
+                logger.error(f"Room {room_id} is full or was deleted")
+                return {'error': 'Room is full'}
             
-            # تحديث عدد اللاعبين
-            room.current_players = current_players + 1
-            db.session.commit()
-            
-            # مسح التخزين المؤقت
-            room_players_cache.pop(str(room_id), None)
+            # تحديث التخزين المؤقت
+            players_cache.add(room_id, username)
+            lobby.notify_room(room_id)
             
             logger.info(f"Player {username} successfully joined room {room_id}")
         
@@ -155,109 +135,158 @@ def handle_join(data):
         db.session.rollback()
         return {'error': str(e)}
 
+def add_player_transaction(room_id, username):
+    """Add a player to a room without a VPN user (runs on the writer thread)
+
+    Returns False when the room was deleted or filled up since the caller checked it.
+    """
+    room = Room.query.get(room_id)
+    if not room:
+        return False
+    players_count = RoomPlayer.query.filter_by(room_id=room_id).count()
+    if players_count >= room.max_players:
+        return False
+    db.session.add(RoomPlayer(
+        room_id=room_id,
+        player_username=username,
+        is_host=(room.owner_username == username),
+        username=username
+    ))
+    # تحديث عدد اللاعبين
+    room.current_players = players_count + 1
+    return True
+
+def leave_player_transaction(room_id, username):
+    """Remove a player, handing the host role to the next player or deleting the room
+    when the host was alone (runs on the writer thread)
+
+    Returns None when the player is not in the room, otherwise what the caller still has
+    to do outside the transaction (VPN cleanup and notifications).
+    """
+    player = RoomPlayer.query.filter_by(room_id=room_id, player_username=username).first()
+    room = Room.query.get(room_id) if player else None
+    if not room:
+        return None
+    result = {'vpn_username': player.username, 'new_host': None, 'room_closed': False}
+
+    # إذا كان اللاعب هو المالك، نقوم بنقل الملكية للاعب التالي
+    if player.is_host:
+        next_player = RoomPlayer.query.filter(
+            RoomPlayer.room_id == room_id,
+            RoomPlayer.player_username != username
+        ).order_by(RoomPlayer.joined_at.asc()).first()
+
+        if not next_player:
+            # إذا لم يكن هناك لاعبين آخرين، نقوم بحذف الغرفة
+            delete_room_transaction(room_id)
+            result['room_closed'] = True
+            return result
+
+        next_player.is_host = True
+        room.owner_username = next_player.player_username
+        result['new_host'] = next_player.player_username
+
+    # حذف اللاعب المغادر
+    db.session.delete(player)
+    room.current_players = max(0, room.current_players - 1)
+    return result
+
 @socketio.on('leave')
 def handle_leave(data):
     try:
         room_id = str(data['room_id'])
         username = data['username']
-        
-        player = RoomPlayer.query.filter_by(
-            room_id=room_id,
-            player_username=username
-        ).first()
-        
-        if player:
-            is_host = player.is_host
-            vpn_username = player.username
-            room = Room.query.get(room_id)
-            
-            if room:
-                # إذا كان اللاعب هو المالك، نقوم بنقل الملكية للاعب التالي
-                if is_host:
-                    # البحث عن اللاعب التالي
-                    next_player = RoomPlayer.query.filter(
-                        RoomPlayer.room_id == room_id,
-                        RoomPlayer.player_username != username
-                    ).order_by(RoomPlayer.joined_at.asc()).first()
-                    
-                    if next_player:
-                        # نقل الملكية للاعب التالي
-                        next_player.is_host = True
-                        room.owner_username = next_player.player_username
-                        db.session.commit()
-                        
-                        # إرسال إشعار بنقل الملكية
-                        emit('host_changed', {
-                            'new_host': next_player.player_username
-                        }, room=room_id)
-                        
-                        logger.info(f"Room ownership transferred to {next_player.player_username}")
-                    else:
-                        # إذا لم يكن هناك لاعبين آخرين، نقوم بحذف الغرفة
-                        cleanup_room(room_id, username)
-                        emit('room_closed', {'room_id': room_id}, broadcast=True)
-                        return {'status': 'success', 'room_closed': True}
-                
-                # حذف اللاعب المغادر
-                db.session.delete(player)
-                room.current_players = max(0, room.current_players - 1)
-                
-                # حذف مستخدم VPN
-                hub_name = f"room_{room_id}"
-                try:
-                    from services.softether import SoftEtherVPN
-                    vpn = SoftEtherVPN()
-                    vpn.delete_user(hub_name, vpn_username)
-                except Exception as e:
-                    logger.error(f"Error deleting VPN user: {e}")
-                
-                db.session.commit()
-                
-                # إرسال إشعارات للاعبين الآخرين
-                leave_room(room_id)
-                emit('user_left', {'username': username}, room=room_id)
-                
-                # تحديث قائمة اللاعبين
-                players = get_players_for_room(room_id)
-                emit('update_players', {'players': players}, room=room_id)
-            
+
+        result = db_writer.run(leave_player_transaction, room_id, username)
+        if result is None:
             return {'status': 'success', 'room_closed': False}
-            
-    except Exception as e:
-        logger.error(f"Error in handle_leave: {e}")
-        db.session.rollback()
-        return {'error': str(e)}
 
-def cleanup_room(room_id, username):
-    """تنظيف موارد الغرفة"""
-    try:
-        # حذف جميع اللاعبين
-        RoomPlayer.query.filter_by(room_id=room_id).delete()
-        
-        # حذف جميع الرسائل
-        ChatMessage.query.filter_by(room_id=room_id).delete()
-        
-        # حذف الغرفة
-        room = Room.query.get(room_id)
-        if room:
-            db.session.delete(room)
-        
-        # حذف هاب VPN
+        # أوامر VPN تُنفذ بعد حفظ التغييرات حتى لا تبقى معاملة الكتابة مفتوحة أثناءها
         hub_name = f"room_{room_id}"
+        if result['room_closed']:
+            delete_room_hub(hub_name)
+            players_cache.invalidate(room_id)
+            emit('room_closed', {'room_id': room_id}, room=room_id)
+            lobby.notify_room(room_id)
+            return {'status': 'success', 'room_closed': True}
+
+        if result['new_host']:
+            # إرسال إشعار بنقل الملكية
+            emit('host_changed', {
+                'new_host': result['new_host']
+            }, room=room_id)
+            logger.info(f"Room ownership transferred to {result['new_host']}")
+
+        # حذف مستخدم VPN
         try:
             from services.softether import SoftEtherVPN
             vpn = SoftEtherVPN()
-            vpn.delete_hub(hub_name)
+            vpn.delete_user(hub_name, result['vpn_username'])
         except Exception as e:
-            logger.error(f"Error deleting VPN hub: {e}")
-        
-        db.session.commit()
-        logger.info(f"Room {room_id} cleaned up successfully")
-        
+            logger.error(f"Error deleting VPN user: {e}")
+
+        players_cache.remove(room_id, username)
+        lobby.notify_room(room_id)
+
+        # إرسال إشعارات للاعبين الآخرين
+        leave_room(room_id)
+        emit('user_left', {'username': username}, room=room_id)
+
+        # تحديث قائمة اللاعبين
+        players = get_players_for_room(room_id)
+        emit('update_players', {'players': players}, room=room_id)
+
+        return {'status': 'success', 'room_closed': False}
+
     except Exception as e:
-        logger.error(f"Error cleaning up room {room_id}: {e}")
-        db.session.rollback()
-        raise
+        logger.error(f"Error in handle_leave: {e}")
+        return {'error': str(e)}
+
+def delete_room_transaction(room_id):
+    """Delete a room with its players and chat messages (runs on the writer thread)"""
+    # حذف جميع اللاعبين
+    RoomPlayer.query.filter_by(room_id=room_id).delete()
+
+    # حذف جميع الرسائل
+    ChatMessage.query.filter_by(room_id=room_id).delete()
+
+    # حذف الغرفة
+    room = Room.query.get(room_id)
+    if room:
+        db.session.delete(room)
+
+def delete_room_hub(hub_name):
+    """حذف هاب VPN بعد حفظ حذف الغرفة"""
+    try:
+        from services.softether import SoftEtherVPN
+        vpn = SoftEtherVPN()
+        vpn.delete_hub(hub_name)
+    except Exception as e:
+        logger.error(f"Error deleting VPN hub: {e}")
+
+def insert_chat_messages(rows):
+    """Insert a batch of chat messages (runs on the writer thread as one transaction)"""
+    # Skip messages for rooms deleted before the batch was flushed
+    room_ids = {row['room_id'] for row in rows}
+    existing = {room_id for (room_id,) in db.session.query(Room.id).filter(Room.id.in_(room_ids))}
+    rows = [row for row in rows if row['room_id'] in existing]
+    if rows:
+        db.session.bulk_insert_mappings(ChatMessage, rows)
+
+def persist_chat_messages(rows):
+    """Write a batch of chat messages (called from the buffer thread)"""
+    db_writer.run(insert_chat_messages, rows)
+
+# Chat messages are broadcast immediately and persisted in batches
+chat_buffer = ChatWriteBuffer(
+    persist_chat_messages,
+    max_batch=int(os.getenv('CHAT_FLUSH_BATCH', '100')),
+    flush_interval=float(os.getenv('CHAT_FLUSH_INTERVAL', '0.5')),
+    max_queue=int(os.getenv('CHAT_BUFFER_SIZE', '10000'))
+)
+# atexit runs in reverse order: the chat buffer drains into the writer before the writer stops
+atexit.register(db_writer.close)
+atexit.register(chat_buffer.close)
 
 @socketio.on('send_message')
 def handle_send_message(data):
@@ -274,29 +303,20 @@ def handle_send_message(data):
         if not room:
             return {'error': 'Room not found'}
             
-        player = RoomPlayer.query.filter_by(
-            room_id=room_id,
-            player_username=username
-        ).first()
-        
-        if not player:
+        if username not in get_players_for_room(room_id):
             return {'error': 'Player not in room'}
         
-        # Create message
-        msg = ChatMessage(
-            room_id=room_id,
-            username=username,
-            message=message
-        )
-        db.session.add(msg)
-        db.session.commit()
+        # Queue message for write-behind persistence
+        created_at = datetime.now(UTC)
+        if not chat_buffer.submit({'room_id': int(room_id), 'username': username,
+                                   'message': message, 'created_at': created_at}):
+            return {'error': 'Server is busy, message not sent'}
         
         # Broadcast message
         emit('new_message', {
-            'id': msg.id,
-            'username': msg.username,
-            'message': msg.message,
-            'created_at': msg.created_at.isoformat()
+            'username': username,
+            'message': message,
+            'created_at': created_at.isoformat()
         }, room=room_id)
         
         return {'status': 'success'}
@@ -306,30 +326,31 @@ def handle_send_message(data):
         db.session.rollback()
         return {'error': str(e)}
 
-def broadcast_rooms_update():
-    """Broadcast rooms update to all connected clients"""
+def send_lobby_snapshot():
+    """Send the full room list to the requesting client only"""
     try:
-        rooms = Room.query.all()
-        rooms_data = [{
-            'room_id': room.id,
-            'name': room.name,
-            'owner': room.owner_username,
-            'description': room.description,
-            'is_private': room.is_private,
-            'max_players': room.max_players,
-            'current_players': room.current_players
-        } for room in rooms]
-        
-        message_queue.put(('rooms_updated', {'rooms': rooms_data}))
-        
+        emit('rooms_updated', {'rooms': lobby.snapshot()}, room=request.sid)
     except Exception as e:
-        logger.error(f"Error in broadcast_rooms_update: {e}")
+        logger.error(f"Error in send_lobby_snapshot: {e}")
 
 @socketio.on('connect')
 def handle_connect():
     """Handle new client connection"""
     logger.info("Client connected")
-    broadcast_rooms_update()
+    # New clients start in the lobby with one snapshot; later changes arrive as room_changed / room_removed
+    join_room(LOBBY_ROOM)
+    send_lobby_snapshot()
+
+@socketio.on('subscribe_lobby')
+def handle_subscribe_lobby(data=None):
+    """Resume lobby updates (e.g. after leaving a game room)"""
+    join_room(LOBBY_ROOM)
+    send_lobby_snapshot()
+
+@socketio.on('unsubscribe_lobby')
+def handle_unsubscribe_lobby(data=None):
+    """Stop lobby updates while the client is inside a game room"""
+    leave_room(LOBBY_ROOM)
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -358,12 +379,7 @@ def handle_check_player(data):
             return {'exists': False}
         
         # التحقق من وجود اللاعب في الغرفة
-        player = RoomPlayer.query.filter_by(
-            room_id=room_id,
-            player_username=username
-        ).first()
-        
-        exists = player is not None
+        exists = username in get_players_for_room(room_id)
         logger.info(f"Player {username} exists in room {room_id}: {exists}")
         return {'exists': exists}
         
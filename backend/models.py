@@ -40,8 +40,8 @@ class User(db.Model):
 # نموذج علاقات الصداقة
 class Friendship(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
-    friend_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    friend_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.String(20), default='pending')  # 'pending', 'accepted', 'declined'
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
@@ -50,9 +50,12 @@ class Friendship(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('sent_requests', lazy='dynamic'))
     friend = db.relationship('User', foreign_keys=[friend_id], backref=db.backref('received_requests', lazy='dynamic'))
 
-    # ضمان عدم تكرار علاقات الصداقة
+    # ضمان عدم تكرار علاقات الصداقة، وفهرسان لقوائم الأصدقاء والطلبات حسب الحالة لكل طرف
+    # (يغنيان عن فهرسي user_id و friend_id المنفردين)
     __table_args__ = (
         db.UniqueConstraint('user_id', 'friend_id', name='unique_friendship'),
+        db.Index('ix_friendship_user_id_status', 'user_id', 'status'),
+        db.Index('ix_friendship_friend_id_status', 'friend_id', 'status'),
     )
     
 class Room(db.Model):
@@ -101,11 +104,16 @@ class ChatMessage(db.Model):
     __mapper_args__ = {'confirm_deleted_rows': False}
     
     id        = db.Column(db.Integer, primary_key=True)
-    room_id   = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False, index=True)
+    room_id   = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False)
     username  = db.Column(db.String(100), db.ForeignKey('user.username'), nullable=False, index=True)
     message   = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
 
+    # رسائل الغرفة مرتبة بالوقت (يغني عن فهرس room_id المنفرد)
+    __table_args__ = (
+        db.Index('ix_chat_message_room_id_created_at', 'room_id', 'created_at'),
+    )
+
     @staticmethod
     def validate_message(message):
         if not message or len(message.strip()) == 0:
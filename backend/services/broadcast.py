@@ -0,0 +1,116 @@
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastPipeline:
+    """Batched broadcast pipeline running on the server's async mode (greenlets under gevent)
+
+    Events published within one tick are grouped per target room and handed to a
+    fixed set of emitter tasks (one target always maps to the same emitter, so
+    per-room ordering is kept). Events published with the same key replace the
+    pending one, so only the latest snapshot of something is sent. The number of
+    pending events is bounded; publishes beyond it are dropped and counted.
+    """
+
+    def __init__(self, socketio, max_pending=10000, emitters=2, emitter_queue_size=100, tick=0.05):
+        self.socketio = socketio
+        self.max_pending = max_pending
+        self.emitters = emitters
+        self.emitter_queue_size = emitter_queue_size
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._queues = []
+
+        # Stats
+        self.published = 0
+        self.superseded = 0
+        self.overflow = 0
+        self.emitted = 0
+        self.failed = 0
+        self.batches = 0
+        self._reported_overflow = 0
+
+    def start(self):
+        """Start the dispatcher and emitter tasks using the server's async mode"""
+        if self._wakeup is not None:
+            return
+        eio = self.socketio.server.eio
+        self._wakeup = eio.create_event()
+        self._queues = [eio.create_queue(self.emitter_queue_size) for _ in range(self.emitters)]
+        self.socketio.start_background_task(self._dispatch)
+        for emitter_queue in self._queues:
+            self.socketio.start_background_task(self._emit_loop, emitter_queue)
+
+    def publish(self, event, data, room=None, key=None):
+        """Queue an event for broadcast; returns False when it was dropped due to overflow"""
+        with self._lock:
+            if key is not None and key in self._pending:
+                # Superseded: keep only the newest payload, at the newest position
+                del self._pending[key]
+                self.superseded += 1
+            elif len(self._pending) >= self.max_pending:
+                self.overflow += 1
+                return False
+            else:
+                key = key if key is not None else next(self._seq)
+            self._pending[key] = (event, data, room)
+            self.published += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def _dispatch(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Let one tick's worth of events accumulate before grouping them
+            self.socketio.sleep(self.tick)
+
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+                overflow = self.overflow
+
+            if overflow != self._reported_overflow:
+                logger.warning(f"Broadcast queue overflow: {overflow - self._reported_overflow} events dropped "
+                               f"(limit {self.max_pending})")
+                self._reported_overflow = overflow
+
+            by_room = OrderedDict()
+            for event, data, room in pending.values():
+                by_room.setdefault(room, []).append((event, data))
+
+            for room, events in by_room.items():
+                # Blocks when the emitter is behind, which lets pending events back up to the bound
+                self._queues[hash(room) % len(self._queues)].put((room, events))
+                self.batches += 1
+
+    def _emit_loop(self, emitter_queue):
+        while True:
+            room, events = emitter_queue.get()
+            for event, data in events:
+                try:
+                    self.socketio.emit(event, data, room=room)
+                    self.emitted += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Error broadcasting {event} to {room}: {e}")
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'published': self.published,
+            'superseded': self.superseded,
+            'overflow': self.overflow,
+            'emitted': self.emitted,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
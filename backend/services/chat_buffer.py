@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ChatWriteBuffer:
+    """حفظ رسائل الدردشة في الخلفية: الرسائل تُبث فوراً وتُكتب في قاعدة البيانات على دفعات
+
+    الدفعة تُكتب عند بلوغ max_batch رسالة أو بعد flush_interval ثانية من أول رسالة فيها.
+    الطابور محدود، وعند امتلائه ترفض submit الرسالة حتى يبلغ المرسل بالضغط بدلاً من نمو الذاكرة.
+    """
+
+    def __init__(self, write_batch, max_batch=100, flush_interval=0.5, max_queue=10000,
+                 max_retries=3, name="chat-write-buffer"):
+        # write_batch(rows) تكتب قائمة قواميس الرسائل في معاملة واحدة
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+        # إحصائيات
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, row):
+        """إضافة رسالة للحفظ، ويعيد False إذا كان الطابور ممتلئاً أو الخدمة متوقفة"""
+        if self._closed:
+            self.rejected += 1
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.rejected += 1
+            logger.warning(f"{self.name} is full ({self._queue.maxsize} messages), rejecting message")
+            return False
+        self.accepted += 1
+        return True
+
+    @property
+    def backpressure(self):
+        """نسبة امتلاء الطابور بين 0 و 1"""
+        return self._queue.qsize() / self._queue.maxsize if self._queue.maxsize else 0.0
+
+    def _collect_batch(self):
+        """انتظار أول رسالة ثم جمع ما يصل حتى امتلاء الدفعة أو انقضاء المهلة"""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.write_batch(batch)
+                self.written += len(batch)
+                self.batches += 1
+                self.last_flush_seconds = time.monotonic() - started
+                return
+            except Exception as e:
+                logger.error(f"{self.name} failed to write {len(batch)} messages (attempt {attempt}): {e}")
+                if attempt < self.max_retries:
+                    time.sleep(0.5 * attempt)
+        self.failed += len(batch)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+        # تفريغ ما تبقى في الطابور قبل التوقف
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.max_batch):
+            self._flush(remaining[start:start + self.max_batch])
+
+    def close(self, timeout=10):
+        """إيقاف استقبال الرسائل وانتظار كتابة كل ما في الطابور"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        # الطابور قد يكون ممتلئاً، فننتظر مكاناً لعلامة التوقف
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error(f"{self.name} could not signal shutdown, {self._queue.qsize()} messages may be lost")
+            return
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"{self.name} did not finish draining within {timeout}s")
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "backpressure": self.backpressure,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
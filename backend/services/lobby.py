@@ -0,0 +1,56 @@
+import logging
+from models import Room
+
+logger = logging.getLogger(__name__)
+
+# Socket.IO room for clients browsing the room list
+LOBBY_ROOM = 'lobby'
+
+
+def room_to_dict(room):
+    """Room as shown in the lobby list"""
+    return {
+        'room_id': room.id,
+        'name': room.name,
+        'owner': room.owner_username,
+        'description': room.description,
+        'is_private': room.is_private,
+        'max_players': room.max_players,
+        'current_players': room.current_players
+    }
+
+
+class LobbyChannel:
+    """Incremental room list updates for lobby subscribers
+
+    New subscribers get one full snapshot sent only to them; after that they
+    receive room_changed / room_removed events for the rooms that changed.
+    """
+
+    def __init__(self):
+        self._emit = None
+
+    def init_app(self, emit):
+        # emit(event, data, room, key) delivers an event to a Socket.IO room;
+        # a newer event with the same key supersedes one that is still pending
+        self._emit = emit
+
+    def snapshot(self):
+        return [room_to_dict(room) for room in Room.query.all()]
+
+    def notify_room(self, room_id):
+        """Publish the current state of a room after its changes were committed"""
+        if self._emit is None:
+            return
+        try:
+            room = Room.query.get(room_id)
+            key = ('lobby_room', int(room_id))
+            if room:
+                self._emit('room_changed', {'room': room_to_dict(room)}, LOBBY_ROOM, key)
+            else:
+                self._emit('room_removed', {'room_id': int(room_id)}, LOBBY_ROOM, key)
+        except Exception as e:
+            logger.error(f"Error publishing lobby update for room {room_id}: {e}")
+
+
+lobby = LobbyChannel()
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class RoomPlayersCache:
+    """ذاكرة مؤقتة محدودة (LRU) لأسماء لاعبي كل غرفة تُحدّث مع كل تغيير في العضوية بدلاً من مدة صلاحية
+
+    كل عملية تغير العضوية يجب أن تستدعي add أو remove أو invalidate بعد حفظها في قاعدة البيانات.
+    """
+
+    def __init__(self, max_rooms=1024):
+        self.max_rooms = max_rooms
+        self._lock = threading.Lock()
+        # room_id -> {username: None} (قاموس للحفاظ على ترتيب الانضمام مع بحث O(1))
+        self._rooms = OrderedDict()
+        # room_id -> هل تغيرت العضوية أثناء التحميل
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, room_id, load):
+        """أسماء لاعبي الغرفة، مع تحميلها عبر load(room_id) عند عدم وجودها"""
+        room_id = str(room_id)
+        with self._lock:
+            players = self._rooms.get(room_id)
+            if players is not None:
+                self._rooms.move_to_end(room_id)
+                self.hits += 1
+                return list(players)
+            self.misses += 1
+            self._loading.setdefault(room_id, False)
+
+        loaded = load(room_id)
+        with self._lock:
+            # إذا تغيرت العضوية أثناء التحميل فقد تكون النتيجة قديمة، فلا نخزنها
+            changed = self._loading.pop(room_id, True)
+            if not changed and room_id not in self._rooms:
+                self._rooms[room_id] = dict.fromkeys(loaded)
+                while len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+                    self.evictions += 1
+        return list(loaded)
+
+    def contains(self, room_id, username, load):
+        return username in self.get(room_id, load)
+
+    def _mark_changed(self, room_id):
+        if room_id in self._loading:
+            self._loading[room_id] = True
+
+    def add(self, room_id, username):
+        room_id = str(room_id)
+        with self._lock:
+            self._mark_changed(room_id)
+            players = self._rooms.get(room_id)
+            if players is not None:
+                players[username] = None
+
+    def remove(self, room_id, username):
+        room_id = str(room_id)
+        with self._lock:
+            self._mark_changed(room_id)
+            players = self._rooms.get(room_id)
+            if players is not None:
+                players.pop(username, None)
+
+    def invalidate(self, room_id):
+        room_id = str(room_id)
+        with self._lock:
+            self._mark_changed(room_id)
+            self._rooms.pop(room_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"rooms": len(self._rooms), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# Shared by the Socket.IO handlers in app.py and the HTTP routes in routes/rooms.py
+players_cache = RoomPlayersCache(max_rooms=int(os.getenv('PLAYERS_CACHE_ROOMS', '1024')))
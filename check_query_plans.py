@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+سكريبت للتحقق من أن استعلامات المسارات تستخدم الفهارس: يملأ قاعدة SQLite في الذاكرة ببيانات
+بأحجام واقعية ويفشل (رمز خروج 1) إذا مسح أي استعلام جدولاً كاملاً أو احتاج ترتيباً مؤقتاً
+"""
+import sys
+from flask import Flask
+from models import db
+from database.query_plans import seed, check_query_plans, hot_queries, aggregate_queries
+
+if __name__ == "__main__":
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        print(f"بدء ملء قاعدة البيانات التجريبية (scale={scale})...")
+        seed(db.session, scale)
+        failures = check_query_plans(db.session)
+
+    for name, plan in failures:
+        print(f"❌ {name}:")
+        for step in plan:
+            print(f"    {step}")
+    total = len(hot_queries()) + len(aggregate_queries())
+    print(f"{total - len(failures)}/{total} استعلام يستخدم الفهارس")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,39 @@
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask import current_app
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect, text
+
+# أول مراجعة في migrations/versions: المخطط كما كان قبل إضافة الترحيلات إلى المستودع
+BASELINE_REVISION = "95a1492a607e"
+
+
+def upgrade_database(db):
+    """تجهيز مخطط قاعدة البيانات عند التشغيل (داخل app context)، ويعيد ما تم: created أو upgraded أو None
+
+    - قاعدة فارغة: create_all ثم ختمها بآخر مراجعة.
+    - قاعدة بدون سجل مراجعات أو بمراجعة غير موجودة هنا (أنشأها create_all أو flask db migrate داخل
+      الحاوية سابقاً): تُختم بالمراجعة الأساسية ثم تُرقى. المراجعات اللاحقة تتحقق مما هو موجود قبل إضافته.
+    - قاعدة قديمة بمراجعة معروفة: ترقية إلى آخر مراجعة.
+    """
+    script = ScriptDirectory.from_config(current_app.extensions['migrate'].migrate.get_config())
+    with db.engine.connect() as conn:
+        tables = set(inspect(conn).get_table_names()) - {"alembic_version"}
+        current = MigrationContext.configure(conn).get_current_revision()
+
+    if not tables:
+        db.create_all()
+        stamp(revision="head")
+        return "created"
+
+    if current not in {revision.revision for revision in script.walk_revisions()}:
+        with db.engine.begin() as conn:
+            if current is not None:
+                conn.execute(text("DELETE FROM alembic_version"))
+        stamp(revision=BASELINE_REVISION)
+        current = BASELINE_REVISION
+
+    if current != script.get_current_head():
+        upgrade()
+        return "upgraded"
+    return None
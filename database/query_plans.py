@@ -0,0 +1,145 @@
+import random
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, delete, exists, or_, and_, text
+from models import User, Friendship, Room, RoomPlayer, ChatMessage, ChatPurge
+
+# أحجام البيانات التجريبية (تقريب لقاعدة بيانات إنتاج نشطة)
+SEED_USERS = 20000
+SEED_FRIENDSHIPS = 60000
+SEED_ROOMS = 2000
+SEED_ROOM_PLAYERS = 10000
+SEED_CHAT_MESSAGES = 200000
+
+# خطوات الخطة المقبولة: البحث بفهرس أو بالمفتاح الأساسي فقط، دون مسح جدول أو ترتيب مؤقت
+_BAD_PLAN = re.compile(r"^SCAN |USE TEMP B-TREE")
+# طابور الحذف صغير ويُقرأ أوله فقط بترتيب المفتاح الأساسي (LIMIT 1)، فمسحه لا يحتاج فهرساً
+_QUEUE_SCAN = re.compile(r"^SCAN chat_purge$")
+# استعلامات الخلفية التجميعية تمر على كل الغرف، فيكفي أن تقرأ فهرساً يغطيها بدلاً من الجدول
+_UNCOVERED_PLAN = re.compile(r"^SCAN (?!.*COVERING INDEX)|USE TEMP B-TREE")
+
+
+def seed(session, scale=1.0, rng=None):
+    """ملء قاعدة البيانات (الفارغة) ببيانات عشوائية بالأحجام أعلاه مضروبة في scale"""
+    rng = rng or random.Random(42)
+    users = int(SEED_USERS * scale)
+    rooms = int(SEED_ROOMS * scale)
+    now = datetime.utcnow()
+
+    session.bulk_insert_mappings(User, [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"}
+        for i in range(1, users + 1)
+    ])
+
+    pairs = set()
+    while len(pairs) < int(SEED_FRIENDSHIPS * scale):
+        user_id, friend_id = rng.randint(1, users), rng.randint(1, users)
+        if user_id != friend_id and (friend_id, user_id) not in pairs:
+            pairs.add((user_id, friend_id))
+    session.bulk_insert_mappings(Friendship, [
+        {"user_id": user_id, "friend_id": friend_id, "status": rng.choice(("pending", "accepted", "accepted", "declined"))}
+        for user_id, friend_id in pairs
+    ])
+
+    session.bulk_insert_mappings(Room, [
+        {"id": i, "name": f"room {i}", "owner_username": f"user{i}@example.com", "description": ""}
+        for i in range(1, rooms + 1)
+    ])
+    players = rng.sample(range(1, users + 1), min(int(SEED_ROOM_PLAYERS * scale), users))
+    session.bulk_insert_mappings(RoomPlayer, [
+        {"room_id": rng.randint(1, rooms), "player_username": f"user{user_id}@example.com",
+         "username": f"user{user_id}", "is_host": False}
+        for user_id in players
+    ])
+
+    session.bulk_insert_mappings(ChatMessage, [
+        {"room_id": rng.randint(1, rooms), "sender": f"user{rng.randint(1, users)}", "message": "hello",
+         "timestamp": now - timedelta(seconds=n)}
+        for n in range(int(SEED_CHAT_MESSAGES * scale))
+    ])
+    session.commit()
+    # إحصائيات الفهارس التي يعتمد عليها مخطط الاستعلامات
+    session.execute(text("ANALYZE"))
+
+
+def hot_queries():
+    """استعلامات المسارات ومعالجات Socket.IO ومهام الخلفية بنفس شروطها، كـ (الاسم، الاستعلام)"""
+    players_count = func.count(RoomPlayer.id)
+    return [
+        ("user by email", select(User).where(User.email == "user7@example.com")),
+        ("user by username", select(User).where(User.username == "user7")),
+        ("friendship by id for receiver", select(Friendship).where(
+            Friendship.id == 5, Friendship.friend_id == 7, Friendship.status == "pending")),
+        ("friendship between two users", select(Friendship).where(or_(
+            and_(Friendship.user_id == 7, Friendship.friend_id == 9),
+            and_(Friendship.user_id == 9, Friendship.friend_id == 7)))),
+        ("accepted friends sent", select(Friendship).where(Friendship.user_id == 7, Friendship.status == "accepted")),
+        ("accepted friends received", select(Friendship).where(Friendship.friend_id == 7, Friendship.status == "accepted")),
+        ("pending requests received", select(Friendship).where(Friendship.friend_id == 7, Friendship.status == "pending")),
+        ("pending requests sent", select(Friendship).where(Friendship.user_id == 7, Friendship.status == "pending")),
+        ("room by id", select(Room).where(Room.id == 7)),
+        ("room by name", select(Room).where(Room.name == "room 7")),
+        ("rooms by ids", select(Room.id).where(Room.id.in_([1, 2, 3]))),
+        ("room players", select(RoomPlayer).where(RoomPlayer.room_id == 7)),
+        ("room player count", select(func.count()).select_from(RoomPlayer).where(RoomPlayer.room_id == 7)),
+        ("player membership", select(RoomPlayer).where(RoomPlayer.player_username == "user7@example.com")),
+        ("player in room", select(RoomPlayer).where(
+            RoomPlayer.room_id == 7, RoomPlayer.player_username == "user7@example.com")),
+        ("players by usernames", select(RoomPlayer).where(
+            RoomPlayer.player_username.in_(["user7@example.com", "user9@example.com"]))),
+        ("chat page", select(ChatMessage).where(ChatMessage.room_id == 7, ChatMessage.id < 100000)
+            .order_by(ChatMessage.id.desc()).limit(50)),
+        ("chat recent", select(ChatMessage).where(ChatMessage.room_id == 7).order_by(ChatMessage.id.desc()).limit(50)),
+        ("chat by time", select(ChatMessage).where(ChatMessage.room_id == 7)
+            .order_by(ChatMessage.timestamp.desc()).limit(50)),
+        ("chat delete for room", delete(ChatMessage).where(ChatMessage.room_id == 7)),
+        ("chat delete by ids", delete(ChatMessage).where(ChatMessage.id.in_([1, 2, 3]))),
+        # تنظيف الغرف الفارغة للغرف المتغيرة (clean_rooms في app.py)
+        ("cleanup changed rooms", select(Room.id, Room.current_players, players_count)
+            .outerjoin(RoomPlayer, RoomPlayer.room_id == Room.id).where(Room.id.in_([1, 2, 3]))
+            .group_by(Room.id, Room.current_players)
+            .having(or_(players_count == 0, players_count != Room.current_players))),
+        ("cleanup delete empty rooms", delete(Room).where(
+            Room.id.in_([1, 2, 3]), ~exists().where(RoomPlayer.room_id == Room.id))),
+        # أرشفة وحذف الرسائل في الخلفية (services/chat_retention.py)
+        ("purge schedule", select(ChatMessage.room_id, func.max(ChatMessage.id))
+            .where(ChatMessage.room_id.in_([1, 2, 3])).group_by(ChatMessage.room_id)),
+        ("purge next room", select(ChatPurge).order_by(ChatPurge.id).limit(1)),
+        ("purge chunk", select(ChatMessage.id).where(ChatMessage.room_id == 7, ChatMessage.id <= 100000).limit(500)),
+        ("retention expired chunk", select(ChatMessage).where(
+            ChatMessage.room_id == 7, ChatMessage.timestamp < datetime(2020, 1, 1))
+            .order_by(ChatMessage.timestamp).limit(500)),
+        ("retention room count", select(func.count()).select_from(ChatMessage).where(ChatMessage.room_id == 7)),
+        ("retention over cap chunk", select(ChatMessage).where(ChatMessage.room_id == 7)
+            .order_by(ChatMessage.id).limit(500)),
+    ]
+
+
+def aggregate_queries():
+    """استعلامات الخلفية التي تجمع كل الغرف، كـ (الاسم، الاستعلام)"""
+    count = func.count(ChatMessage.id)
+    oldest = func.min(ChatMessage.timestamp)
+    return [
+        ("retention candidate rooms", select(ChatMessage.room_id, count, oldest).group_by(ChatMessage.room_id)
+            .having(or_(count > 10000, oldest < datetime(2020, 1, 1)))),
+    ]
+
+
+def explain(session, statement):
+    """خطوات EXPLAIN QUERY PLAN في SQLite للاستعلام"""
+    sql = str(statement.compile(dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    return [row[3] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def check_query_plans(session):
+    """فحص خطط كل الاستعلامات، ويعيد قائمة (الاسم، الخطوات) للاستعلامات التي تمسح جدولاً أو ترتب مؤقتاً"""
+    failures = []
+    for name, statement in hot_queries():
+        plan = explain(session, statement)
+        if any(_BAD_PLAN.search(step) and not _QUEUE_SCAN.search(step) for step in plan):
+            failures.append((name, plan))
+    for name, statement in aggregate_queries():
+        plan = explain(session, statement)
+        if any(_UNCOVERED_PLAN.search(step) for step in plan):
+            failures.append((name, plan))
+    return failures
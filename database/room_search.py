@@ -0,0 +1,109 @@
+import re
+from sqlalchemy import text
+
+# فهرس البحث النصي الكامل للغرف (FTS5) مرتبط بجدول room كمحتوى خارجي
+ROOM_FTS_TABLE = "room_fts"
+
+_SETUP_STATEMENTS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS room_fts_after_insert AFTER INSERT ON room BEGIN
+        INSERT INTO {ROOM_FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS room_fts_after_delete AFTER DELETE ON room BEGIN
+        INSERT INTO {ROOM_FTS_TABLE}({ROOM_FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS room_fts_after_update AFTER UPDATE OF name, description ON room BEGIN
+        INSERT INTO {ROOM_FTS_TABLE}({ROOM_FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {ROOM_FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+# في PostgreSQL يُبحث في نفس الجدول بفهرس GIN على هذا التعبير بدلاً من جدول FTS5
+_PG_DOCUMENT = (
+    "(setweight(to_tsvector('simple', name), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B'))"
+)
+
+
+def setup_room_search(engine):
+    """إنشاء جدول FTS5 والمشغلات التي تبقيه متزامناً مع جدول room (آمنة للتكرار)"""
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_room_search ON room USING gin ({_PG_DOCUMENT})"))
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": ROOM_FTS_TABLE}
+        ).first()
+        if not exists:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {ROOM_FTS_TABLE} USING fts5("
+                "name, description, content='room', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            ))
+            # فهرسة الغرف الموجودة مسبقاً
+            conn.execute(text(f"INSERT INTO {ROOM_FTS_TABLE}({ROOM_FTS_TABLE}) VALUES ('rebuild')"))
+        for statement in _SETUP_STATEMENTS:
+            conn.execute(text(statement))
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """مرشح Alembic autogenerate: جدول FTS5 (وجداوله الداخلية room_fts_*) وفهرس GIN تُنشأ هنا وليست في
+    النماذج، فبدون هذا المرشح يقترح flask db migrate حذفها"""
+    if type_ == "table" and name.startswith(ROOM_FTS_TABLE):
+        return False
+    if type_ == "index" and name == "ix_room_search":
+        return False
+    return True
+
+
+def build_match_query(query):
+    """تحويل نص البحث إلى استعلام FTS5 يطابق بادئة كل كلمة، ويعيد None إذا لم يحتوِ على كلمات"""
+    terms = re.findall(r"\w+", query or "")
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_rooms(session, query, limit, offset):
+    """البحث في اسم ووصف الغرف مرتبة حسب الصلة، ويعيد (قائمة المعرفات، العدد الكلي)"""
+    if session.get_bind().dialect.name == "postgresql":
+        return _search_rooms_postgres(session, query, limit, offset)
+
+    match = build_match_query(query)
+    if match is None:
+        return [], 0
+
+    # bm25 يعطي قيماً أصغر للنتائج الأكثر صلة، مع وزن أكبر لاسم الغرفة من وصفها
+    rows = session.execute(text(
+        f"SELECT rowid FROM {ROOM_FTS_TABLE} WHERE {ROOM_FTS_TABLE} MATCH :match "
+        f"ORDER BY bm25({ROOM_FTS_TABLE}, 10.0, 1.0) LIMIT :limit OFFSET :offset"
+    ), {"match": match, "limit": limit, "offset": offset}).fetchall()
+    total = session.execute(text(
+        f"SELECT count(*) FROM {ROOM_FTS_TABLE} WHERE {ROOM_FTS_TABLE} MATCH :match"
+    ), {"match": match}).scalar()
+    return [row[0] for row in rows], total
+
+
+def _search_rooms_postgres(session, query, limit, offset):
+    """نفس البحث في PostgreSQL: مطابقة بادئة كل كلمة مع ترتيب ts_rank (وزن الاسم أكبر من الوصف)"""
+    terms = re.findall(r"\w+", query or "")
+    if not terms:
+        return [], 0
+    tsquery = " & ".join(f"{term}:*" for term in terms)
+
+    condition = f"{_PG_DOCUMENT} @@ to_tsquery('simple', :tsquery)"
+    rows = session.execute(text(
+        f"SELECT id FROM room WHERE {condition} "
+        f"ORDER BY ts_rank({_PG_DOCUMENT}, to_tsquery('simple', :tsquery)) DESC, id "
+        f"LIMIT :limit OFFSET :offset"
+    ), {"tsquery": tsquery, "limit": limit, "offset": offset}).fetchall()
+    total = session.execute(text(f"SELECT count(*) FROM room WHERE {condition}"), {"tsquery": tsquery}).scalar()
+    return [row[0] for row in rows], total
@@ -0,0 +1,36 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+# الإضافة مع تجاهل التعارض (ON CONFLICT) مدعومة بنفس الصيغة في SQLite وPostgreSQL
+_INSERT_BY_DIALECT = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def _insert_for(session, model):
+    dialect = session.get_bind().dialect.name
+    insert = _INSERT_BY_DIALECT.get(dialect)
+    if insert is None:
+        raise NotImplementedError(f"Upserts are not supported for the {dialect} dialect")
+    return insert(model)
+
+
+def insert_ignore(session, model, values, conflict_columns):
+    """إضافة صف إذا لم يوجد صف بنفس قيم القيد الفريد conflict_columns، ويعيد True إذا أضيف
+
+    العملية أمر واحد في قاعدة البيانات، فلا سباق بين التحقق من الوجود والإضافة كما في الاستعلام ثم add.
+    """
+    statement = _insert_for(session, model).values(**values).on_conflict_do_nothing(
+        index_elements=conflict_columns
+    )
+    return session.execute(statement).rowcount > 0
+
+
+def upsert(session, model, values, conflict_columns, update_columns):
+    """إضافة صف أو تحديث الأعمدة update_columns في الصف الموجود بنفس قيم conflict_columns"""
+    statement = _insert_for(session, model).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={column: statement.excluded[column] for column in update_columns}
+    )
+    session.execute(statement)
@@ -2,8 +2,12 @@
 import os
 import sys
 import ctypes
+import time
+import uuid
 import requests
 import subprocess
+import threading
+import socketio
 from PyQt5 import QtWidgets, uic, QtCore
 from PyQt5.QtWidgets import QMessageBox, QDialog, QInputDialog, QListWidgetItem, QMenu
 from PyQt5.QtGui import QTextCursor
@@ -29,20 +33,60 @@ if not is_admin():
 
 API_BASE_URL = "http://31.220.80.192:5000"  # رابط السيرفر
 
-class RoomLoader(QtCore.QThread):
+# إعادة محاولة طلبات الإنشاء والانضمام عند انقطاع الاتصال أو انشغال الخادم
+RETRY_ATTEMPTS = 3
+# 409: طلب سابق بنفس Idempotency-Key ما زال قيد التنفيذ
+RETRY_STATUSES = {409, 429, 502, 503, 504}
+
+
+def post_idempotent(url, payload, idempotency_key, attempts=RETRY_ATTEMPTS):
+    """POST مع إعادة المحاولة بنفس Idempotency-Key، فيعيد الخادم نتيجة المحاولة الأولى بدلاً من تكرارها"""
+    for attempt in range(attempts):
+        retry_after = None
+        try:
+            resp = requests.post(url, json=payload, headers={"Idempotency-Key": idempotency_key}, timeout=30)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == attempts - 1:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return resp
+            retry_after = resp.headers.get("Retry-After")
+        time.sleep(min(float(retry_after or 2 ** attempt), 10))
+
+class LobbyClient(QtCore.QObject):
+    """اشتراك في قناة lobby: قائمة كاملة عند الاشتراك ثم تحديثات الغرف التي تغيرت فقط"""
     rooms_loaded = QtCore.pyqtSignal(list)
-    def run(self):
-        while True:
-            try:
-                resp = requests.get(f"{API_BASE_URL}/rooms")
-                if resp.ok:
-                    self.rooms_loaded.emit(resp.json().get("rooms", []))
-                else:
-                    # طباعة خطأ إذا لم تكن الاستجابة ناجحة (مثل 404, 500)
-                    print(f"Error fetching rooms: Status {resp.status_code}, Response: {resp.text}") 
-            except Exception as e: # <-- التعديل هنا: التقاط الخطأ المحدد وطباعته
-                print(f"Exception in RoomLoader: {e}") # طباعة الخطأ الذي يحدث
-            self.sleep(5)
+    room_changed = QtCore.pyqtSignal(dict)
+    room_removed = QtCore.pyqtSignal(dict)
+
+    def __init__(self):
+        super().__init__()
+        self.socket = socketio.Client()
+        self.socket.on('rooms_updated', lambda data: self.rooms_loaded.emit(data.get('rooms', [])))
+        self.socket.on('room_changed', lambda data: self.room_changed.emit(data.get('room', {})))
+        self.socket.on('room_removed', lambda data: self.room_removed.emit(data))
+
+    def start(self):
+        # الاتصال في خيط منفصل حتى لا تتجمد الواجهة
+        threading.Thread(target=self._subscribe, daemon=True).start()
+
+    def _subscribe(self):
+        try:
+            if not self.socket.connected:
+                self.socket.connect(API_BASE_URL)
+            # الخادم يضيف الاتصال إلى lobby ويرسل القائمة كاملة لهذا العميل فقط
+            self.socket.emit('subscribe_lobby')
+        except Exception as e:
+            print(f"Exception in LobbyClient: {e}")
+
+    def pause(self):
+        """إيقاف التحديثات أثناء وجود المستخدم داخل غرفة"""
+        try:
+            if self.socket.connected:
+                self.socket.emit('unsubscribe_lobby')
+        except Exception as e:
+            print(f"Exception in LobbyClient: {e}")
 
 class MainApp(QtWidgets.QMainWindow):
     def __init__(self, user_data):
@@ -72,9 +116,11 @@ class MainApp(QtWidgets.QMainWindow):
         self.room_win = None
         self.last_rooms = []
 
-        self.loader = RoomLoader()
-        self.loader.rooms_loaded.connect(self.populate_rooms)
-        self.loader.start()
+        self.lobby = LobbyClient()
+        self.lobby.rooms_loaded.connect(self.on_rooms_loaded)
+        self.lobby.room_changed.connect(self.on_room_changed)
+        self.lobby.room_removed.connect(self.on_room_removed)
+        self.lobby.start()
 
     def translate_ui(self):
         """ترجمة عناصر واجهة المستخدم"""
@@ -85,6 +131,20 @@ class MainApp(QtWidgets.QMainWindow):
         self.btn_add_friend.setText(_("ui.main_window.add_friend", "➕ إضافة صديق"))
         self.btn_settings.setText(_("ui.main_window.settings", "⚙️ الإعدادات"))
 
+    def on_rooms_loaded(self, rooms):
+        self.last_rooms = rooms
+        self.populate_rooms(rooms)
+
+    def on_room_changed(self, room):
+        # استبدال الغرفة إذا كانت معروضة أو إضافتها
+        rooms = [r for r in self.last_rooms if r.get("room_id") != room.get("room_id")]
+        index = next((i for i, r in enumerate(self.last_rooms) if r.get("room_id") == room.get("room_id")), len(rooms))
+        rooms.insert(index, room)
+        self.on_rooms_loaded(rooms)
+
+    def on_room_removed(self, data):
+        self.on_rooms_loaded([r for r in self.last_rooms if r.get("room_id") != data.get("room_id")])
+
     def populate_rooms(self, rooms):
         for i in reversed(range(self.roomsLayout.count())):
             w = self.roomsLayout.itemAt(i).widget()
@@ -101,6 +161,8 @@ class MainApp(QtWidgets.QMainWindow):
         s = dlg.get_settings()
         if not s["name"]:
             return self.show_message("أدخل اسم الغرفة")
+        # مفتاح ثابت لهذه العملية حتى لا تنشئ إعادة المحاولة غرفة مكررة
+        idempotency_key = str(uuid.uuid4())
         
         payload = {
             "name":        s["name"],
@@ -116,7 +178,7 @@ class MainApp(QtWidgets.QMainWindow):
                 f.write(msg + "\n")
 
         try:
-            resp = requests.post(f"{API_BASE_URL}/create_room", json=payload)
+            resp = post_idempotent(f"{API_BASE_URL}/create_room", payload, idempotency_key)
             try:
                 resp.raise_for_status()
             except requests.exceptions.HTTPError as e:
@@ -137,6 +199,7 @@ class MainApp(QtWidgets.QMainWindow):
             "max_players": s["max_players"],
             "current_players": 1,
             "owner_username": self.user_data["username"],
+            "shard": data.get("shard"),
             "vpn_info": {
                 "hub": data["vpn_hub"],
                 "username": data["vpn_username"],
@@ -152,11 +215,13 @@ class MainApp(QtWidgets.QMainWindow):
     def join_room_direct(self, room):
         if room.get("is_private"):
             return self.show_message("هذه الغرفة خاصة")
+        # مفتاح واحد لكل نقرة انضمام تُعاد به كل المحاولات
+        idempotency_key = str(uuid.uuid4())
         try:
-            resp = requests.post(f"{API_BASE_URL}/join_room", json={
+            resp = post_idempotent(f"{API_BASE_URL}/join_room", {
                 "room_id": room["room_id"],
                 "username": self.user_data["username"]
-            })
+            }, idempotency_key)
             resp.raise_for_status()
             data = resp.json()
             
@@ -168,6 +233,7 @@ class MainApp(QtWidgets.QMainWindow):
                 "max_players": room.get("max_players", 8),
                 "current_players": room.get("current_players", 0),
                 "owner_username": room.get("owner_username", ""),
+                "shard": data.get("shard"),
                 "vpn_info": {
                     "hub": data["vpn_hub"],
                     "username": data["vpn_username"],
@@ -186,15 +252,15 @@ class MainApp(QtWidgets.QMainWindow):
         if self.room_win:
             self.room_win.close()
 
-        self.loader.terminate()
+        self.lobby.pause()
 
         self.room_win = RoomWindow(room_info, self.user_data["username"])
         self.room_win.room_closed.connect(self.on_room_close)
         self.room_win.show()
 
     def on_room_close(self):
-        self.update_rooms()
-        self.loader.start()
+        # إعادة الاشتراك ترسل القائمة كاملة ثم التحديثات
+        self.lobby.start()
         self.room_win = None
 
     def update_rooms(self):
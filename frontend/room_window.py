@@ -1,6 +1,5 @@
 import sys
 import os
-import socketio
 import subprocess
 import time
 import logging
@@ -8,6 +7,7 @@ from PyQt5 import QtWidgets, uic, QtCore
 from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtCore import QMetaType, QTimer, Qt, pyqtSlot
 from PyQt5.QtGui import QTextCursor
+from socket_serializer import create_client, connection_url
 
 # إعداد السجلات
 logging.basicConfig(level=logging.INFO)
@@ -124,9 +124,11 @@ class VPNManager:
 class RoomWindow(QtWidgets.QMainWindow):
     room_closed = QtCore.pyqtSignal()
     message_received = QtCore.pyqtSignal(dict)
+    chat_history_received = QtCore.pyqtSignal(dict)
     player_joined = QtCore.pyqtSignal(dict)
     player_left = QtCore.pyqtSignal(dict)
     players_updated = QtCore.pyqtSignal(dict)
+    players_delta = QtCore.pyqtSignal(dict)
     host_changed = QtCore.pyqtSignal(dict)
     room_closed_signal = QtCore.pyqtSignal(dict)
 
@@ -143,6 +145,8 @@ class RoomWindow(QtWidgets.QMainWindow):
         self.user_username = user_username
         self.is_host = room_data.get('owner_username') == user_username
         self.room_id = room_data.get('room_id')
+        # العملية التي تخدم الغرفة على الخادم (None عند العمل بعملية واحدة)
+        self.shard = room_data.get('shard')
         
         # التحقق من وجود vpn_info
         if "vpn_info" not in room_data:
@@ -150,8 +154,11 @@ class RoomWindow(QtWidgets.QMainWindow):
             raise ValueError("vpn_info is required in room_data")
             
         self.vpn_manager = VPNManager(room_data)
-        self.socket = socketio.Client()
+        # يطلب ترميز MessagePack الأصغر لبيانات الغرفة ويعود إلى JSON إذا لم يدعمه الخادم
+        self.socket = create_client()
         self.players = []
+        # إصدار قائمة اللاعبين المعروضة (None حتى تصل أول قائمة كاملة)
+        self.players_version = None
         
         # إعداد مؤقت للنبضات heartbeat
         self.heartbeat_timer = QTimer(self)
@@ -203,17 +210,21 @@ class RoomWindow(QtWidgets.QMainWindow):
 
         # ربط الإشارات مع المعالجات
         self.message_received.connect(self.on_receive_message)
+        self.chat_history_received.connect(self.on_chat_history)
         self.player_joined.connect(self.on_user_joined)
         self.player_left.connect(self.on_user_left)
         self.players_updated.connect(self.on_players_update)
+        self.players_delta.connect(self.on_players_delta)
         self.host_changed.connect(self.on_host_changed)
         self.room_closed_signal.connect(self.on_room_closed)
 
         # إعداد معالجات Socket.IO
         self.socket.on('new_message', lambda data: self.message_received.emit(data))
+        self.socket.on('chat_history', lambda data: self.chat_history_received.emit(data))
         self.socket.on('user_joined', lambda data: self.player_joined.emit(data))
         self.socket.on('user_left', lambda data: self.player_left.emit(data))
         self.socket.on('update_players', lambda data: self.players_updated.emit(data))
+        self.socket.on('players_delta', lambda data: self.players_delta.emit(data))
         self.socket.on('host_changed', lambda data: self.host_changed.emit(data))
         self.socket.on('room_closed', lambda data: self.room_closed_signal.emit(data))
         self.socket.on('game_started', self.on_game_started)
@@ -236,6 +247,9 @@ class RoomWindow(QtWidgets.QMainWindow):
         print("[DEBUG] RoomWindow.on_socket_connect called")
         logger.info("Socket.IO connected")
         self.chat_display.append("🟢 Connected to server")
+        # بعد إعادة الاتصال قد تكون فاتتنا فروق في قائمة اللاعبين
+        if self.players_version is not None:
+            self.request_players_resync()
 
     def on_socket_disconnect(self):
         print("[DEBUG] RoomWindow.on_socket_disconnect called")
@@ -258,7 +272,8 @@ class RoomWindow(QtWidgets.QMainWindow):
         print("[DEBUG] RoomWindow.connect_to_server called")
         try:
             if not self.socket.connected:
-                self.socket.connect(API_BASE_URL)
+                url = API_BASE_URL if self.shard is None else f"{API_BASE_URL}?shard={self.shard}"
+                self.socket.connect(connection_url(url))
             
             # التحقق من وجود اللاعب في الغرفة
             self.socket.emit('check_player', {
@@ -331,6 +346,17 @@ class RoomWindow(QtWidgets.QMainWindow):
                 self.chat_display.verticalScrollBar().maximum()
             )
 
+    @pyqtSlot(dict)
+    def on_chat_history(self, data):
+        print("[DEBUG] RoomWindow.on_chat_history called")
+        # آخر رسائل الغرفة عند الانضمام
+        for msg in data.get('messages', []):
+            sender = msg.get('sender', 'Anonymous')
+            self.chat_display.append(f"<span style='color: gray;'>[{msg.get('time', '')}]</span> <b>{sender}:</b> {msg.get('message', '')}")
+        self.chat_display.verticalScrollBar().setValue(
+            self.chat_display.verticalScrollBar().maximum()
+        )
+
     @pyqtSlot(dict)
     def on_user_joined(self, data):
         print("[DEBUG] RoomWindow.on_user_joined called")
@@ -353,8 +379,40 @@ class RoomWindow(QtWidgets.QMainWindow):
     def on_players_update(self, data):
         print("[DEBUG] RoomWindow.on_players_update called")
         self.players = data.get('players', [])
+        self.players_version = data.get('version')
         self.update_players_list()
 
+    @pyqtSlot(dict)
+    def on_players_delta(self, data):
+        print("[DEBUG] RoomWindow.on_players_delta called")
+        version = data.get('version')
+        # ننتظر القائمة الكاملة الأولى، ونتجاهل الفروق التي تتضمنها القائمة الحالية
+        if self.players_version is None or version <= self.players_version:
+            return
+        if version != self.players_version + 1:
+            # فاتنا فرق أو أكثر: نطلب القائمة كاملة
+            logger.info(f"Player list gap ({self.players_version} -> {version}), requesting resync")
+            self.request_players_resync()
+            return
+
+        for username in data.get('joined', []):
+            self.chat_display.append(f"🟢 {username} joined the room")
+            if username not in self.players:
+                self.players.append(username)
+        for username in data.get('left', []):
+            self.chat_display.append(f"🔴 {username} left the room")
+            if username in self.players:
+                self.players.remove(username)
+        self.players_version = version
+        self.update_players_list()
+
+    def request_players_resync(self):
+        try:
+            if self.socket.connected:
+                self.socket.emit('get_players', {'room_id': self.room_id})
+        except Exception as e:
+            logger.error(f"Error requesting players list: {e}")
+
     def update_players_list(self):
         print("[DEBUG] RoomWindow.update_players_list called")
         self.list_players.clear()
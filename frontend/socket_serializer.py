@@ -0,0 +1,54 @@
+import socketio
+from socketio import packet
+
+try:
+    import msgpack
+except ImportError:  # بدون msgpack يعمل العميل بـ JSON كالمعتاد
+    msgpack = None
+
+# حزم المرفقات الثنائية خاصة بترميز JSON، أما MessagePack فيرمز البيانات الثنائية مباشرة
+_PLAIN_TYPES = {packet.BINARY_EVENT: packet.EVENT, packet.BINARY_ACK: packet.ACK}
+
+
+def create_client(**kwargs):
+    """socketio.Client يطلب ترميز MessagePack ويعود إلى JSON إذا لم يدعمه الخادم
+
+    طلب الاتصال يُرسل دائماً بـ JSON، ورد الخادم عليه يحدد الترميز: رد ثنائي يعني أن الخادم
+    وافق على MessagePack، ورد نصي يعني الاستمرار بـ JSON. يُعاد التحديد مع كل إعادة اتصال.
+    """
+    if msgpack is None:
+        return socketio.Client(**kwargs)
+
+    state = {"msgpack": False}
+
+    class ClientPacket(packet.Packet):
+        def encode(self):
+            if not state["msgpack"] or self.packet_type == packet.CONNECT:
+                return super().encode()
+            data = self._to_dict()
+            data['type'] = _PLAIN_TYPES.get(self.packet_type, self.packet_type)
+            return msgpack.dumps(data)
+
+        def decode(self, encoded_packet):
+            binary = isinstance(encoded_packet, bytes)
+            if binary:
+                decoded = msgpack.loads(encoded_packet)
+                self.packet_type = decoded['type']
+                self.data = decoded.get('data')
+                self.id = decoded.get('id')
+                self.namespace = decoded['nsp']
+                attachment_count = 0
+            else:
+                attachment_count = super().decode(encoded_packet)
+            if self.packet_type == packet.CONNECT:
+                state["msgpack"] = binary
+            return attachment_count
+
+    return socketio.Client(serializer=ClientPacket, **kwargs)
+
+
+def connection_url(url):
+    """رابط الاتصال مع طلب ترميز MessagePack إذا كانت المكتبة متوفرة"""
+    if msgpack is None:
+        return url
+    return url + ('&' if '?' in url else '?') + 'serializer=msgpack'
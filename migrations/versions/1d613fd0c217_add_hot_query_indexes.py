@@ -0,0 +1,38 @@
+"""add indexes for hot queries
+
+Revision ID: 1d613fd0c217
+Revises: 6695380a7085
+Create Date: 2026-10-19 20:00:03.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d613fd0c217'
+down_revision = '6695380a7085'
+branch_labels = None
+depends_on = None
+
+# (الجدول، اسم الفهرس، الأعمدة)
+INDEXES = [
+    ('user', 'ix_user_username', ['username']),
+    ('friendship', 'ix_friendship_user_id_status', ['user_id', 'status']),
+    ('friendship', 'ix_friendship_friend_id_status', ['friend_id', 'status']),
+    ('room', 'ix_room_name', ['name']),
+    ('room_player', 'ix_room_player_player_username', ['player_username']),
+    ('chat_message', 'ix_chat_message_room_id_timestamp', ['room_id', 'timestamp']),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, name, columns in INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for table, name, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,26 @@
+"""add chat_message (room_id, id) index
+
+Revision ID: 6695380a7085
+Revises: e9562e5435a4
+Create Date: 2026-10-19 20:00:02.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6695380a7085'
+down_revision = 'e9562e5435a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('chat_message')}
+    if 'ix_chat_message_room_id_id' not in indexes:
+        op.create_index('ix_chat_message_room_id_id', 'chat_message', ['room_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_chat_message_room_id_id', table_name='chat_message')
@@ -0,0 +1,81 @@
+"""add chat_archive and chat_purge, drop chat_message room foreign key
+
+Revision ID: a6671e9d1555
+Revises: 1d613fd0c217
+Create Date: 2026-10-19 20:00:04.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6671e9d1555'
+down_revision = '1d613fd0c217'
+branch_labels = None
+depends_on = None
+
+
+def _chat_message_without_room_fk():
+    """تعريف chat_message بعد هذه المراجعة، لإعادة إنشاء الجدول في SQLite بدون المفتاح الأجنبي غير المسمى"""
+    return sa.Table(
+        'chat_message', sa.MetaData(),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('room_id', sa.Integer(), nullable=False),
+        sa.Column('sender', sa.String(length=100), nullable=False),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.Index('ix_chat_message_room_id_id', 'room_id', 'id'),
+        sa.Index('ix_chat_message_room_id_timestamp', 'room_id', 'timestamp'),
+    )
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    if 'chat_archive' not in tables:
+        op.create_table('chat_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('room_id', sa.Integer(), nullable=False),
+        sa.Column('first_message_id', sa.Integer(), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=False),
+        sa.Column('first_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_chat_archive_room_id', 'chat_archive', ['room_id'], unique=False)
+
+    if 'chat_purge' not in tables:
+        op.create_table('chat_purge',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('room_id', sa.Integer(), nullable=False),
+        sa.Column('max_message_id', sa.Integer(), nullable=False),
+        sa.Column('requested_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+    # رسائل الغرف المغلقة تُحذف بعد الغرفة على دفعات، فلا يبقى مفتاح أجنبي إلى room
+    room_fks = [fk for fk in inspector.get_foreign_keys('chat_message') if fk['referred_table'] == 'room']
+    if not room_fks:
+        return
+    if bind.dialect.name == 'sqlite':
+        with op.batch_alter_table('chat_message', recreate='always',
+                                  copy_from=_chat_message_without_room_fk()):
+            pass
+    else:
+        for fk in room_fks:
+            op.drop_constraint(fk['name'], 'chat_message', type_='foreignkey')
+
+
+def downgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.create_foreign_key('fk_chat_message_room_id_room', 'room', ['room_id'], ['id'])
+    op.drop_table('chat_purge')
+    op.drop_index('ix_chat_archive_room_id', table_name='chat_archive')
+    op.drop_table('chat_archive')
@@ -0,0 +1,29 @@
+"""add room_player.vpn_password_encrypted
+
+Revision ID: e9562e5435a4
+Revises: 95a1492a607e
+Create Date: 2026-10-19 20:00:01.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9562e5435a4'
+down_revision = '95a1492a607e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # قد يكون العمود موجوداً إذا أنشأ create_all الجدول من النماذج الحالية
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('room_player')}
+    if 'vpn_password_encrypted' not in columns:
+        with op.batch_alter_table('room_player', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('vpn_password_encrypted', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('room_player', schema=None) as batch_op:
+        batch_op.drop_column('vpn_password_encrypted')
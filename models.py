@@ -6,7 +6,7 @@ db = SQLAlchemy()
 
 class User(db.Model):
     id                = db.Column(db.Integer, primary_key=True)
-    username          = db.Column(db.String(80), nullable=False)
+    username          = db.Column(db.String(80), nullable=False, index=True)
     email             = db.Column(db.String(120), unique=True, nullable=False)
     password_hash     = db.Column(db.String(128), nullable=False)
     verification_code = db.Column(db.String(10), nullable=True)
@@ -31,14 +31,16 @@ class Friendship(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('sent_requests', lazy='dynamic'))
     friend = db.relationship('User', foreign_keys=[friend_id], backref=db.backref('received_requests', lazy='dynamic'))
 
-    # ضمان عدم تكرار علاقات الصداقة
+    # ضمان عدم تكرار علاقات الصداقة، وفهرسان لقوائم الأصدقاء والطلبات حسب الحالة لكل طرف
     __table_args__ = (
         db.UniqueConstraint('user_id', 'friend_id', name='unique_friendship'),
+        db.Index('ix_friendship_user_id_status', 'user_id', 'status'),
+        db.Index('ix_friendship_friend_id_status', 'friend_id', 'status'),
     )
 
 class Room(db.Model):
     id              = db.Column(db.Integer, primary_key=True)
-    name            = db.Column(db.String(100), nullable=False)
+    name            = db.Column(db.String(100), nullable=False, index=True)
     owner_username = db.Column(db.String(100), nullable=False)  # استخدام owner_username بدلاً من owner_email
     description     = db.Column(db.String(255), default="")
     is_private      = db.Column(db.Boolean, default=False)
@@ -54,15 +56,47 @@ class RoomPlayer(db.Model):
     player_username = db.Column(db.String(100), nullable=False)
     is_host = db.Column(db.Boolean, default=False)
     username = db.Column(db.String(100), nullable=False)
+    # كلمة مرور VPN مشفرة لإعادة استخدامها عند إعادة الانضمام دون استدعاء vpncmd
+    vpn_password_encrypted = db.Column(db.String(255), nullable=True)
 
+    # القيد الفريد يخدم البحث بالغرفة، والفهرس الثاني للبحث عن غرفة اللاعب الحالية
     __table_args__ = (
         db.UniqueConstraint('room_id', 'player_username', name='unique_player_in_room'),
+        db.Index('ix_room_player_player_username', 'player_username'),
     )
 
 
 class ChatMessage(db.Model):
     id        = db.Column(db.Integer, primary_key=True)
-    room_id   = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
+    # بدون مفتاح أجنبي: رسائل الغرف المغلقة تُحذف لاحقاً على دفعات (ChatPurge) وليس مع الغرفة
+    room_id   = db.Column(db.Integer, nullable=False)
     sender    = db.Column(db.String(100), nullable=False)
     message   = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # فهرس لتقسيم سجل الرسائل بالمؤشر (room_id, id)، وفهرس لرسائل الغرفة مرتبة بالوقت
+    __table_args__ = (
+        db.Index('ix_chat_message_room_id_id', 'room_id', 'id'),
+        db.Index('ix_chat_message_room_id_timestamp', 'room_id', 'timestamp'),
+    )
+
+
+# دفعة رسائل مؤرشفة ومضغوطة (JSON مضغوط بـ zlib) لغرفة واحدة
+class ChatArchive(db.Model):
+    id                = db.Column(db.Integer, primary_key=True)
+    room_id           = db.Column(db.Integer, nullable=False, index=True)
+    first_message_id  = db.Column(db.Integer, nullable=False)
+    last_message_id   = db.Column(db.Integer, nullable=False)
+    first_timestamp   = db.Column(db.DateTime)
+    last_timestamp    = db.Column(db.DateTime)
+    message_count     = db.Column(db.Integer, nullable=False)
+    payload           = db.Column(db.LargeBinary, nullable=False)
+    archived_at       = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# رسائل غرفة مغلقة تنتظر الحذف على دفعات (حتى max_message_id حتى لا تُحذف رسائل غرفة جديدة بنفس الرقم)
+class ChatPurge(db.Model):
+    id             = db.Column(db.Integer, primary_key=True)
+    room_id        = db.Column(db.Integer, nullable=False)
+    max_message_id = db.Column(db.Integer, nullable=False)
+    requested_at   = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, Friendship
+from database.upsert import insert_ignore
 import logging
 
 # إعداد السجلات
@@ -46,15 +47,13 @@ def send_friend_request():
             else:
                 return jsonify({"error": "لديك طلب صداقة معلق بالفعل مع هذا المستخدم"}), 400
     
-    # إنشاء طلب صداقة جديد
-    friendship = Friendship(
-        user_id=current_user.id,
-        friend_id=friend.id,
-        status='pending'
-    )
-    
-    db.session.add(friendship)
+    # إنشاء طلب صداقة جديد (طلبان متزامنان لنفس المستخدم لا يضيفان إلا سجلاً واحداً)
+    created = insert_ignore(db.session, Friendship,
+                            {"user_id": current_user.id, "friend_id": friend.id, "status": 'pending'},
+                            ["user_id", "friend_id"])
     db.session.commit()
+    if not created:
+        return jsonify({"error": "لديك طلب صداقة معلق بالفعل مع هذا المستخدم"}), 400
     
     return jsonify({"message": "تم إرسال طلب الصداقة بنجاح"}), 201
 
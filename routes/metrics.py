@@ -0,0 +1,10 @@
+from flask import Blueprint, jsonify
+from services.metrics import collect_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """عرض مقاييس الأداء الحالية للخادم"""
+    return jsonify(collect_metrics()), 200
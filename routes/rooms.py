@@ -1,9 +1,19 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response, Response
 from models import db, Room, RoomPlayer, ChatMessage
 from services.softether import SoftEtherVPN
-import random
+from database.room_search import search_rooms
+from services.admission import AdmissionController, AdmissionRejected
+from services.metrics import register_metrics
+from services.idempotency import create_idempotency_store, IdempotencyConflict, IdempotencyInProgress
+from services.membership import MembershipService, MembershipError, hub_name_for
+from services.credentials import encrypt_password, generate_vpn_password
+from services.chat_history import ChatHistory, message_to_dict
+from services.sharding import RoomShards
 import os
+import math
+import hashlib
 import logging
+from functools import wraps
 
 # إعداد السجلات
 logging.basicConfig(level=logging.INFO)
@@ -15,32 +25,181 @@ admin_password = os.getenv("SOFTETHER_ADMIN_PASSWORD", "vpn")
 server_ip = os.getenv("SOFTETHER_SERVER_IP", "localhost")
 server_port = int(os.getenv("SOFTETHER_SERVER_PORT", 5555))
 vpn = SoftEtherVPN(admin_password, server_ip, server_port)
+# خدمة العضوية المشتركة مع معالجات Socket.IO في app.py
+membership = MembershipService(vpn)
+# العملية المالكة لكل غرفة عند تشغيل عدة عمليات (SHARD_COUNT) تخدم كل منها غرفها فقط
+# عدة عمليات تخدم نفس الغرف إذا شُغلت عدة نسخ (APP_REPLICAS، نفس قيمة --scale app=N)،
+# أو بدون تقسيم مع طابور رسائل مشترك، فلا تكفي ذاكرة أي منها
+shard_count = int(os.getenv("SHARD_COUNT", 1))
+app_replicas = int(os.getenv("APP_REPLICAS", 1))
+room_shards = RoomShards(count=shard_count, index=int(os.getenv("SHARD_INDEX", 0)),
+                         shared=app_replicas > 1 or (shard_count == 1 and bool(os.getenv("SOCKETIO_MESSAGE_QUEUE"))))
+
+# التحكم في قبول طلبات إنشاء الغرف والانضمام حتى لا تتراكم أوامر vpncmd
+admission = AdmissionController(
+    global_rate=float(os.getenv("ADMISSION_GLOBAL_RATE", 20)),
+    global_burst=int(os.getenv("ADMISSION_GLOBAL_BURST", 40)),
+    user_rate=float(os.getenv("ADMISSION_USER_RATE", 0.5)),
+    user_burst=int(os.getenv("ADMISSION_USER_BURST", 3)),
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", 4)),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 32)),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10)),
+)
+register_metrics("admission", admission.stats)
+
+
+def admission_controlled(get_key):
+    """ديكوريتور يمرر الطلب عبر التحكم في القبول ويعيد 429 عند الحمل الزائد"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = get_key(request.get_json(silent=True) or {})
+            try:
+                with admission.admit(key):
+                    return func(*args, **kwargs)
+            except AdmissionRejected as e:
+                logger.warning(f"Admission rejected for {key}: {e.reason}")
+                response = jsonify({"error": e.reason, "retry_after": round(e.retry_after, 2)})
+                response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+                return response, 429
+        return wrapper
+    return decorator
+
+
+# نتائج الطلبات المكررة حسب ترويسة Idempotency-Key (يعيد العميل الطلب عند انتهاء المهلة)،
+# في Redis المشترك عند تشغيل عدة عمليات حتى لا تكرر إعادة المحاولة في عملية أخرى إنشاء الهاب والمستخدم
+idempotency_store = create_idempotency_store(
+    os.getenv("PRESENCE_STORE_URL") or os.getenv("SOCKETIO_MESSAGE_QUEUE"),
+    ttl=int(os.getenv("IDEMPOTENCY_TTL", 3600)),
+    wait_timeout=float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", 10))
+)
+register_metrics("idempotency", idempotency_store.stats)
+
+
+def idempotent(func):
+    """ديكوريتور يعيد الاستجابة الأصلية للطلبات المكررة بنفس Idempotency-Key دون تكرار آثارها"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return func(*args, **kwargs)
+
+        def run():
+            response = make_response(func(*args, **kwargs))
+            snapshot = (response.get_data(), response.status_code, response.mimetype)
+            # لا نحفظ أخطاء الخادم أو رفض الحمل الزائد حتى تنجح إعادة المحاولة لاحقاً
+            return snapshot, response.status_code < 500 and response.status_code != 429
+
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        try:
+            body, status, mimetype = idempotency_store.execute(f"{request.endpoint}:{key}", fingerprint, run)
+        except IdempotencyConflict as e:
+            return jsonify({"error": str(e)}), 422
+        except IdempotencyInProgress as e:
+            # الطلب الأصلي لم ينته بعد: يعيد العميل المحاولة بنفس المفتاح لاحقاً
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response, 409
+        return Response(body, status=status, mimetype=mimetype)
+    return wrapper
+
+
+def load_recent_messages(room_id, limit):
+    """آخر الرسائل المحفوظة للغرفة من الأقدم للأحدث بنفس شكل قواميس طابور الحفظ"""
+    rows = ChatMessage.query.filter_by(room_id=int(room_id)).order_by(ChatMessage.id.desc()).limit(limit).all()
+    return [{"id": m.id, "room_id": m.room_id, "sender": m.sender, "message": m.message, "timestamp": m.timestamp}
+            for m in reversed(rows)]
+
+
+# آخر رسائل الغرف النشطة في الذاكرة (تُملأ من send_message في app.py)
+chat_history = ChatHistory(load_recent_messages, size=int(os.getenv("CHAT_HISTORY_SIZE", 50)))
+register_metrics("chat_history", chat_history.stats)
+
+
+def room_to_dict(room):
+    """تحويل الغرفة إلى الشكل الذي تتوقعه الواجهة الأمامية"""
+    return {
+        "id": room.id,
+        "room_id": room.id, # إضافة room_id ليتوافق مع الفرونت اند
+        "room_name": room.name,
+        "owner_username": room.owner_username,
+        "description": room.description,
+        "is_private": room.is_private,
+        "max_players": room.max_players,
+        "current_players": room.current_players
+        # يمكنك إضافة أي حقول أخرى تحتاجها هنا
+    }
 
 
 @rooms_bp.route('/get_rooms', methods=['GET'])
 def get_rooms():
     try:
         rooms_query = Room.query.all()
-        rooms_list = []
-        for room in rooms_query:
-            rooms_list.append({
-                "id": room.id,
-                "room_id": room.id, # إضافة room_id ليتوافق مع الفرونت اند
-                "room_name": room.name,
-                "owner_username": room.owner_username,
-                "description": room.description,
-                "is_private": room.is_private,
-                "max_players": room.max_players,
-                "current_players": room.current_players
-                # يمكنك إضافة أي حقول أخرى تحتاجها هنا
-            })
+        rooms_list = [room_to_dict(room) for room in rooms_query]
         return jsonify({"rooms": rooms_list}), 200
     except Exception as e:
         logger.error(f"Error fetching rooms: {e}")
         return jsonify({"error": "Failed to fetch rooms"}), 500
-    
-    
+
+
+@rooms_bp.route('/rooms/search', methods=['GET'])
+def search_rooms_route():
+    """البحث النصي في أسماء وأوصاف الغرف مع الترتيب حسب الصلة والتقسيم إلى صفحات"""
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", 20, type=int), 1), 50)
+
+    if not query:
+        return jsonify({"error": "Search query is required"}), 400
+
+    try:
+        room_ids, total = search_rooms(db.session, query, per_page, (page - 1) * per_page)
+        rooms_by_id = {room.id: room for room in Room.query.filter(Room.id.in_(room_ids)).all()} if room_ids else {}
+        rooms_list = [room_to_dict(rooms_by_id[room_id]) for room_id in room_ids if room_id in rooms_by_id]
+        return jsonify({
+            "rooms": rooms_list,
+            "page": page,
+            "per_page": per_page,
+            "total": total
+        }), 200
+    except Exception as e:
+        logger.error(f"Error searching rooms: {e}")
+        return jsonify({"error": "Failed to search rooms"}), 500
+
+
+@rooms_bp.route('/rooms/<int:room_id>/messages', methods=['GET'])
+def get_room_messages(room_id):
+    """سجل رسائل الغرفة مقسماً بمؤشر before (معرّف أقدم رسالة لدى العميل) من الأحدث للأقدم"""
+    before = request.args.get("before", type=int)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 100)
+
+    try:
+        # الحالة الشائعة تُخدم من الذاكرة، وقاعدة البيانات للصفحات الأقدم فقط
+        # (ذاكرة الرسائل كاملة فقط في العملية الوحيدة التي تخدم الغرفة)
+        messages = chat_history.page(room_id, before, limit) if room_shards.owns(room_id) else None
+        if messages is None:
+            query = ChatMessage.query.filter_by(room_id=room_id)
+            if before is not None:
+                query = query.filter(ChatMessage.id < before)
+            messages = list(reversed(query.order_by(ChatMessage.id.desc()).limit(limit).all()))
+            if not messages and not Room.query.get(room_id):
+                return jsonify({"error": "Room not found"}), 404
+
+        messages = [message_to_dict(m) for m in messages]
+        ids = [m["id"] for m in messages if m["id"] is not None]
+        return jsonify({
+            "room_id": room_id,
+            "messages": messages,
+            "next_before": min(ids) if ids and len(messages) == limit else None
+        }), 200
+    except Exception as e:
+        logger.error(f"Error fetching messages for room {room_id}: {e}")
+        return jsonify({"error": "Failed to fetch messages"}), 500
+
+
 @rooms_bp.route('/create_room', methods=['POST'])
+@idempotent
+@admission_controlled(lambda data: data.get("owner"))
 def create_room():
     data = request.get_json()
 
@@ -81,7 +240,7 @@ def create_room():
         # إنشاء مستخدم للمالك
         username = data["owner"].split('@')[0]
         # إنشاء كلمة مرور عشوائية آمنة
-        vpn_password = ''.join(random.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=12))
+        vpn_password = generate_vpn_password()
         logger.info(f"Creating VPN user: {username} in hub: {hub_name}")
         
         # استخدام الوظيفة المحسنة لإنشاء المستخدم
@@ -94,9 +253,11 @@ def create_room():
         logger.info(f"Successfully created VPN user: {username} in hub: {hub_name}")
 
         # إضافة اللاعب إلى قاعدة البيانات
-        rp = RoomPlayer(room_id=room.id, player_username=data["owner"], username=username, is_host=True)
+        rp = RoomPlayer(room_id=room.id, player_username=data["owner"], username=username, is_host=True,
+                        vpn_password_encrypted=encrypt_password(vpn_password))
         db.session.add(rp)
         db.session.commit()
+        membership.notify("joined", room.id, data["owner"])
         
         # تشخيص حالة الهب للتأكد من إنشائه بنجاح
         hub_status = vpn.hub_exists(hub_name)
@@ -108,7 +269,8 @@ def create_room():
             "vpn_username": username,
             "vpn_password": vpn_password,
             "server_ip": server_ip,
-            "port": server_port
+            "port": server_port,
+            "shard": room_shards.shard_for(room.id)
         }), 200
     
     except Exception as e:
@@ -122,93 +284,66 @@ def create_room():
         return jsonify({"error": f"Error creating room: {str(e)}"}), 500
 
 @rooms_bp.route('/join_room', methods=['POST'])
+@idempotent
+@admission_controlled(lambda data: data.get("username"))
 def join_room():
     data = request.get_json()
     
     # التحقق من صحة المدخلات
     if not data.get("room_id") or not data.get("username"):
         return jsonify({"error": "Room ID and username are required"}), 400
-    
-    room = Room.query.get(data["room_id"])
-    if not room:
-        return jsonify({"error": "Room not found"}), 404
-
-    # التحقق من وجود المستخدم في نفس الغرفة
-    existing_in_same_room = RoomPlayer.query.filter_by(
-        room_id=data["room_id"], 
-        player_username=data["username"]
-    ).first()
-    if existing_in_same_room:
-        # إذا كان المستخدم موجود بالفعل في الغرفة، نعيد له بياناته من الـ VPN بدلا من الإبلاغ عن خطأ
-        hub_name = f"room_{room.id}"
-        
-        # تشخيص للتأكد من وجود الهاب والمستخدم
-        hub_exists = vpn.hub_exists(hub_name)
-        logger.info(f"Hub {hub_name} exists = {hub_exists} for user: {existing_in_same_room.username}")
-        
-        # نرجع إلى اللاعب بيانات الاتصال الحالية
-        return jsonify({
-            "room_id": room.id,
-            "vpn_hub": hub_name,
-            "vpn_username": existing_in_same_room.username,
-            "vpn_password": "REUSEDPASSWORD",  # مشكلة: لا نستطيع استرجاع كلمة المرور القديمة
-            "server_ip": server_ip,
-            "port": server_port,
-            "message": "You are already in this room. Using existing connection."
-        }), 200
 
     try:
-        # قبل ما ينضم، نتأكد إذا هو موجود بغرفة ثانية
-        existing_membership = RoomPlayer.query.filter_by(player_username=data["username"]).first()
-        if existing_membership:
-            # نطرده من الغرفة القديمة
-            old_room = Room.query.get(existing_membership.room_id)
-            if old_room:
-                old_hub = f"room_{old_room.id}"
-                vpn.delete_user(old_hub, existing_membership.username)
-                db.session.delete(existing_membership)
-                old_room.current_players -= 1
-
-                if old_room.current_players <= 0:
-                    vpn.delete_hub(old_hub)
-                    ChatMessage.query.filter_by(room_id=old_room.id).delete()
-                    db.session.delete(old_room)
-
-        players_count = RoomPlayer.query.filter_by(room_id=room.id).count()
-        if players_count >= room.max_players:
-            return jsonify({"error": "Room is full"}), 400
-
-        # إنشاء مستخدم VPN جديد
-        hub_name = f"room_{room.id}"
-        username = data["username"].split('@')[0]
-        vpn_password = ''.join(random.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=12))
-        
-        # التأكد من وجود الهاب أولاً وإنشائه إذا لم يكن موجوداً - الآن مضمّن في وظيفة create_user
-        # الوظيفة المُحسّنة للتحقق من وجود الهاب وإنشائه إذا لم يكن موجوداً ثم إنشاء المستخدم
-        if not vpn.create_user(hub_name, username, vpn_password):
-            logger.error(f"Failed to create VPN user: {username} in hub: {hub_name}")
-            return jsonify({"error": "Failed to create VPN user"}), 500
+        result = membership.join(data["room_id"], data["username"])
+    except MembershipError as e:
+        return jsonify({"error": e.message}), e.status
+    except Exception as e:
+        logger.error(f"Exception during joining room: {str(e)}")
+        return jsonify({"error": f"Error joining room: {str(e)}"}), 500
 
-        rp = RoomPlayer(room_id=room.id, player_username=data["username"], username=username, is_host=False)
-        db.session.add(rp)
-        room.current_players = players_count + 1
-        db.session.commit()
+    response = {
+        "room_id": int(data["room_id"]),
+        "vpn_hub": hub_name_for(data["room_id"]),
+        "vpn_username": result["vpn_username"],
+        "vpn_password": result["vpn_password"],
+        "server_ip": server_ip,
+        "port": server_port,
+        "shard": room_shards.shard_for(data["room_id"])
+    }
+    if result["rejoined"]:
+        response["message"] = "You are already in this room. Using existing connection."
+    return jsonify(response), 200
 
-        return jsonify({
-            "room_id": room.id,
-            "vpn_hub": hub_name,
-            "vpn_username": username,
-            "vpn_password": vpn_password,
-            "server_ip": server_ip,
-            "port": server_port
-        }), 200
-    
+@rooms_bp.route('/bulk_join_room', methods=['POST'])
+@idempotent
+@admission_controlled(lambda data: f"room_{data.get('room_id')}")
+def bulk_join_room():
+    """إضافة مجموعة من اللاعبين إلى غرفة بعملية VPN واحدة ومعاملة قاعدة بيانات واحدة"""
+    data = request.get_json()
+
+    # التحقق من صحة المدخلات
+    usernames = data.get("usernames")
+    if not data.get("room_id") or not isinstance(usernames, list) or not usernames:
+        return jsonify({"error": "Room ID and a list of usernames are required"}), 400
+
+    try:
+        results = membership.bulk_join(data["room_id"], usernames)
+    except MembershipError as e:
+        return jsonify({"error": e.message}), e.status
     except Exception as e:
-        logger.error(f"Exception during joining room: {str(e)}")
-        db.session.rollback()
+        logger.error(f"Exception during bulk join: {str(e)}")
         return jsonify({"error": f"Error joining room: {str(e)}"}), 500
 
+    return jsonify({
+        "room_id": int(data["room_id"]),
+        "vpn_hub": hub_name_for(data["room_id"]),
+        "server_ip": server_ip,
+        "port": server_port,
+        "players": results
+    }), 200
+
 @rooms_bp.route('/leave_room', methods=['POST'])
+@idempotent
 def leave_room():
     data = request.get_json()
 
@@ -216,67 +351,16 @@ def leave_room():
     if not data.get("room_id") or not data.get("username"):
         return jsonify({"error": "Room ID and username are required"}), 400
 
-    rp = RoomPlayer.query.filter_by(room_id=data["room_id"], player_username=data["username"]).first()
-    room = Room.query.get(data["room_id"])
+    logger.info(f"Leave room request for {data['username']} from room {data['room_id']}")
+    try:
+        result = membership.leave(data["room_id"], data["username"])
+    except Exception as e:
+        logger.error(f"Error in leave_room: {e}")
+        return jsonify({"error": "Internal server error"}), 500
 
-    if not room:
+    if result is None:
         return jsonify({"error": "Room not found"}), 404
-
-    # علامة تشير إلى ما إذا كان هذا آخر لاعب (تأتي من Socket.IO)
-    is_last_player = data.get("is_last_player", False)
-    logger.info(f"Leave room request for {data['username']} from room {data['room_id']} - is_last_player: {is_last_player}")
-
-    if rp:
-        # حذف مستخدم VPN
-        hub_name = f"room_{room.id}"
-        logger.info(f"Deleting VPN user: {rp.username} from hub: {hub_name}")
-        vpn.delete_user(hub_name, rp.username)
-        db.session.delete(rp)
-        db.session.flush()
-
-    # إذا تم التحديد مسبقًا أن هذا آخر لاعب، نحذف الغرفة مباشرة
-    if is_last_player:
-        logger.info(f"Last player left room {room.id} - cleaning up room")
-        # نحتفظ بمحول الشبكة للاستخدام المستقبلي - نستخدم اسم ثابت "VPN"
-        adapter_name = "VPN"
-        if vpn.adapter_exists(adapter_name):
-            logger.info(f"Keeping VPN adapter {adapter_name} for future use")
-        
-        # حذف هاب VPN
-        hub_name = f"room_{room.id}"
-        logger.info(f"Deleting VPN hub: {hub_name}")
-        vpn.delete_hub(hub_name)
-        logger.info(f"Successfully deleted VPN hub: {hub_name}")
-        ChatMessage.query.filter_by(room_id=room.id).delete()
-        db.session.delete(room)
-    else:
-        # إذا لم نكن متأكدين، نتحقق من عدد اللاعبين المتبقين
-        players_left = RoomPlayer.query.filter_by(room_id=room.id).count()
-        room.current_players = players_left
-
-        if players_left == 0:
-            # نحتفظ بمحول الشبكة للاستخدام المستقبلي - نستخدم اسم ثابت "VPN"
-            adapter_name = "VPN"
-            if vpn.adapter_exists(adapter_name):
-                logger.info(f"Keeping VPN adapter {adapter_name} for future use")
-            
-            # حذف هاب VPN
-            hub_name = f"room_{room.id}"
-            logger.info(f"Deleting VPN hub: {hub_name}")
-            vpn.delete_hub(hub_name)
-            logger.info(f"Successfully deleted VPN hub: {hub_name}")
-            ChatMessage.query.filter_by(room_id=room.id).delete()
-            db.session.delete(room)
-        else:
-            if rp and rp.is_host:
-                new_host = RoomPlayer.query.filter_by(room_id=room.id).first()
-                if new_host:
-                    new_host.is_host = True
-                    room.owner_username = new_host.player_username
-                    logger.info(f"New host assigned: {new_host.player_username}")
-
-    db.session.commit()
-    return jsonify(message="left"), 200
+    return jsonify(message="left", **result), 200
 
 @rooms_bp.route('/vpn_status', methods=['GET'])
 def vpn_status():
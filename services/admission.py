@@ -0,0 +1,140 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    """يُرفع عند رفض طلب بسبب الحمل الزائد، مع الوقت المقترح لإعادة المحاولة"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """دلو رموز بسيط: rate رمز في الثانية وسعة قصوى capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        # دلو جديد قد يُنشأ بعد أخذ now، فلا يُحسب الزمن السالب كسحب من الرموز
+        if now <= self.updated_at:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, now):
+        """محاولة أخذ رمز، ويعيد 0 عند النجاح أو عدد الثواني حتى يتوفر رمز"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """التحكم في قبول العمليات الثقيلة (إنشاء الغرف والانضمام) قبل الوصول إلى SoftEther"""
+
+    def __init__(self, global_rate, global_burst, user_rate, user_burst,
+                 max_concurrent, max_queue, queue_timeout):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_buckets = {}
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._waiting = 0
+
+        # إحصائيات
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_queue = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _take_tokens(self, user, now):
+        # تنظيف دلاء المستخدمين الممتلئة حتى لا ينمو القاموس بلا حدود
+        if len(self.user_buckets) > 10000:
+            self.user_buckets = {key: bucket for key, bucket in self.user_buckets.items() if not bucket.is_full(now)}
+
+        user_bucket = self.user_buckets.get(user)
+        if user_bucket is None:
+            user_bucket = self.user_buckets[user] = TokenBucket(self.user_rate, self.user_burst)
+
+        retry_after = user_bucket.try_acquire(now)
+        if retry_after:
+            self.rejected_rate += 1
+            raise AdmissionRejected("Too many requests for this user", retry_after)
+
+        retry_after = self.global_bucket.try_acquire(now)
+        if retry_after:
+            user_bucket.refund()
+            self.rejected_rate += 1
+            raise AdmissionRejected("Server is busy", retry_after)
+
+    @contextmanager
+    def admit(self, user):
+        """حجز مكان لتنفيذ عملية، مع الانتظار في طابور محدود عند امتلاء الأماكن"""
+        started = time.monotonic()
+        with self._lock:
+            self._take_tokens(user, started)
+
+            if self._in_flight >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self.rejected_queue += 1
+                    raise AdmissionRejected("Admission queue is full", self.queue_timeout)
+
+                self._waiting += 1
+                try:
+                    deadline = started + self.queue_timeout
+                    while self._in_flight >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_queue += 1
+                            raise AdmissionRejected("Timed out waiting in admission queue", self.queue_timeout)
+                        self._slot_free.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_flight += 1
+            waited = time.monotonic() - started
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._slot_free.notify()
+
+    def stats(self):
+        """إحصائيات الطابور الحالية لعرضها في المقاييس"""
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "admitted": self.admitted,
+                "rejected_rate_limited": self.rejected_rate,
+                "rejected_queue": self.rejected_queue,
+                "avg_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+                "max_wait_seconds": self.max_wait,
+            }
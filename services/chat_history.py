@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict, deque
+
+
+def message_to_dict(row):
+    """تحويل رسالة (قاموس من طابور الحفظ أو صف ChatMessage) إلى الشكل المرسل للعميل"""
+    if isinstance(row, dict):
+        return {
+            'id': row.get('id'),
+            'sender': row['sender'],
+            'message': row['message'],
+            'time': row['timestamp'].strftime("%H:%M:%S"),
+            'timestamp': row['timestamp'].isoformat(),
+        }
+    return {
+        'id': row.id,
+        'sender': row.sender,
+        'message': row.message,
+        'time': row.timestamp.strftime("%H:%M:%S"),
+        'timestamp': row.timestamp.isoformat(),
+    }
+
+
+class ChatHistory:
+    """مخزن حلقي لآخر رسائل كل غرفة نشطة لإرسال السجل فوراً عند الانضمام دون قاعدة البيانات
+
+    الرسائل هي نفس قواميس طابور الحفظ، فيظهر معرّف الرسالة فيها بعد كتابة دفعتها.
+    الغرف الأقل استخداماً تُحذف عند تجاوز max_rooms وتُحمّل من قاعدة البيانات عند الحاجة.
+    """
+
+    def __init__(self, load_recent, size=50, max_rooms=5000):
+        # load_recent(room_id, limit) تعيد آخر الرسائل المحفوظة من الأقدم للأحدث
+        self.load_recent = load_recent
+        self.size = size
+        self.max_rooms = max_rooms
+        self._lock = threading.Lock()
+        # room_id -> [deque، هل تم تحميل السجل القديم]
+        self._rooms = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+
+    def _room(self, room_id):
+        entry = self._rooms.get(room_id)
+        if entry is None:
+            entry = self._rooms[room_id] = [deque(maxlen=self.size), False]
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room_id)
+        return entry
+
+    def append(self, room_id, row):
+        with self._lock:
+            self._room(str(room_id))[0].append(row)
+
+    def recent(self, room_id):
+        """آخر رسائل الغرفة من الأقدم للأحدث، مع تحميلها من قاعدة البيانات إذا لم تكن في الذاكرة"""
+        room_id = str(room_id)
+        with self._lock:
+            messages, warm = self._room(room_id)
+            if warm:
+                self.hits += 1
+                return list(messages)
+
+        # الغرفة ليست في الذاكرة: نحمّل آخر الرسائل المحفوظة وندمجها مع ما وصل بعد ذلك
+        loaded = self.load_recent(room_id, self.size)
+        with self._lock:
+            self.loads += 1
+            messages, warm = entry = self._room(room_id)
+            if not warm:
+                known = {row.get('id') for row in messages if row.get('id') is not None}
+                merged = [row for row in loaded if row['id'] not in known] + list(messages)
+                messages.clear()
+                messages.extend(merged)
+                entry[1] = True
+            return list(messages)
+
+    def page(self, room_id, before=None, limit=50):
+        """صفحة من الرسائل الأقدم من before من الذاكرة، أو None إذا كانت تحتاج قاعدة البيانات"""
+        with self._lock:
+            entry = self._rooms.get(str(room_id))
+            if entry is None or not entry[1]:
+                return None
+            messages = list(entry[0])
+            # المخزن قد لا يحتوي كل الرسائل المطلوبة إذا كان ممتلئاً
+            full = len(messages) == self.size
+
+        if before is not None:
+            # الرسائل التي لم تُحفظ بعد أحدث من أي معرّف موجود
+            messages = [row for row in messages if row.get('id') is not None and row['id'] < before]
+        if len(messages) < limit and full:
+            return None
+        self.hits += 1
+        return messages[-limit:]
+
+    def drop(self, room_id):
+        with self._lock:
+            self._rooms.pop(str(room_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {"rooms": len(self._rooms), "hits": self.hits, "loads": self.loads}
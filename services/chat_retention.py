@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+import zlib
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from models import db, Room, ChatMessage, ChatArchive, ChatPurge
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_purge(session, room_id):
+    """تسجيل حذف رسائل غرفة مغلقة لاحقاً على دفعات بدلاً من حذفها داخل معاملة الإغلاق"""
+    schedule_purges(session, [room_id])
+
+
+def schedule_purges(session, room_ids):
+    """مثل schedule_purge لعدة غرف باستعلام تجميعي واحد"""
+    if not room_ids:
+        return
+    rows = session.query(ChatMessage.room_id, func.max(ChatMessage.id)) \
+        .filter(ChatMessage.room_id.in_(room_ids)).group_by(ChatMessage.room_id).all()
+    session.bulk_insert_mappings(ChatPurge, [
+        {"room_id": room_id, "max_message_id": max_id} for room_id, max_id in rows
+    ])
+
+
+class RedisRunLock:
+    """قفل في Redis يسمح لعملية واحدة فقط بتشغيل المهمة في كل دورة، حتى مع --scale app=N
+
+    لا يُحرر القفل بعد التشغيل، بل ينتهي قبل الدورة التالية بقليل فتأخذه أول عملية تصل إليه.
+    """
+
+    def __init__(self, url, key="chat_retention:lock", ttl=540):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.key = key
+        self.ttl = max(1, int(ttl))
+
+    def acquire(self):
+        return bool(self._redis.set(self.key, "1", nx=True, ex=self.ttl))
+
+
+def read_archive(archive):
+    """رسائل دفعة مؤرشفة كقواميس بنفس شكل message_to_dict"""
+    return [
+        {"id": message_id, "room_id": archive.room_id, "sender": sender, "message": message, "timestamp": timestamp}
+        for message_id, sender, message, timestamp in json.loads(zlib.decompress(archive.payload))
+    ]
+
+
+class ChatRetention:
+    """أرشفة وحذف الرسائل في الخلفية على دفعات صغيرة حتى لا تحجز أي معاملة قاعدة البيانات طويلاً
+
+    - رسائل الغرف المغلقة (ChatPurge) تُحذف بدون أرشفة.
+    - الرسائل الأقدم من retention_days والزائدة عن max_per_room في كل غرفة تُنقل إلى ChatArchive مضغوطة.
+    كل دفعة معاملة مستقلة تُنفذ عبر run_transaction (كاتب قاعدة البيانات)، فتتخللها كتابات التطبيق العادية.
+    الغرف التي تحتاج أرشفة تُحدد باستعلام تجميعي واحد عبر run_read خارج الكاتب، فلا تُرسل للكاتب إلا دفعات فعلية.
+    إذا مُرر lock فلا تعمل الدورة إلا إذا أخذت العملية القفل (انظر RedisRunLock).
+    """
+
+    def __init__(self, run_transaction, run_read, max_per_room=None, retention_days=None, chunk_size=500,
+                 interval=600, lock=None, name="chat-retention"):
+        self.run_transaction = run_transaction
+        self.run_read = run_read
+        self.max_per_room = max_per_room
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.lock = lock
+        self.name = name
+        self._thread = None
+
+        # إحصائيات
+        self.purged = 0
+        self.archived = 0
+        self.archives = 0
+        self.runs = 0
+        self.skipped = 0
+        self.last_run_seconds = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self.lock is not None and not self.lock.acquire():
+                    # عملية أخرى تشغل هذه الدورة
+                    self.skipped += 1
+                    continue
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Chat retention run failed: {e}")
+
+    def run_once(self):
+        started = time.monotonic()
+        while self.run_transaction(self._purge_chunk):
+            pass
+
+        if self.retention_days or self.max_per_room:
+            cutoff = datetime.utcnow() - timedelta(days=self.retention_days) if self.retention_days else None
+            for room_id, count, oldest in self.run_read(self._candidate_rooms, cutoff):
+                if cutoff is not None and oldest is not None and oldest < cutoff:
+                    while True:
+                        archived = self.run_transaction(self._archive_expired_chunk, room_id, cutoff)
+                        count -= archived
+                        if archived < self.chunk_size:
+                            break
+                # الزيادة تُحسب مرة واحدة من عدد الاستعلام التجميعي وتُنقص بعد كل دفعة
+                excess = count - self.max_per_room if self.max_per_room else 0
+                while excess > 0:
+                    archived = self.run_transaction(self._archive_over_cap_chunk, room_id, excess)
+                    if not archived:
+                        break
+                    excess -= archived
+
+        self.runs += 1
+        self.last_run_seconds = time.monotonic() - started
+
+    def _purge_chunk(self):
+        """حذف دفعة من رسائل أقدم غرفة مغلقة، ويعيد True إذا بقي عمل"""
+        purge = ChatPurge.query.order_by(ChatPurge.id).first()
+        if purge is None:
+            return False
+        ids = [message_id for (message_id,) in db.session.query(ChatMessage.id).filter(
+            ChatMessage.room_id == purge.room_id, ChatMessage.id <= purge.max_message_id
+        ).limit(self.chunk_size)]
+        if ids:
+            ChatMessage.query.filter(ChatMessage.id.in_(ids)).delete(synchronize_session=False)
+            self.purged += len(ids)
+        if len(ids) < self.chunk_size:
+            db.session.delete(purge)
+        return True
+
+    def _candidate_rooms(self, cutoff):
+        """الغرف الموجودة التي تتجاوز max_per_room أو فيها رسائل أقدم من cutoff، كـ (الغرفة، العدد، أقدم وقت)"""
+        count = func.count(ChatMessage.id)
+        oldest = func.min(ChatMessage.timestamp)
+        conditions = []
+        if self.max_per_room:
+            conditions.append(count > self.max_per_room)
+        if cutoff is not None:
+            conditions.append(oldest < cutoff)
+        rows = db.session.query(ChatMessage.room_id, count, oldest) \
+            .group_by(ChatMessage.room_id).having(or_(*conditions)).all()
+        if not rows:
+            return []
+        # رسائل الغرف المغلقة تُحذف عبر ChatPurge ولا تُؤرشف
+        open_rooms = {room_id for (room_id,) in
+                      db.session.query(Room.id).filter(Room.id.in_([row[0] for row in rows]))}
+        return [tuple(row) for row in rows if row[0] in open_rooms]
+
+    def _archive_expired_chunk(self, room_id, cutoff):
+        """أرشفة دفعة من الرسائل الأقدم من cutoff، ويعيد عدد الرسائل المؤرشفة"""
+        rows = ChatMessage.query.filter(
+            ChatMessage.room_id == room_id, ChatMessage.timestamp < cutoff
+        ).order_by(ChatMessage.timestamp).limit(self.chunk_size).all()
+        return self._archive(room_id, rows)
+
+    def _archive_over_cap_chunk(self, room_id, excess):
+        """أرشفة دفعة من أقدم الرسائل الزائدة عن max_per_room (excess منها)، ويعيد عدد الرسائل المؤرشفة"""
+        rows = ChatMessage.query.filter_by(room_id=room_id).order_by(ChatMessage.id) \
+            .limit(min(excess, self.chunk_size)).all()
+        return self._archive(room_id, rows)
+
+    def _archive(self, room_id, rows):
+        """نقل الرسائل إلى دفعة أرشيف مضغوطة واحدة، ويعيد عدد الرسائل المنقولة"""
+        if not rows:
+            return 0
+        payload = [
+            [row.id, row.sender, row.message, row.timestamp.isoformat() if row.timestamp else None]
+            for row in rows
+        ]
+        timestamps = [row.timestamp for row in rows if row.timestamp]
+        db.session.add(ChatArchive(
+            room_id=room_id,
+            first_message_id=min(row.id for row in rows),
+            last_message_id=max(row.id for row in rows),
+            first_timestamp=min(timestamps) if timestamps else None,
+            last_timestamp=max(timestamps) if timestamps else None,
+            message_count=len(rows),
+            payload=zlib.compress(json.dumps(payload, ensure_ascii=False).encode(), 6),
+        ))
+        ChatMessage.query.filter(ChatMessage.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+        self.archived += len(rows)
+        self.archives += 1
+        return len(rows)
+
+    def stats(self):
+        return {
+            "purged": self.purged,
+            "archived": self.archived,
+            "archives": self.archives,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+        }
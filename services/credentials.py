@@ -0,0 +1,54 @@
+import os
+import base64
+import hashlib
+import secrets
+import string
+from cryptography.fernet import Fernet, InvalidToken
+
+
+# القيمة الافتراضية لـ SECRET_KEY في config.py، وهي معروفة فلا يُشتق منها مفتاح
+_DEFAULT_SECRET_KEY = "mysecretkey"
+
+
+def _load_key():
+    """تحميل مفتاح تشفير بيانات اعتماد VPN من المتغيرات البيئية
+
+    VPN_CREDENTIALS_KEY مفتاح Fernet مستقل (الأفضل)، وإلا يُشتق مفتاح من SECRET_KEY بشرط ألا تكون
+    القيمة الافتراضية. بدون أحدهما يرفض التطبيق التشغيل بدلاً من تشفير كلمات المرور بمفتاح يعرفه الجميع.
+    """
+    key = os.getenv("VPN_CREDENTIALS_KEY")
+    if key:
+        try:
+            Fernet(key.encode())
+        except ValueError:
+            raise ValueError("VPN_CREDENTIALS_KEY must be a Fernet key "
+                             "(python -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\")")
+        return key.encode()
+    secret = os.getenv("SECRET_KEY")
+    if not secret or secret == _DEFAULT_SECRET_KEY:
+        raise ValueError("VPN_CREDENTIALS_KEY (or a non-default SECRET_KEY) must be set to encrypt stored VPN passwords")
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+
+
+_fernet = Fernet(_load_key())
+
+
+def encrypt_password(password):
+    """تشفير كلمة مرور VPN قبل حفظها في قاعدة البيانات"""
+    return _fernet.encrypt(password.encode()).decode()
+
+
+def decrypt_password(token):
+    """فك تشفير كلمة مرور VPN المخزنة، ويعيد None إذا كانت غير صالحة"""
+    if not token:
+        return None
+    try:
+        return _fernet.decrypt(token.encode()).decode()
+    except (InvalidToken, ValueError):
+        return None
+
+
+def generate_vpn_password(length=12):
+    """توليد كلمة مرور عشوائية لمستخدم VPN بمولد آمن (secrets) لأنها تُخزن وتُعاد كبيانات اعتماد"""
+    alphabet = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(alphabet) for _ in range(length))
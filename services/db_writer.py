@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# إعدادات SQLite لكل اتصال: WAL يسمح للقراء بالعمل أثناء الكتابة، وNORMAL آمن مع WAL وأسرع من FULL
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+
+def configure_sqlite(engine):
+    """تطبيق SQLITE_PRAGMAS على كل اتصال جديد بقاعدة SQLite (لا شيء لقواعد البيانات الأخرى)"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    # الاتصالات المفتوحة قبل تسجيل المستمع تُغلق حتى تُنشأ من جديد بالإعدادات
+    engine.dispose()
+
+
+class DatabaseWriter:
+    """كاتب قاعدة بيانات واحد: معاملات الكتابة تُنفذ بالترتيب في خيط واحد بجلسة خاصة به
+
+    بما أن كاتباً واحداً فقط يكتب في العملية فلا تتنافس الكتابات على قفل SQLite ولا حاجة لإعادة
+    المحاولة، بينما يقرأ باقي الخيوط بالتوازي (WAL). كل دالة تُرسل تعمل داخل app context
+    ويُحفظ ما غيرته في db.session عند انتهائها، أو يُتراجع عنه إذا رفعت استثناء.
+    الجلسة تُغلق بعد كل معاملة، لذلك يجب أن تعيد الدوال بيانات عادية وليس كائنات ORM.
+    """
+
+    def __init__(self, db, max_queue=10000, name="db-writer"):
+        self.db = db
+        self.name = name
+        self._app = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+        # إحصائيات
+        self.executed = 0
+        self.failed = 0
+        self.max_wait_seconds = 0.0
+
+    def init_app(self, app):
+        self._app = app
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """إضافة معاملة كتابة إلى الطابور، ويعيد Future بنتيجة الدالة"""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # معاملة تُرسل من داخل معاملة أخرى تُنفذ مباشرة حتى لا ينتظر الكاتب نفسه
+            future.set_result(func(*args, **kwargs))
+            return future
+        if self._closed:
+            raise RuntimeError(f"{self.name} is closed")
+        self._ensure_started()
+        self._queue.put((future, func, args, kwargs, time.monotonic()))
+        return future
+
+    def run(self, func, *args, timeout=None, **kwargs):
+        """تنفيذ معاملة كتابة وانتظار نتيجتها (الاستثناءات تُرفع عند المستدعي)"""
+        return self.submit(func, *args, **kwargs).result(timeout)
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                future, func, args, kwargs, queued_at = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.max_wait_seconds = max(self.max_wait_seconds, time.monotonic() - queued_at)
+                try:
+                    result = func(*args, **kwargs)
+                    self.db.session.commit()
+                    self.executed += 1
+                    future.set_result(result)
+                except Exception as e:
+                    self.db.session.rollback()
+                    self.failed += 1
+                    logger.error(f"Write transaction {getattr(func, '__name__', func)} failed: {e}")
+                    future.set_exception(e)
+                finally:
+                    self.db.session.close()
+
+    def close(self, timeout=10):
+        """تنفيذ ما تبقى في الطابور ثم إيقاف الخيط"""
+        self._closed = True
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "executed": self.executed,
+            "failed": self.failed,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
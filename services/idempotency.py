@@ -0,0 +1,170 @@
+import json
+import time
+import base64
+import threading
+
+
+class IdempotencyConflict(Exception):
+    """يُرفع عند إعادة استخدام مفتاح Idempotency-Key مع طلب مختلف"""
+
+
+class IdempotencyInProgress(Exception):
+    """يُرفع عندما يطول انتظار طلب مكرر لنتيجة الطلب الأصلي أكثر من wait_timeout"""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Request with this Idempotency-Key is still in progress")
+        self.retry_after = retry_after
+
+
+class IdempotencyStore:
+    """مخزن مؤقت لنتائج الطلبات حسب مفتاح Idempotency-Key مع مدة صلاحية"""
+
+    def __init__(self, ttl=3600, max_entries=50000, wait_timeout=30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def _purge(self, now):
+        if now - self._last_purge < 60 and len(self._entries) < self.max_entries:
+            return
+        self._last_purge = now
+        expired = [key for key, entry in self._entries.items()
+                   if entry["expires_at"] is not None and entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def execute(self, key, fingerprint, func):
+        """تنفيذ func مرة واحدة لكل مفتاح، وإعادة النتيجة المخزنة عند تكرار الطلب"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._purge(now)
+                entry = self._entries.get(key)
+                if entry is not None and entry["expires_at"] is not None and entry["expires_at"] <= now:
+                    del self._entries[key]
+                    entry = None
+
+                if entry is None:
+                    # أول طلب بهذا المفتاح: نحجزه ونعلم الطلبات المتزامنة بالانتظار
+                    entry = {"fingerprint": fingerprint, "done": threading.Event(), "result": None, "expires_at": None}
+                    self._entries[key] = entry
+                    self.misses += 1
+                    break
+
+                if entry["fingerprint"] != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key reused with a different request")
+
+                if entry["done"].is_set():
+                    self.hits += 1
+                    return entry["result"]
+
+                done = entry["done"]
+
+            # طلب مكرر أثناء تنفيذ الطلب الأصلي: ننتظر نتيجته حتى wait_timeout فقط
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not done.wait(remaining):
+                raise IdempotencyInProgress()
+
+        try:
+            result, cacheable = func()
+        except Exception:
+            with self._lock:
+                self._entries.pop(key, None)
+            entry["done"].set()
+            raise
+
+        with self._lock:
+            if cacheable:
+                entry["result"] = result
+                entry["expires_at"] = time.monotonic() + self.ttl
+            else:
+                self._entries.pop(key, None)
+        entry["done"].set()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class RedisIdempotencyStore:
+    """نفس IdempotencyStore مشتركاً بين عدة عمليات عبر Redis، حتى لا تكرر إعادة المحاولة آثار الطلب
+    إذا وصلت إلى عملية أخرى
+
+    الطلب الأول يحجز المفتاح (SET NX) بحالة pending تنتهي بعد pending_ttl إذا توقفت العملية المنفذة،
+    والطلبات المكررة تنتظر حتى تُحفظ النتيجة. النتيجة (المحتوى، الحالة، النوع) تُحفظ كـ JSON.
+    """
+
+    def __init__(self, url, ttl=3600, wait_timeout=30, pending_ttl=120, poll_interval=0.05, prefix="idempotency"):
+        import redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.pending_ttl = pending_ttl
+        self.poll_interval = poll_interval
+        self._prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self._prefix}:{key}"
+
+    def execute(self, key, fingerprint, func):
+        """تنفيذ func مرة واحدة لكل مفتاح، وإعادة النتيجة المخزنة عند تكرار الطلب"""
+        redis_key = self._key(key)
+        pending = json.dumps({"fingerprint": fingerprint, "done": False})
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            if self._redis.set(redis_key, pending, nx=True, ex=self.pending_ttl):
+                self.misses += 1
+                break
+
+            value = self._redis.get(redis_key)
+            if value is None:
+                # انتهت صلاحية المفتاح بين المحاولتين
+                continue
+            entry = json.loads(value)
+            if entry["fingerprint"] != fingerprint:
+                raise IdempotencyConflict("Idempotency-Key reused with a different request")
+            if entry["done"]:
+                self.hits += 1
+                body, status, mimetype = entry["result"]
+                return base64.b64decode(body), status, mimetype
+
+            # طلب مكرر أثناء تنفيذ الطلب الأصلي (ربما في عملية أخرى): ننتظر نتيجته حتى wait_timeout فقط،
+            # فإذا توقفت العملية المنفذة لا يبقى الطلب محجوزاً حتى انتهاء pending_ttl
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress()
+            time.sleep(self.poll_interval)
+
+        try:
+            result, cacheable = func()
+        except Exception:
+            self._redis.delete(redis_key)
+            raise
+
+        if cacheable:
+            body, status, mimetype = result
+            self._redis.set(redis_key, json.dumps({
+                "fingerprint": fingerprint, "done": True,
+                "result": [base64.b64encode(body).decode(), status, mimetype],
+            }), ex=self.ttl)
+        else:
+            self._redis.delete(redis_key)
+        return result
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_idempotency_store(url=None, ttl=3600, wait_timeout=30):
+    """إنشاء مخزن Idempotency-Key المناسب: Redis إذا تم تحديد رابط، وإلا مخزن داخل العملية"""
+    if url:
+        return RedisIdempotencyStore(url, ttl=ttl, wait_timeout=wait_timeout)
+    return IdempotencyStore(ttl=ttl, wait_timeout=wait_timeout)
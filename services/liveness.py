@@ -0,0 +1,117 @@
+import threading
+import time
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class LivenessTable:
+    """جدول آخر ظهور لكل جلسة في مصفوفة مفهرسة بخانة ثابتة لكل جلسة
+
+    النبضة تكتب قيمة الساعة الحالية في خانة الجلسة فقط، دون سجلات أو كائنات جديدة.
+    خيط واحد يحدّث الساعة كل ثانية ويفحص كل الخانات دفعة واحدة كل sweep_interval ثانية،
+    ويمرر الجلسات التي لم ترسل نبضة خلال timeout ثانية إلى on_stale.
+    """
+
+    def __init__(self, on_stale, timeout=90, sweep_interval=15, capacity=1024, name="liveness-sweeper"):
+        # on_stale تستقبل قائمة sid للجلسات المتوقفة
+        self.on_stale = on_stale
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self.name = name
+        # الساعة بالثواني منذ البدء، ويحدّثها خيط الفحص فقط
+        self.clock = 0
+        self._started_at = time.monotonic()
+        self._last_seen = array('l', [0]) * capacity
+        self._sids = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # إحصائيات
+        self.stale_total = 0
+        self.sweeps = 0
+        self.last_sweep_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _grow(self):
+        capacity = len(self._sids)
+        self._last_seen.extend(array('l', [0]) * capacity)
+        self._sids.extend([None] * capacity)
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def register(self, sid):
+        """حجز خانة للجلسة (أو إعادة خانتها الحالية) وتسجيل ظهورها الآن"""
+        with self._lock:
+            slot = self._slots.get(sid)
+            if slot is None:
+                if not self._free:
+                    self._grow()
+                slot = self._free.pop()
+                self._slots[sid] = slot
+                self._sids[slot] = sid
+            self._last_seen[slot] = self.clock
+            self._ensure_started()
+            return slot
+
+    def slot_of(self, sid):
+        return self._slots.get(sid)
+
+    def touch(self, slot):
+        """المسار السريع للنبضة"""
+        self._last_seen[slot] = self.clock
+
+    def release(self, sid):
+        with self._lock:
+            slot = self._slots.pop(sid, None)
+            if slot is not None:
+                self._sids[slot] = None
+                self._free.append(slot)
+
+    def sweep(self):
+        """فحص كل الخانات وإرجاع الجلسات المتوقفة بعد تحرير خاناتها"""
+        started = time.monotonic()
+        deadline = self.clock - self.timeout
+        with self._lock:
+            last_seen = self._last_seen
+            sids = self._sids
+            stale = [sids[slot] for slot in range(len(sids))
+                     if sids[slot] is not None and last_seen[slot] < deadline]
+            for sid in stale:
+                slot = self._slots.pop(sid)
+                sids[slot] = None
+                self._free.append(slot)
+        self.sweeps += 1
+        self.stale_total += len(stale)
+        self.last_sweep_seconds = time.monotonic() - started
+        return stale
+
+    def _run(self):
+        next_sweep = self.clock + self.sweep_interval
+        while True:
+            time.sleep(1)
+            self.clock = int(time.monotonic() - self._started_at)
+            if self.clock < next_sweep:
+                continue
+            next_sweep = self.clock + self.sweep_interval
+            try:
+                stale = self.sweep()
+                if stale:
+                    self.on_stale(stale)
+            except Exception as e:
+                logger.error(f"Error sweeping stale sessions in {self.name}: {e}")
+
+    def stats(self):
+        return {
+            "sessions": len(self._slots),
+            "capacity": len(self._sids),
+            "stale_total": self.stale_total,
+            "sweeps": self.sweeps,
+            "last_sweep_seconds": self.last_sweep_seconds,
+        }
@@ -0,0 +1,261 @@
+import logging
+from models import db, Room, RoomPlayer
+from services.credentials import encrypt_password, decrypt_password, generate_vpn_password
+from database.upsert import insert_ignore, upsert
+from services.chat_retention import schedule_purge
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipError(Exception):
+    """خطأ في عملية انضمام أو مغادرة مع رمز حالة HTTP المناسب"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def hub_name_for(room_id):
+    return f"room_{room_id}"
+
+
+class MembershipService:
+    """خدمة عضوية الغرف المشتركة بين مسارات HTTP ومعالجات Socket.IO
+
+    كل عملية انضمام أو مغادرة تتم في معاملة قاعدة بيانات واحدة ودفعة أوامر VPN واحدة.
+    """
+
+    def __init__(self, vpn):
+        self.vpn = vpn
+        self._listeners = []
+        self._router = None
+
+    def subscribe(self, listener):
+        """تسجيل دالة تُستدعى بعد كل تغيير محفوظ في العضوية: listener(event, room_id, username)
+
+        الأحداث: joined و left و room_deleted (آخر لاعب غادر وحُذفت الغرفة).
+        """
+        self._listeners.append(listener)
+
+    def set_router(self, router):
+        """تمرير الأحداث عبر router(event, room_id, username) قبل المستمعين؛ إذا أعاد True فالحدث أُرسل لعملية أخرى"""
+        self._router = router
+
+    def notify(self, event, room_id, username):
+        if self._router is not None and self._router(event, room_id, username):
+            return
+        for listener in self._listeners:
+            try:
+                listener(event, str(room_id), username)
+            except Exception as e:
+                logger.error(f"Membership listener failed for {event} in room {room_id}: {e}")
+
+    def _stage_removal(self, rp, room):
+        """تجهيز حذف لاعب داخل الجلسة الحالية دون حفظ، ويعيد (أوامر VPN، نتيجة المغادرة)"""
+        hub_name = hub_name_for(room.id)
+        is_host = rp.is_host
+        db.session.delete(rp)
+        db.session.flush()
+
+        players_left = RoomPlayer.query.filter_by(room_id=room.id).count()
+        room.current_players = players_left
+        result = {"left": True, "room_deleted": False, "players_left": players_left, "new_host": None}
+
+        if players_left == 0:
+            # حذف الهاب يحذف مستخدميه أيضاً، فلا حاجة لـ UserDelete
+            # رسائل الغرفة تُحذف لاحقاً على دفعات في الخلفية
+            schedule_purge(db.session, room.id)
+            db.session.delete(room)
+            result["room_deleted"] = True
+            return [(None, f"HubDelete {hub_name}")], result
+
+        if is_host:
+            new_host = RoomPlayer.query.filter_by(room_id=room.id).first()
+            if new_host:
+                new_host.is_host = True
+                room.owner_username = new_host.player_username
+                result["new_host"] = new_host.player_username
+                logger.info(f"New host assigned: {new_host.player_username}")
+
+        return [(hub_name, f"UserDelete {rp.username}")], result
+
+    def join(self, room_id, player_username):
+        """انضمام لاعب إلى غرفة مع إنشاء مستخدم VPN له، ويعيد بيانات الاتصال"""
+        room = Room.query.get(room_id)
+        if not room:
+            raise MembershipError("Room not found", 404)
+        hub_name = hub_name_for(room.id)
+
+        existing = RoomPlayer.query.filter_by(room_id=room.id, player_username=player_username).first()
+        if existing:
+            # اللاعب موجود بالفعل: نعيد بيانات الاتصال المخزنة دون أي استدعاء لـ vpncmd
+            vpn_password = decrypt_password(existing.vpn_password_encrypted)
+            if vpn_password is None:
+                # سجل قديم بلا كلمة مرور مخزنة: نعيد تعيين كلمة المرور فقط بدلاً من حذف المستخدم وإعادة إنشائه
+                vpn_password = generate_vpn_password()
+                logger.info(f"No stored VPN password for {existing.username} in hub {hub_name}, resetting it")
+                if not self.vpn.set_user_password(hub_name, existing.username, vpn_password):
+                    raise MembershipError("Failed to reset VPN password", 500)
+                existing.vpn_password_encrypted = encrypt_password(vpn_password)
+                db.session.commit()
+            return {"vpn_username": existing.username, "vpn_password": vpn_password, "rejoined": True}
+
+        players_count = RoomPlayer.query.filter_by(room_id=room.id).count()
+        if players_count >= room.max_players:
+            raise MembershipError("Room is full", 400)
+
+        # مستخدم VPN الجديد يُنشأ قبل أي تعديل في الجلسة، فلا تبقى معاملة كتابة مفتوحة (وقفل SQLite)
+        # أثناء تشغيل vpncmd، ومن أول flush حتى الحفظ لا يوجد أي استدعاء خارجي
+        username = player_username.split('@')[0]
+        vpn_password = generate_vpn_password()
+        if not self.vpn.create_users(hub_name, {username: vpn_password}):
+            logger.error(f"Failed to create VPN user: {username} in hub: {hub_name}")
+            raise MembershipError("Failed to create VPN user", 500)
+
+        old_operations = []
+        old_room_event = None
+        try:
+            # قبل ما ينضم، نتأكد إذا هو موجود بغرفة ثانية ونخرجه منها في نفس المعاملة
+            old_membership = RoomPlayer.query.filter_by(player_username=player_username).first()
+            if old_membership:
+                old_room = Room.query.get(old_membership.room_id)
+                if old_room:
+                    old_operations, old_result = self._stage_removal(old_membership, old_room)
+                    old_room_event = ("room_deleted" if old_result["room_deleted"] else "left", old_room.id)
+
+            # طلب انضمام متزامن لنفس اللاعب قد يسبقنا، فنحدث بيانات VPN في سجله بدلاً من فشل القيد الفريد
+            upsert(db.session, RoomPlayer,
+                   {"room_id": room.id, "player_username": player_username, "username": username,
+                    "is_host": False, "vpn_password_encrypted": encrypt_password(vpn_password)},
+                   ["room_id", "player_username"], ["username", "vpn_password_encrypted"])
+            room.current_players = RoomPlayer.query.filter_by(room_id=room.id).count()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # المستخدم الجديد أُنشئ قبل الحفظ، فيُحذف حتى لا يبقى في الهاب بدون عضوية
+            if not self.vpn.delete_users(hub_name, [username]):
+                logger.error(f"Failed to delete VPN user {username} from hub {hub_name} after rollback")
+            raise
+
+        # الحذف من الغرفة القديمة (UserDelete أو HubDelete) بعد الحفظ فقط، فلا يُحذف الهاب أو المستخدم إذا تراجعت المعاملة
+        if old_operations and not self.vpn.run_commands(old_operations):
+            logger.error(f"Failed to run VPN cleanup for {player_username} in hub: {hub_name_for(old_room_event[1])}")
+
+        if old_room_event:
+            self.notify(old_room_event[0], old_room_event[1], player_username)
+        self.notify("joined", room.id, player_username)
+        return {"vpn_username": username, "vpn_password": vpn_password, "rejoined": False}
+
+    def bulk_join(self, room_id, usernames):
+        """انضمام مجموعة لاعبين بدفعة VPN واحدة ومعاملة واحدة، ويعيد بيانات الاتصال لكل مستخدم"""
+        room = Room.query.get(room_id)
+        if not room:
+            raise MembershipError("Room not found", 404)
+        hub_name = hub_name_for(room.id)
+        results = {}
+
+        # جلب العضويات الحالية لكل المستخدمين المطلوبين باستعلام واحد
+        memberships = RoomPlayer.query.filter(RoomPlayer.player_username.in_(usernames)).all()
+        membership_by_user = {m.player_username: m for m in memberships}
+
+        # أسماء مستخدمي VPN المستخدمة في الهاب: لاعبان بنفس الجزء قبل @ (bob@a.com و bob@b.com) سيتشاركان مستخدماً واحداً
+        taken_vpn_usernames = {vpn_username for (vpn_username,) in
+                               db.session.query(RoomPlayer.username).filter_by(room_id=room.id)}
+
+        new_players = {}
+        for player_username in dict.fromkeys(usernames):
+            existing = membership_by_user.get(player_username)
+            if existing is None:
+                vpn_username = player_username.split('@')[0]
+                if vpn_username in taken_vpn_usernames:
+                    results[player_username] = {"error": "VPN username already in use in this room"}
+                    continue
+                taken_vpn_usernames.add(vpn_username)
+                new_players[player_username] = (vpn_username, generate_vpn_password())
+            elif existing.room_id == room.id:
+                # موجود بالفعل في الغرفة: نعيد بياناته المخزنة
+                vpn_password = decrypt_password(existing.vpn_password_encrypted)
+                if vpn_password is None:
+                    results[player_username] = {"error": "Stored VPN credentials unavailable, use join_room"}
+                else:
+                    results[player_username] = {"vpn_username": existing.username, "vpn_password": vpn_password}
+            else:
+                results[player_username] = {"error": "Player is already in another room"}
+
+        # التحقق من السعة مرة واحدة لكل الدفعة
+        players_count = RoomPlayer.query.filter_by(room_id=room.id).count()
+        if players_count + len(new_players) > room.max_players:
+            raise MembershipError("Room is full", 400)
+
+        if not new_players:
+            return results
+
+        logger.info(f"Creating {len(new_players)} VPN users in hub: {hub_name}")
+        if not self.vpn.create_users(hub_name, dict(new_players.values())):
+            logger.error(f"Failed to create VPN users in hub: {hub_name}")
+            raise MembershipError("Failed to create VPN users", 500)
+
+        try:
+            db.session.add_all([
+                RoomPlayer(room_id=room.id, player_username=player_username, username=vpn_username, is_host=False,
+                           vpn_password_encrypted=encrypt_password(vpn_password))
+                for player_username, (vpn_username, vpn_password) in new_players.items()
+            ])
+            room.current_players = players_count + len(new_players)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # المستخدمون أُنشئوا قبل الحفظ، فيُحذفون حتى لا يبقوا في الهاب بدون عضوية (مثلاً عند انضمام متزامن)
+            vpn_usernames = [vpn_username for vpn_username, _ in new_players.values()]
+            if not self.vpn.delete_users(hub_name, vpn_usernames):
+                logger.error(f"Failed to delete VPN users {vpn_usernames} from hub {hub_name} after rollback")
+            raise
+
+        for player_username, (vpn_username, vpn_password) in new_players.items():
+            results[player_username] = {"vpn_username": vpn_username, "vpn_password": vpn_password}
+            self.notify("joined", room.id, player_username)
+        return results
+
+    def add_player(self, room_id, player_username):
+        """تسجيل لاعب في الغرفة دون إنشاء مستخدم VPN (لاتصالات Socket.IO)، ويعيد True إذا أضيف"""
+        try:
+            added = insert_ignore(db.session, RoomPlayer,
+                                  {"room_id": room_id, "player_username": player_username,
+                                   "is_host": False, "username": player_username},
+                                  ["room_id", "player_username"])
+            if not added:
+                db.session.rollback()
+                return False
+            room = Room.query.get(room_id)
+            if room:
+                room.current_players = RoomPlayer.query.filter_by(room_id=room_id).count()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.notify("joined", room_id, player_username)
+        return True
+
+    def leave(self, room_id, player_username):
+        """مغادرة لاعب للغرفة مع حذف الغرفة والهاب إذا أصبحت فارغة، ويعيد None إذا لم توجد الغرفة"""
+        room = Room.query.get(room_id)
+        if not room:
+            return None
+
+        rp = RoomPlayer.query.filter_by(room_id=room.id, player_username=player_username).first()
+        if not rp:
+            return {"left": False, "room_deleted": False, "players_left": room.current_players, "new_host": None}
+
+        try:
+            operations, result = self._stage_removal(rp, room)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # أوامر VPN بعد الحفظ حتى لا يُحذف المستخدم أو الهاب إذا تراجعت المعاملة
+        if not self.vpn.run_commands(operations):
+            logger.error(f"Failed to run VPN cleanup for {player_username} in hub: {hub_name_for(room_id)}")
+        logger.info(f"Player {player_username} left room {room_id}: {result}")
+        self.notify("room_deleted" if result["room_deleted"] else "left", room_id, player_username)
+        return result
@@ -0,0 +1,24 @@
+import threading
+
+# سجل مصادر المقاييس: اسم القسم -> دالة تعيد قاموساً بالقيم الحالية
+_providers = {}
+_lock = threading.Lock()
+
+
+def register_metrics(name, provider):
+    """تسجيل دالة تعيد مقاييس قسم معين لعرضها في /metrics"""
+    with _lock:
+        _providers[name] = provider
+
+
+def collect_metrics():
+    """جمع المقاييس الحالية من كل الأقسام المسجلة"""
+    with _lock:
+        providers = list(_providers.items())
+    result = {}
+    for name, provider in providers:
+        try:
+            result[name] = provider()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
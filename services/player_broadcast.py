@@ -0,0 +1,82 @@
+import threading
+import logging
+from services.scheduler import TimerScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerListBroadcaster:
+    """تجميع تغييرات عضوية كل غرفة خلال نافذة قصيرة وإرسالها كفرق واحد مرقّم بإصدار
+
+    العميل يطبق الفروق بالترتيب، وإذا لاحظ فجوة في الإصدارات يطلب القائمة كاملة عبر get_players.
+    """
+
+    def __init__(self, emit, versions, window=0.2):
+        # emit(room_id, payload) ترسل حدث players_delta لأعضاء الغرفة
+        self.emit = emit
+        # مخزن الإصدارات (مخزن الحضور) حتى تتفق العمليات المختلفة على الترقيم
+        self.versions = versions
+        self.window = window
+        self._lock = threading.Lock()
+        # room_id -> {username: [أول حدث، آخر حدث]}
+        self._pending = {}
+        self._deleted = set()
+        self._timers = TimerScheduler(self._flush, name="player-broadcast", batch_window=0)
+        self.changes_total = 0
+        self.emitted_total = 0
+
+    def record(self, event, room_id, username):
+        """تسجيل تغيير عضوية (joined أو left أو room_deleted) لإرساله مع دفعة الغرفة"""
+        room_id = str(room_id)
+        with self._lock:
+            self.changes_total += 1
+            if event == "room_deleted":
+                self._deleted.add(room_id)
+                event = "left"
+            else:
+                self._deleted.discard(room_id)
+
+            changes = self._pending.get(room_id)
+            if changes is None:
+                changes = self._pending[room_id] = {}
+                # أول تغيير في الغرفة يفتح النافذة، والتغييرات اللاحقة تنضم لنفس الدفعة
+                self._timers.schedule(room_id, self.window, room_id)
+
+            change = changes.get(username)
+            if change is None:
+                changes[username] = [event, event]
+            else:
+                change[1] = event
+
+    def _flush(self, room_ids):
+        for room_id in room_ids:
+            with self._lock:
+                changes = self._pending.pop(room_id, {})
+                deleted = room_id in self._deleted
+                self._deleted.discard(room_id)
+
+            try:
+                if deleted:
+                    # لا يوجد من يستقبل الفرق بعد حذف الغرفة
+                    self.versions.drop_room_version(room_id)
+                    continue
+
+                # إذا اختلف أول حدث عن آخره فاللاعب عاد إلى حالته الأصلية ولا داعي لإرساله
+                joined = [username for username, (first, last) in changes.items() if first == last == "joined"]
+                left = [username for username, (first, last) in changes.items() if first == last == "left"]
+                if not joined and not left:
+                    continue
+
+                version = self.versions.next_room_version(room_id)
+                self.emit(room_id, {"room_id": room_id, "version": version, "joined": joined, "left": left})
+                self.emitted_total += 1
+            except Exception as e:
+                logger.error(f"Failed to broadcast player changes for room {room_id}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending_rooms": len(self._pending),
+                "changes_total": self.changes_total,
+                "emitted_total": self.emitted_total,
+            }
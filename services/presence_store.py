@@ -0,0 +1,285 @@
+import json
+import threading
+
+
+class PresenceSession:
+    """مدخل جلسة مضغوط"""
+    __slots__ = ("sid", "room_id", "username")
+
+    def __init__(self, sid, room_id, username):
+        self.sid = sid
+        self.room_id = room_id
+        self.username = username
+
+
+class PresenceRegistry:
+    """سجل الحضور داخل العملية مع فهارس sid والغرفة والمستخدم (لعملية واحدة أو للاختبارات)
+
+    كل التحديثات والاستعلامات O(1)، والغرف التي تغيرت تُجمع حتى يفحص التنظيف التدريجي ما تغير فقط.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # sid -> PresenceSession
+        self._sessions = {}
+        # room_id -> {sid}
+        self._room_sids = {}
+        # username -> {sid}
+        self._user_sids = {}
+        # (room_id, username) -> sid
+        self._disconnected = {}
+        # room_id -> {username} للاعبين المنقطعين
+        self._room_disconnected = {}
+        self._dirty_rooms = set()
+        # room_id -> إصدار قائمة اللاعبين
+        self._room_versions = {}
+
+    def _index_add(self, index, key, value):
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = set()
+        bucket.add(value)
+
+    def _index_remove(self, index, key, value):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(value)
+            if not bucket:
+                del index[key]
+
+    def _remove_session_locked(self, sid):
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return None
+        self._index_remove(self._room_sids, session.room_id, sid)
+        self._index_remove(self._user_sids, session.username, sid)
+        return session
+
+    def set_session(self, sid, room_id, username):
+        room_id = str(room_id)
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is not None and session.room_id == room_id and session.username == username:
+                return
+            self._remove_session_locked(sid)
+            self._sessions[sid] = PresenceSession(sid, room_id, username)
+            self._index_add(self._room_sids, room_id, sid)
+            self._index_add(self._user_sids, username, sid)
+            self._dirty_rooms.add(room_id)
+
+    def get_session(self, sid):
+        with self._lock:
+            session = self._sessions.get(sid)
+            return (session.room_id, session.username) if session else None
+
+    def remove_session(self, sid):
+        with self._lock:
+            session = self._remove_session_locked(sid)
+            return (session.room_id, session.username) if session else None
+
+    def sessions(self):
+        with self._lock:
+            return [(sid, (session.room_id, session.username)) for sid, session in self._sessions.items()]
+
+    def room_sessions(self, room_id):
+        """جلسات غرفة معينة: قائمة (sid، اسم المستخدم)"""
+        with self._lock:
+            return [(sid, self._sessions[sid].username) for sid in self._room_sids.get(str(room_id), ())]
+
+    def user_sessions(self, username):
+        """جلسات مستخدم معين: قائمة (sid، معرف الغرفة)"""
+        with self._lock:
+            return [(sid, self._sessions[sid].room_id) for sid in self._user_sids.get(username, ())]
+
+    def mark_disconnected(self, room_id, username, sid):
+        room_id = str(room_id)
+        with self._lock:
+            self._disconnected[(room_id, username)] = sid
+            self._index_add(self._room_disconnected, room_id, username)
+            self._dirty_rooms.add(room_id)
+
+    def get_disconnected(self, room_id, username):
+        with self._lock:
+            return self._disconnected.get((str(room_id), username))
+
+    def clear_disconnected(self, room_id, username):
+        """إزالة اللاعب من قائمة المنقطعين، ويعيد True إذا كان فيها"""
+        room_id = str(room_id)
+        with self._lock:
+            if self._disconnected.pop((room_id, username), None) is None:
+                return False
+            self._index_remove(self._room_disconnected, room_id, username)
+            return True
+
+    def disconnected(self):
+        with self._lock:
+            return list(self._disconnected.items())
+
+    def room_disconnected(self, room_id):
+        """اللاعبون المنقطعون في غرفة معينة: قائمة (اسم المستخدم، sid)"""
+        room_id = str(room_id)
+        with self._lock:
+            return [(username, self._disconnected[(room_id, username)])
+                    for username in self._room_disconnected.get(room_id, ())]
+
+    def mark_room_dirty(self, room_id):
+        """تسجيل أن عضوية الغرفة تغيرت حتى يفحصها التنظيف التالي"""
+        with self._lock:
+            self._dirty_rooms.add(str(room_id))
+
+    def take_dirty_rooms(self):
+        """سحب الغرف التي تغيرت منذ آخر تنظيف"""
+        with self._lock:
+            rooms, self._dirty_rooms = self._dirty_rooms, set()
+            return rooms
+
+    def next_room_version(self, room_id):
+        """زيادة إصدار قائمة لاعبي الغرفة وإعادته"""
+        room_id = str(room_id)
+        with self._lock:
+            version = self._room_versions.get(room_id, 0) + 1
+            self._room_versions[room_id] = version
+            return version
+
+    def room_version(self, room_id):
+        with self._lock:
+            return self._room_versions.get(str(room_id), 0)
+
+    def drop_room_version(self, room_id):
+        with self._lock:
+            self._room_versions.pop(str(room_id), None)
+
+    def counts(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "disconnected": len(self._disconnected),
+                "rooms": len(self._room_sids),
+                "dirty_rooms": len(self._dirty_rooms),
+            }
+
+
+class RedisPresenceStore:
+    """مخزن حالة الحضور المشترك بين عدة عمليات عبر Redis (أو أي خادم متوافق معه)"""
+
+    def __init__(self, url, prefix="presence"):
+        import redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._sessions_key = f"{prefix}:sessions"
+        self._disconnected_key = f"{prefix}:disconnected"
+        self._dirty_key = f"{prefix}:dirty_rooms"
+        self._versions_key = f"{prefix}:room_versions"
+
+    def _room_key(self, room_id):
+        return f"{self._prefix}:room:{room_id}"
+
+    def _user_key(self, username):
+        return f"{self._prefix}:user:{username}"
+
+    def _room_disconnected_key(self, room_id):
+        return f"{self._prefix}:room_disconnected:{room_id}"
+
+    @staticmethod
+    def _player_field(room_id, username):
+        return json.dumps([str(room_id), username])
+
+    def set_session(self, sid, room_id, username):
+        room_id = str(room_id)
+        previous = self.get_session(sid)
+        pipe = self._redis.pipeline()
+        if previous and previous != (room_id, username):
+            pipe.srem(self._room_key(previous[0]), sid)
+            pipe.srem(self._user_key(previous[1]), sid)
+        pipe.hset(self._sessions_key, sid, json.dumps([room_id, username]))
+        pipe.sadd(self._room_key(room_id), sid)
+        pipe.sadd(self._user_key(username), sid)
+        pipe.sadd(self._dirty_key, room_id)
+        pipe.execute()
+
+    def get_session(self, sid):
+        value = self._redis.hget(self._sessions_key, sid)
+        return tuple(json.loads(value)) if value else None
+
+    def remove_session(self, sid):
+        session = self.get_session(sid)
+        if session is None:
+            return None
+        pipe = self._redis.pipeline()
+        pipe.hdel(self._sessions_key, sid)
+        pipe.srem(self._room_key(session[0]), sid)
+        pipe.srem(self._user_key(session[1]), sid)
+        pipe.execute()
+        return session
+
+    def sessions(self):
+        return [(sid, tuple(json.loads(value))) for sid, value in self._redis.hgetall(self._sessions_key).items()]
+
+    def room_sessions(self, room_id):
+        sids = list(self._redis.smembers(self._room_key(room_id)))
+        values = self._redis.hmget(self._sessions_key, sids) if sids else []
+        return [(sid, json.loads(value)[1]) for sid, value in zip(sids, values) if value]
+
+    def user_sessions(self, username):
+        sids = list(self._redis.smembers(self._user_key(username)))
+        values = self._redis.hmget(self._sessions_key, sids) if sids else []
+        return [(sid, json.loads(value)[0]) for sid, value in zip(sids, values) if value]
+
+    def mark_disconnected(self, room_id, username, sid):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._disconnected_key, self._player_field(room_id, username), sid)
+        pipe.sadd(self._room_disconnected_key(room_id), username)
+        pipe.sadd(self._dirty_key, str(room_id))
+        pipe.execute()
+
+    def get_disconnected(self, room_id, username):
+        return self._redis.hget(self._disconnected_key, self._player_field(room_id, username))
+
+    def clear_disconnected(self, room_id, username):
+        pipe = self._redis.pipeline()
+        pipe.hdel(self._disconnected_key, self._player_field(room_id, username))
+        pipe.srem(self._room_disconnected_key(room_id), username)
+        removed, _ = pipe.execute()
+        return removed > 0
+
+    def disconnected(self):
+        return [(tuple(json.loads(field)), sid) for field, sid in self._redis.hgetall(self._disconnected_key).items()]
+
+    def room_disconnected(self, room_id):
+        usernames = list(self._redis.smembers(self._room_disconnected_key(room_id)))
+        fields = [self._player_field(room_id, username) for username in usernames]
+        sids = self._redis.hmget(self._disconnected_key, fields) if fields else []
+        return [(username, sid) for username, sid in zip(usernames, sids) if sid]
+
+    def mark_room_dirty(self, room_id):
+        self._redis.sadd(self._dirty_key, str(room_id))
+
+    def take_dirty_rooms(self):
+        pipe = self._redis.pipeline()
+        pipe.smembers(self._dirty_key)
+        pipe.delete(self._dirty_key)
+        rooms, _ = pipe.execute()
+        return set(rooms)
+
+    def next_room_version(self, room_id):
+        return self._redis.hincrby(self._versions_key, str(room_id), 1)
+
+    def room_version(self, room_id):
+        return int(self._redis.hget(self._versions_key, str(room_id)) or 0)
+
+    def drop_room_version(self, room_id):
+        self._redis.hdel(self._versions_key, str(room_id))
+
+    def counts(self):
+        return {
+            "sessions": self._redis.hlen(self._sessions_key),
+            "disconnected": self._redis.hlen(self._disconnected_key),
+            "dirty_rooms": self._redis.scard(self._dirty_key),
+        }
+
+
+def create_presence_store(url=None):
+    """إنشاء مخزن الحضور المناسب: Redis إذا تم تحديد رابط، وإلا مخزن داخل العملية"""
+    if url:
+        return RedisPresenceStore(url)
+    return PresenceRegistry()
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TimerScheduler:
+    """مجدول مؤقتات بخيط واحد (كومة + قاموس مفاتيح) يعالج المؤقتات المنتهية على دفعات"""
+
+    def __init__(self, on_expire, name="timer-scheduler", batch_window=0.25):
+        # on_expire تستقبل قائمة بحمولات كل المؤقتات التي انتهت في نفس الدورة
+        self.on_expire = on_expire
+        self.name = name
+        # المؤقتات التي تنتهي خلال هذه النافذة تُعالج مع الدفعة الحالية
+        self.batch_window = batch_window
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self.expired_total = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def schedule(self, key, delay, payload):
+        """جدولة مؤقت لمفتاح معين (يستبدل أي مؤقت سابق لنفس المفتاح)"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                old[3] = False
+            deadline = time.monotonic() + delay
+            entry = [deadline, next(self._counter), payload, True, key]
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            self._ensure_started()
+            if self._heap[0] is entry:
+                self._wakeup.notify()
+
+    def cancel(self, key):
+        """إلغاء مؤقت بتكلفة O(1)؛ يبقى المدخل في الكومة ويُتجاهل عند انتهائه"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            entry[3] = False
+            return True
+
+    def pending(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    # التخلص من المدخلات الملغاة في رأس الكومة
+                    while self._heap and not self._heap[0][3]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._wakeup.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._wakeup.wait(timeout)
+
+                # جمع كل المؤقتات المنتهية في دفعة واحدة
+                horizon = time.monotonic() + self.batch_window
+                batch = []
+                while self._heap and self._heap[0][0] <= horizon:
+                    entry = heapq.heappop(self._heap)
+                    if entry[3]:
+                        entry[3] = False
+                        del self._entries[entry[4]]
+                        batch.append(entry[2])
+                self.expired_total += len(batch)
+
+            if batch:
+                try:
+                    self.on_expire(batch)
+                except Exception as e:
+                    logger.error(f"Error processing {len(batch)} expired timers in {self.name}: {e}")
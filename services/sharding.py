@@ -0,0 +1,135 @@
+import json
+import logging
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class RoomShards:
+    """توزيع الغرف على عمليات العمال: كل غرفة لها عملية مالكة واحدة تحدد بتجزئة رقمها
+
+    التجزئة ثابتة بين العمليات (crc32 وليس hash الخاص ببايثون) حتى تتفق كل العمليات على المالك.
+    """
+
+    def __init__(self, count=1, index=0, shared=False):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index} of {count}")
+        self.count = count
+        self.index = index
+        # هل تخدم عدة عمليات نفس الغرف (مثلاً --scale app=N)، فلا تكفي ذاكرة أي منها
+        self.shared = shared
+
+    @property
+    def enabled(self):
+        return self.count > 1
+
+    def owner(self, room_id):
+        if self.count == 1:
+            return 0
+        return zlib.crc32(str(room_id).encode()) % self.count
+
+    def is_local(self, room_id):
+        return self.owner(room_id) == self.index
+
+    def owns(self, room_id):
+        """هل هذه العملية وحدها تخدم الغرفة، فتكون حالتها في الذاكرة (سجل الرسائل، قائمة اللاعبين) كاملة"""
+        return self.is_local(room_id) and not self.shared
+
+    def shard_for(self, room_id):
+        """رقم العملية المالكة كما يُرسل للعميل (None عند العمل بعملية واحدة)"""
+        return self.owner(room_id) if self.enabled else None
+
+
+class ShardRouter:
+    """توجيه أحداث العضوية الصادرة من عملية غير مالكة (مسارات HTTP مثلاً) إلى العملية المالكة للغرفة
+
+    كل عملية تستمع على قناة Redis خاصة بها وتمرر ما يصلها إلى deliver(event, room_id, username).
+    عند انقطاع الاتصال بـ Redis يُعاد الاشتراك مع تأخير متزايد حتى max_retry_delay.
+    """
+
+    def __init__(self, shards, url, deliver, prefix="shard", retry_delay=1.0, max_retry_delay=30.0):
+        import redis
+        self.shards = shards
+        self.deliver = deliver
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._thread = None
+        self.forwarded = 0
+        self.received = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    def _channel(self, index):
+        return f"{self._prefix}:{index}:membership"
+
+    def _subscribe(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(self.shards.index))
+        return pubsub
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # الاشتراك الأول قبل العودة حتى لا تضيع الأحداث الموجهة بعد بدء التشغيل
+        pubsub = self._subscribe()
+        self._thread = threading.Thread(target=self._run, args=(pubsub,),
+                                        name=f"shard-router-{self.shards.index}", daemon=True)
+        self._thread.start()
+
+    def _run(self, pubsub):
+        delay = self.retry_delay
+        while True:
+            if pubsub is not None:
+                try:
+                    self._listen(pubsub)
+                except Exception as e:
+                    logger.error(f"Shard router lost its Redis subscription, retrying in {delay}s: {e}")
+                finally:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(delay)
+            try:
+                pubsub = self._subscribe()
+                self.reconnects += 1
+                delay = self.retry_delay
+            except Exception as e:
+                pubsub = None
+                delay = min(delay * 2, self.max_retry_delay)
+                logger.error(f"Shard router failed to resubscribe, retrying in {delay}s: {e}")
+
+    def _listen(self, pubsub):
+        for message in pubsub.listen():
+            try:
+                event, room_id, username = json.loads(message["data"])
+                self.received += 1
+                self.deliver(event, room_id, username)
+            except Exception as e:
+                logger.error(f"Failed to deliver routed membership event {message.get('data')}: {e}")
+
+    def route(self, event, room_id, username):
+        """إرسال الحدث إلى مالك الغرفة، ويعيد False إذا كانت الغرفة محلية ويجب معالجته هنا"""
+        if self.shards.is_local(room_id):
+            return False
+        try:
+            self._redis.publish(self._channel(self.shards.owner(room_id)), json.dumps([event, str(room_id), username]))
+            self.forwarded += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Failed to route {event} for room {room_id} to its shard: {e}")
+        return True
+
+    def stats(self):
+        return {
+            "shard": self.shards.index,
+            "shards": self.shards.count,
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "failed": self.failed,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# حدود أعمدة مدرج زمن المعالجة بالميلي ثانية (العمود الأخير لما يتجاوز آخر حد)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class _EventStats:
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "buckets", "sampled", "payload_bytes")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.sampled = 0
+        self.payload_bytes = 0
+
+    def percentile(self, fraction):
+        """تقدير النسبة المئوية من المدرج (الحد الأعلى للعمود الذي تقع فيه)"""
+        target = self.count * fraction
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target and bucket_count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return 0.0
+
+
+class SocketEventMetrics:
+    """قياس زمن معالجة أحداث Socket.IO وأخطائها وحجم بياناتها ومعدل الأحداث لكل غرفة
+
+    الزمن يُقاس لكل حدث (استدعاءان لـ perf_counter)، أما حجم البيانات فيُقاس لحدث واحد
+    من كل payload_sample_rate حتى لا يكلف ترميز JSON إضافي في كل حدث.
+    """
+
+    def __init__(self, payload_sample_rate=10, rate_window=60, top_rooms=20):
+        self.payload_sample_rate = payload_sample_rate
+        self.rate_window = rate_window
+        self.top_rooms = top_rooms
+        self._lock = threading.Lock()
+        self._events = {}
+        # عدد أحداث كل غرفة في النافذة الحالية، ومعدلاتها في النافذة السابقة
+        self._room_counts = {}
+        self._room_rates = {}
+        self._window_started = time.monotonic()
+
+    def _roll_window(self, now):
+        elapsed = now - self._window_started
+        self._room_rates = {room_id: count / elapsed for room_id, count in self._room_counts.items()}
+        self._room_counts = {}
+        self._window_started = now
+
+    def record(self, event, elapsed_ms, failed, room_id=None, payload=None):
+        with self._lock:
+            stats = self._events.get(event)
+            if stats is None:
+                stats = self._events[event] = _EventStats()
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            if elapsed_ms > stats.max_ms:
+                stats.max_ms = elapsed_ms
+            stats.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            if failed:
+                stats.errors += 1
+            sample = payload is not None and stats.count % self.payload_sample_rate == 0
+
+            if room_id is not None:
+                self._room_counts[room_id] = self._room_counts.get(room_id, 0) + 1
+            now = time.monotonic()
+            if now - self._window_started >= self.rate_window:
+                self._roll_window(now)
+
+        if sample:
+            try:
+                size = len(json.dumps(payload, default=str))
+            except (TypeError, ValueError):
+                return
+            with self._lock:
+                stats.sampled += 1
+                stats.payload_bytes += size
+
+    def instrument(self, event, handler):
+        """تغليف معالج حدث لتسجيل زمنه ونتيجته"""
+        @wraps(handler)
+        def wrapper(*args):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = handler(*args)
+                failed = False
+                return result
+            finally:
+                data = args[0] if args else None
+                room_id = str(data.get('room_id')) if isinstance(data, dict) and 'room_id' in data else None
+                self.record(event, (time.perf_counter() - started) * 1000, failed, room_id, data)
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            events = {
+                event: {
+                    "count": s.count,
+                    "errors": s.errors,
+                    "avg_ms": s.total_ms / s.count if s.count else 0.0,
+                    "p50_ms": s.percentile(0.5),
+                    "p99_ms": s.percentile(0.99),
+                    "max_ms": s.max_ms,
+                    "latency_buckets_ms": dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["inf"], s.buckets)),
+                    "avg_payload_bytes": s.payload_bytes / s.sampled if s.sampled else None,
+                }
+                for event, s in self._events.items()
+            }
+            busiest = sorted(self._room_rates.items(), key=lambda item: item[1], reverse=True)[:self.top_rooms]
+        return {
+            "events": events,
+            "room_events_per_second": dict(busiest),
+            "rate_window_seconds": self.rate_window,
+        }
@@ -0,0 +1,62 @@
+from socketio import packet
+
+try:
+    import msgpack
+except ImportError:  # MessagePack اختياري، وبدونه تبقى كل الاتصالات JSON
+    msgpack = None
+
+# يطلب العميل MessagePack بإضافة هذا المعامل إلى رابط الاتصال
+MSGPACK_QUERY = "serializer=msgpack"
+
+# حزم المرفقات الثنائية خاصة بترميز JSON، أما MessagePack فيرمز البيانات الثنائية مباشرة
+_PLAIN_TYPES = {packet.BINARY_EVENT: packet.EVENT, packet.BINARY_ACK: packet.ACK}
+
+
+class NegotiatedPacket(packet.Packet):
+    """حزمة Socket.IO تُرمز بـ MessagePack لاتصالات العملاء الذين طلبوه وبـ JSON لغيرهم
+
+    فك الترميز يعتمد على نوع الرسالة: النصية JSON والثنائية MessagePack.
+    """
+
+    use_msgpack = False
+
+    def encode(self):
+        if not self.use_msgpack:
+            return super().encode()
+        data = self._to_dict()
+        data['type'] = _PLAIN_TYPES.get(self.packet_type, self.packet_type)
+        return msgpack.dumps(data, default=str)
+
+    def decode(self, encoded_packet):
+        if not isinstance(encoded_packet, bytes):
+            return super().decode(encoded_packet)
+        decoded = msgpack.loads(encoded_packet)
+        self.use_msgpack = True
+        self.packet_type = decoded['type']
+        self.data = decoded.get('data')
+        self.id = decoded.get('id')
+        self.namespace = decoded['nsp']
+        return 0
+
+
+def wants_msgpack(environ):
+    return environ is not None and MSGPACK_QUERY in environ.get('QUERY_STRING', '')
+
+
+def enable_msgpack_negotiation(server):
+    """ترميز الحزم المرسلة لكل اتصال حسب ما طلبه العميل عند الاتصال
+
+    يتطلب أن يكون الخادم منشأً بـ serializer=NegotiatedPacket. بدون مكتبة msgpack لا يتغير شيء
+    ويستمر العملاء الذين طلبوه باستقبال JSON (ويعرفون ذلك من رد الاتصال النصي).
+    """
+    if msgpack is None:
+        return False
+    send_packet = server._send_packet
+
+    def _send_packet(eio_sid, pkt):
+        # يُرمز كل حدث لكل مستقبل على حدة، فلا تكلفة إضافية لخلط الترميزين في نفس الغرفة
+        pkt.use_msgpack = wants_msgpack(server.environ.get(eio_sid))
+        send_packet(eio_sid, pkt)
+
+    server._send_packet = _send_packet
+    return True
@@ -1,6 +1,7 @@
 import os
 import subprocess
 import json
+import tempfile
 from datetime import datetime
 
 class SoftEtherVPN:
@@ -42,11 +43,15 @@ class SoftEtherVPN:
         result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
         if result.returncode == 0:
             # تعيين كلمة المرور للمستخدم
-            cmd = f"{self.vpncmd_path} /SERVER {self.server_ip}:{self.server_port} /PASSWORD:{self.admin_password} /ADMINHUB:{hub_name} /CMD UserPasswordSet {username} /PASSWORD:{password}"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            return result.returncode == 0
+            return self.set_user_password(hub_name, username, password)
         return False
 
+    def set_user_password(self, hub_name, username, password):
+        """تعيين كلمة مرور مستخدم موجود في هاب معين"""
+        cmd = f"{self.vpncmd_path} /SERVER {self.server_ip}:{self.server_port} /PASSWORD:{self.admin_password} /ADMINHUB:{hub_name} /CMD UserPasswordSet {username} /PASSWORD:{password}"
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        return result.returncode == 0
+
     def delete_user(self, hub_name, username):
         """حذف مستخدم من هاب معين"""
         cmd = f"{self.vpncmd_path} /SERVER {self.server_ip}:{self.server_port} /PASSWORD:{self.admin_password} /ADMINHUB:{hub_name} /CMD UserDelete {username}"
@@ -63,4 +68,42 @@ class SoftEtherVPN:
         """الحصول على قائمة المستخدمين في هاب معين"""
         cmd = f"{self.vpncmd_path} /SERVER {self.server_ip}:{self.server_port} /PASSWORD:{self.admin_password} /ADMINHUB:{hub_name} /CMD UserList"
         result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        return result.stdout
\ No newline at end of file
+        return result.stdout
+
+    def run_batch(self, hub_name, commands):
+        """تنفيذ عدة أوامر vpncmd على هاب معين في عملية واحدة عبر ملف أوامر"""
+        if not commands:
+            return True
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("\n".join(commands) + "\n")
+            batch_path = f.name
+        try:
+            cmd = f"{self.vpncmd_path} /SERVER {self.server_ip}:{self.server_port} /PASSWORD:{self.admin_password} /ADMINHUB:{hub_name} /IN:{batch_path}"
+            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            return result.returncode == 0
+        finally:
+            os.remove(batch_path)
+
+    def run_commands(self, operations):
+        """تنفيذ أوامر على عدة هابات في عملية vpncmd واحدة (operations: قائمة (اسم الهاب أو None، الأمر))"""
+        commands = []
+        current_hub = None
+        for hub_name, command in operations:
+            # التبديل إلى الهاب المطلوب داخل نفس الجلسة
+            if hub_name and hub_name != current_hub:
+                commands.append(f"Hub {hub_name}")
+                current_hub = hub_name
+            commands.append(command)
+        return self.run_batch("DEFAULT", commands)
+
+    def create_users(self, hub_name, users):
+        """إنشاء عدة مستخدمين مع كلمات مرورهم في هاب معين دفعة واحدة (users: اسم المستخدم -> كلمة المرور)"""
+        commands = []
+        for username, password in users.items():
+            commands.append(f"UserCreate {username} /GROUP:none /REALNAME:none /NOTE:none")
+            commands.append(f"UserPasswordSet {username} /PASSWORD:{password}")
+        return self.run_batch(hub_name, commands)
+
+    def delete_users(self, hub_name, usernames):
+        """حذف عدة مستخدمين من هاب معين دفعة واحدة"""
+        return self.run_batch(hub_name, [f"UserDelete {username}" for username in usernames])
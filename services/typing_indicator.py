@@ -0,0 +1,94 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TypingAggregator:
+    """تجميع حالة الكتابة لكل غرفة وإرسال قائمة "من يكتب الآن" مرة واحدة على الأكثر كل interval ثانية
+
+    كل ضغطة مفتاح تجدد صلاحية حالة اللاعب فقط، والحالة تنتهي تلقائياً بعد ttl ثانية بدون تجديد.
+    """
+
+    def __init__(self, emit, interval=1.0, ttl=5.0, name="typing-aggregator"):
+        # emit(room_id, payload) ترسل حدث typing لأعضاء الغرفة
+        self.emit = emit
+        self.interval = interval
+        self.ttl = ttl
+        self.name = name
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # room_id -> {username: وقت انتهاء الحالة}
+        self._rooms = {}
+        self._dirty = set()
+        self._thread = None
+        self.events_total = 0
+        self.emitted_total = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def record(self, room_id, username, typing=True):
+        """تسجيل أن اللاعب يكتب (أو توقف عن الكتابة)"""
+        room_id = str(room_id)
+        with self._lock:
+            self.events_total += 1
+            typists = self._rooms.get(room_id)
+            if typing:
+                if typists is None:
+                    typists = self._rooms[room_id] = {}
+                if username not in typists:
+                    self._dirty.add(room_id)
+                typists[username] = time.monotonic() + self.ttl
+            elif typists is not None and typists.pop(username, None) is not None:
+                self._dirty.add(room_id)
+            self._ensure_started()
+        self._wakeup.set()
+
+    def clear_room(self, room_id):
+        with self._lock:
+            self._rooms.pop(str(room_id), None)
+            self._dirty.discard(str(room_id))
+
+    def _collect(self):
+        """إزالة الحالات المنتهية وإرجاع لقطات الغرف التي تغيرت"""
+        now = time.monotonic()
+        with self._lock:
+            for room_id, typists in list(self._rooms.items()):
+                expired = [username for username, expires_at in typists.items() if expires_at <= now]
+                for username in expired:
+                    del typists[username]
+                if expired:
+                    self._dirty.add(room_id)
+                if not typists:
+                    del self._rooms[room_id]
+
+            snapshots = [(room_id, sorted(self._rooms.get(room_id, ()))) for room_id in self._dirty]
+            self._dirty.clear()
+            idle = not self._rooms
+            if idle:
+                self._wakeup.clear()
+        return snapshots
+
+    def _run(self):
+        while True:
+            # لا عمل أثناء عدم وجود أي لاعب يكتب
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            for room_id, users in self._collect():
+                try:
+                    self.emit(room_id, {"room_id": room_id, "users": users})
+                    self.emitted_total += 1
+                except Exception as e:
+                    logger.error(f"Failed to emit typing snapshot for room {room_id}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rooms": len(self._rooms),
+                "events_total": self.events_total,
+                "emitted_total": self.emitted_total,
+            }
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+from flask import Flask
+
+import routes.rooms
+from services.admission import AdmissionController, AdmissionRejected
+
+
+def controller(**kwargs):
+    options = dict(global_rate=100, global_burst=100, user_rate=0.5, user_burst=2,
+                   max_concurrent=4, max_queue=4, queue_timeout=0.2)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def admit(admission, user):
+    with admission.admit(user):
+        pass
+
+
+def test_user_bucket_rejects_after_burst():
+    admission = controller()
+    admit(admission, "a")
+    admit(admission, "a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        admit(admission, "a")
+    # رمز كل ثانيتين
+    assert 1.9 < rejected.value.retry_after <= 2
+    # دلو كل مستخدم مستقل
+    admit(admission, "b")
+    assert admission.stats()["rejected_rate_limited"] == 1
+
+
+def test_global_rejection_refunds_user_token():
+    admission = controller(global_rate=0.01, global_burst=1)
+    admit(admission, "a")
+    with pytest.raises(AdmissionRejected):
+        admit(admission, "b")
+    assert admission.user_buckets["b"].tokens >= 1
+
+
+def test_queue_times_out_when_slots_are_busy():
+    admission = controller(max_concurrent=1, max_queue=1, queue_timeout=0.1)
+    release = threading.Event()
+    entered = threading.Event()
+
+    def hold():
+        with admission.admit("a"):
+            entered.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait(1)
+    try:
+        with pytest.raises(AdmissionRejected, match="Timed out"):
+            admit(admission, "b")
+        assert admission.stats()["rejected_queue"] == 1
+    finally:
+        release.set()
+        holder.join()
+    admit(admission, "b")
+
+
+def test_route_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(routes.rooms, "admission", controller(user_burst=1))
+    app = Flask(__name__)
+    view = routes.rooms.admission_controlled(lambda data: data.get("owner"))(lambda: "ok")
+    app.add_url_rule("/create", "create", view, methods=["POST"])
+    client = app.test_client()
+
+    assert client.post("/create", json={"owner": "a"}).status_code == 200
+    response = client.post("/create", json={"owner": "a"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert response.get_json()["error"] == "Too many requests for this user"
@@ -0,0 +1,73 @@
+import importlib.util
+import os
+import threading
+
+from flask import Flask
+from flask_socketio import SocketIO
+
+from conftest import ROOT
+
+# backend/services لها نفس اسم حزمة services في الجذر، فتُحمّل الوحدة من ملفها مباشرة
+spec = importlib.util.spec_from_file_location("backend_broadcast",
+                                              os.path.join(ROOT, "backend", "services", "broadcast.py"))
+broadcast = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(broadcast)
+
+
+class Recorder(SocketIO):
+    """SocketIO بوضع threading يسجل الأحداث بدلاً من إرسالها"""
+
+    def __init__(self):
+        super().__init__(Flask(__name__), async_mode="threading")
+        self.emitted = []
+        self.done = threading.Event()
+        self.expected = 0
+
+    def emit(self, event, data, room=None, **kwargs):
+        self.emitted.append((event, data, room))
+        if len(self.emitted) >= self.expected:
+            self.done.set()
+
+
+def test_superseded_events_send_only_latest():
+    socketio = Recorder()
+    socketio.expected = 2
+    # backend/app.py يبدأ الأنبوب قبل أي نشر، وكل ما يُنشر خلال tick واحد يُجمع في دفعة
+    pipeline = broadcast.BroadcastPipeline(socketio, tick=0.2)
+    pipeline.start()
+    for n in range(5):
+        pipeline.publish("rooms_updated", {"rooms": n}, key="rooms_updated")
+    pipeline.publish("user_joined", {"username": "a"}, room="1")
+
+    assert socketio.done.wait(2)
+    assert sorted(socketio.emitted, key=lambda e: e[0]) == [
+        ("rooms_updated", {"rooms": 4}, None),
+        ("user_joined", {"username": "a"}, "1"),
+    ]
+    assert pipeline.stats()["superseded"] == 4
+
+
+def test_overflow_is_dropped_and_counted():
+    pipeline = broadcast.BroadcastPipeline(Recorder(), max_pending=2)
+    assert pipeline.publish("a", {}, room="1")
+    assert pipeline.publish("b", {}, room="1")
+    assert not pipeline.publish("c", {}, room="1")
+    # استبدال حدث معلق بمفتاح لا يحتاج مكاناً جديداً
+    assert pipeline.publish("d", {}, key=0)
+
+    stats = pipeline.stats()
+    assert stats["overflow"] == 1
+    assert stats["pending"] == 2
+
+
+def test_per_room_order_is_kept():
+    socketio = Recorder()
+    socketio.expected = 10
+    pipeline = broadcast.BroadcastPipeline(socketio, emitters=3, tick=0.05)
+    pipeline.start()
+    for n in range(10):
+        pipeline.publish("new_message", {"n": n}, room=str(n % 2))
+
+    assert socketio.done.wait(2)
+    for room in ("0", "1"):
+        assert [data["n"] for event, data, r in socketio.emitted if r == room] == list(range(int(room), 10, 2))
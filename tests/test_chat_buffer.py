@@ -0,0 +1,78 @@
+import threading
+import time
+
+from models import db, Room, RoomPlayer, ChatMessage
+from services.chat_buffer import ChatWriteBuffer
+
+
+def test_close_drains_pending_rows():
+    written = []
+    release = threading.Event()
+
+    def write_batch(rows):
+        # الدفعة الأولى بطيئة فتتراكم البقية في الطابور حتى close
+        release.wait(1)
+        written.extend(rows)
+
+    buffer = ChatWriteBuffer(write_batch, max_batch=2, flush_interval=0.01)
+    for n in range(5):
+        assert buffer.submit({"n": n})
+    release.set()
+    buffer.close()
+
+    assert [row["n"] for row in written] == [0, 1, 2, 3, 4]
+    assert buffer.stats()["written"] == 5
+    assert not buffer.submit({"n": 5})
+
+
+def test_full_queue_rejects_message():
+    release = threading.Event()
+    buffer = ChatWriteBuffer(lambda rows: release.wait(1), max_batch=1, flush_interval=0.01, max_queue=1)
+    buffer.submit({"n": 0})
+    time.sleep(0.05)  # الخيط أخذ الرسالة الأولى وينتظر
+    assert buffer.submit({"n": 1})
+    assert not buffer.submit({"n": 2})
+    assert buffer.stats()["rejected"] == 1
+    release.set()
+    buffer.close()
+
+
+def join_room(app_module, room_id, username):
+    client = app_module.socketio.test_client(app_module.app)
+    client.emit('join', {'room_id': room_id, 'username': username})
+    client.get_received()
+    return client
+
+
+def test_send_message_rejects_invalid_room_id(app_module):
+    client = app_module.socketio.test_client(app_module.app)
+    client.emit('send_message', {'room_id': 'abc', 'username': 'a@example.com', 'message': 'hi'})
+    assert client.get_received() == [{'name': 'error', 'args': [{'message': 'Invalid room_id'}], 'namespace': '/'}]
+
+
+def test_send_message_rejects_deleted_room(app_module):
+    accepted = app_module.chat_buffer.accepted
+    client = app_module.socketio.test_client(app_module.app)
+    client.emit('send_message', {'room_id': '424242', 'username': 'a@example.com', 'message': 'hi'})
+    assert [event['args'][0]['message'] for event in client.get_received()] == \
+        ['Room not found or sender is not in the room']
+    assert app_module.chat_buffer.accepted == accepted
+
+
+def test_send_message_is_broadcast_and_persisted(app_module):
+    room = Room(name="room", owner_username="a@example.com", max_players=8, current_players=1)
+    db.session.add(room)
+    db.session.flush()
+    db.session.add(RoomPlayer(room_id=room.id, player_username="a@example.com", username="a", is_host=True))
+    db.session.commit()
+    room_id = str(room.id)
+
+    client = join_room(app_module, room_id, "a@example.com")
+    client.emit('send_message', {'room_id': room_id, 'username': 'a@example.com', 'message': 'hi'})
+    assert [event['name'] for event in client.get_received()] == ['new_message']
+
+    deadline = time.monotonic() + 5
+    while not ChatMessage.query.filter_by(room_id=room.id).count() and time.monotonic() < deadline:
+        time.sleep(0.05)
+        db.session.rollback()
+    assert ChatMessage.query.filter_by(room_id=room.id).one().message == "hi"
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+
+import routes.rooms
+from models import db, Room, ChatMessage
+from services.sharding import RoomShards
+
+
+def test_owns_single_process():
+    assert RoomShards().owns("1")
+
+
+def test_owns_shared_workers():
+    # --scale app=N بدون تقسيم: كل عامل يرى جزءاً من رسائل الغرفة فقط
+    assert not RoomShards(shared=True).owns("1")
+
+
+def test_owns_only_owner_shard():
+    shards = [RoomShards(count=3, index=index) for index in range(3)]
+    assert [shard.owns("42") for shard in shards].count(True) == 1
+
+
+def test_owns_nothing_when_shards_are_replicated():
+    # SHARD_COUNT > 1 مع --scale app=N: عدة نسخ لنفس الجزء
+    assert not any(RoomShards(count=3, index=index, shared=True).owns("42") for index in range(3))
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    app.register_blueprint(routes.rooms.rooms_bp)
+    db.create_all()
+    room = Room(name="room", owner_username="host@example.com", max_players=8, current_players=1)
+    db.session.add(room)
+    db.session.flush()
+    db.session.add(ChatMessage(room_id=room.id, sender="a", message="from db", timestamp=datetime.utcnow()))
+    db.session.commit()
+    # ذاكرة هذا العامل لا تعرف رسالة حفظها عامل آخر
+    history = routes.rooms.ChatHistory(lambda room_id, limit: [], size=50)
+    history.recent(room.id)
+    monkeypatch.setattr(routes.rooms, "chat_history", history)
+    return app.test_client(), room.id
+
+
+def test_messages_from_db_when_workers_share_rooms(client, monkeypatch):
+    client, room_id = client
+    monkeypatch.setattr(routes.rooms, "room_shards", RoomShards(shared=True))
+    response = client.get(f"/rooms/{room_id}/messages")
+    assert [m["message"] for m in response.get_json()["messages"]] == ["from db"]
+
+
+def test_messages_from_memory_when_process_owns_room(client, monkeypatch):
+    client, room_id = client
+    monkeypatch.setattr(routes.rooms, "room_shards", RoomShards())
+    response = client.get(f"/rooms/{room_id}/messages")
+    assert response.get_json()["messages"] == []
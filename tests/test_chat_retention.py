@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+from models import db, Room, ChatMessage, ChatArchive
+from services.chat_retention import ChatRetention, RedisRunLock, read_archive
+
+
+class Writer:
+    """بديل كاتب قاعدة البيانات ينفذ المعاملة مباشرة ويعدّها"""
+
+    def __init__(self):
+        self.transactions = []
+
+    def run(self, func, *args):
+        self.transactions.append(func.__name__)
+        result = func(*args)
+        db.session.commit()
+        return result
+
+
+@pytest.fixture
+def rooms(app):
+    db.create_all()
+    now = datetime.utcnow()
+    rooms = [Room(name=f"room {i}", owner_username="host@example.com") for i in range(5)]
+    db.session.add_all(rooms)
+    db.session.flush()
+    for room in rooms:
+        db.session.add_all([ChatMessage(room_id=room.id, sender="a", message=f"m{n}", timestamp=now - timedelta(minutes=n))
+                            for n in range(3)])
+    db.session.commit()
+    return [room.id for room in rooms]
+
+
+def retention(writer, **kwargs):
+    return ChatRetention(writer.run, lambda func, *args: func(*args), chunk_size=2, **kwargs)
+
+
+def test_no_transactions_for_rooms_within_limits(rooms):
+    writer = Writer()
+    retention(writer, max_per_room=10, retention_days=30).run_once()
+    # فقط فحص طابور الحذف، ولا معاملة لأي غرفة
+    assert writer.transactions == ["_purge_chunk"]
+
+
+def test_archives_only_candidate_rooms(rooms):
+    busy, old = rooms[0], rooms[1]
+    db.session.add_all([ChatMessage(room_id=busy, sender="a", message=f"x{n}", timestamp=datetime.utcnow())
+                        for n in range(4)])
+    db.session.add(ChatMessage(room_id=old, sender="a", message="old", timestamp=datetime.utcnow() - timedelta(days=40)))
+    db.session.commit()
+
+    writer = Writer()
+    chat_retention = retention(writer, max_per_room=5, retention_days=30)
+    chat_retention.run_once()
+
+    assert ChatMessage.query.filter_by(room_id=busy).count() == 5
+    assert ChatMessage.query.filter_by(room_id=old).count() == 3
+    assert [m["message"] for m in read_archive(ChatArchive.query.filter_by(room_id=old).one())] == ["old"]
+    assert chat_retention.archived == 3
+    # دفعة واحدة لكل غرفة تحتاج أرشفة، دون معاملات لبقية الغرف
+    assert writer.transactions[0] == "_purge_chunk"
+    assert sorted(writer.transactions[1:]) == ["_archive_expired_chunk", "_archive_over_cap_chunk"]
+
+
+def test_skips_closed_rooms(rooms):
+    closed = rooms[2]
+    db.session.add(ChatMessage(room_id=closed, sender="a", message="old", timestamp=datetime.utcnow() - timedelta(days=40)))
+    Room.query.filter_by(id=closed).delete()
+    db.session.commit()
+
+    writer = Writer()
+    retention(writer, retention_days=30).run_once()
+    assert ChatArchive.query.count() == 0
+
+
+
+def test_over_cap_counts_once_per_room(rooms):
+    busy = rooms[0]
+    db.session.add_all([ChatMessage(room_id=busy, sender="a", message=f"x{n}", timestamp=datetime.utcnow())
+                        for n in range(7)])
+    db.session.commit()
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.lower())
+    event.listen(db.engine, "before_cursor_execute", listener)
+
+    writer = Writer()
+    try:
+        retention(writer, max_per_room=4).run_once()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+    # 10 رسائل مع حد 4: ثلاث دفعات (2 + 2 + 2)، والعدد من الاستعلام التجميعي فقط
+    assert writer.transactions[1:] == ["_archive_over_cap_chunk"] * 3
+    assert len([s for s in statements if "count(" in s]) == 1
+    assert ChatMessage.query.filter_by(room_id=busy).count() == 4
+    assert [m["message"] for m in read_archive(ChatArchive.query.order_by(ChatArchive.id).first())] == ["m0", "m1"]
+
+
+def test_run_lock_lets_one_replica_run(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr("redis.Redis.from_url", lambda url: fakeredis.FakeRedis(server=server))
+    replicas = [RedisRunLock("redis://", ttl=60) for _ in range(3)]
+    assert [lock.acquire() for lock in replicas] == [True, False, False]
@@ -0,0 +1,74 @@
+import pytest
+
+from models import db, Room, RoomPlayer, ChatMessage, ChatPurge
+from services.sharding import RoomShards
+
+
+def add_room(name, current_players, players=()):
+    room = Room(name=name, owner_username="host@example.com", max_players=8, current_players=current_players)
+    db.session.add(room)
+    db.session.flush()
+    for username in players:
+        db.session.add(RoomPlayer(room_id=room.id, player_username=username, username=username.split("@")[0]))
+    db.session.commit()
+    return room.id
+
+
+@pytest.fixture
+def local_shards(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "room_shards", RoomShards())
+    return app_module
+
+
+def test_corrects_counts_and_deletes_empty_rooms(local_shards):
+    ok = add_room("ok", 1, ["a@example.com"])
+    drifted = add_room("drifted", 5, ["b@example.com", "c@example.com"])
+    empty = add_room("empty", 2)
+    db.session.add(ChatMessage(room_id=empty, sender="a", message="bye"))
+    db.session.commit()
+
+    corrections, deleted = local_shards.clean_rooms()
+    db.session.commit()
+
+    assert corrections == [(drifted, 5, 2)]
+    assert deleted == [empty]
+    assert db.session.get(Room, drifted).current_players == 2
+    assert db.session.get(Room, ok).current_players == 1
+    assert db.session.get(Room, empty) is None
+    # رسائل الغرفة المحذوفة تُحذف لاحقاً على دفعات
+    assert [purge.room_id for purge in ChatPurge.query.all()] == [empty]
+
+
+def test_only_given_rooms_are_checked(local_shards):
+    first = add_room("first", 0)
+    second = add_room("second", 0)
+
+    corrections, deleted = local_shards.clean_rooms([first])
+    db.session.commit()
+    assert deleted == [first]
+    assert db.session.get(Room, second) is not None
+
+
+def test_room_joined_after_query_is_not_deleted(local_shards, monkeypatch):
+    room_id = add_room("racing", 0)
+
+    class JoinDuringCleanup(RoomShards):
+        def is_local(self, checked_room_id):
+            # لاعب ينضم بعد الاستعلام التجميعي وقبل الحذف
+            db.session.add(RoomPlayer(room_id=checked_room_id, player_username="late@example.com", username="late"))
+            db.session.flush()
+            return True
+
+    monkeypatch.setattr(local_shards, "room_shards", JoinDuringCleanup())
+    corrections, deleted = local_shards.clean_rooms()
+    db.session.commit()
+    assert deleted == []
+    assert db.session.get(Room, room_id) is not None
+
+
+def test_other_shards_rooms_are_left_alone(local_shards, monkeypatch):
+    room_id = add_room("remote", 0)
+    monkeypatch.setattr(local_shards, "room_shards",
+                        next(shards for shards in (RoomShards(count=2, index=i) for i in range(2))
+                             if not shards.is_local(room_id)))
+    assert local_shards.clean_rooms() == ([], [])
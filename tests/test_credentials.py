@@ -0,0 +1,50 @@
+import pytest
+from cryptography.fernet import Fernet
+
+from services import credentials
+
+
+def test_round_trip():
+    token = credentials.encrypt_password("secret123")
+    assert token != "secret123"
+    assert credentials.decrypt_password(token) == "secret123"
+    assert credentials.decrypt_password("not-a-token") is None
+
+
+def test_vpn_credentials_key_is_used(monkeypatch):
+    key = Fernet.generate_key().decode()
+    monkeypatch.setenv("VPN_CREDENTIALS_KEY", key)
+    assert credentials._load_key() == key.encode()
+
+
+def test_invalid_vpn_credentials_key_is_rejected(monkeypatch):
+    monkeypatch.setenv("VPN_CREDENTIALS_KEY", "not-a-fernet-key")
+    with pytest.raises(ValueError):
+        credentials._load_key()
+
+
+@pytest.mark.parametrize("secret", [None, "mysecretkey"])
+def test_missing_or_default_secret_key_is_rejected(monkeypatch, secret):
+    monkeypatch.delenv("VPN_CREDENTIALS_KEY", raising=False)
+    if secret is None:
+        monkeypatch.delenv("SECRET_KEY", raising=False)
+    else:
+        monkeypatch.setenv("SECRET_KEY", secret)
+    with pytest.raises(ValueError):
+        credentials._load_key()
+
+
+def test_key_derived_from_custom_secret_key(monkeypatch):
+    monkeypatch.delenv("VPN_CREDENTIALS_KEY", raising=False)
+    monkeypatch.setenv("SECRET_KEY", "a-real-secret")
+    Fernet(credentials._load_key())
+
+
+def test_generate_vpn_password_uses_secrets(monkeypatch):
+    # random.seed يجعل random.choices متوقعاً، أما secrets فلا يتأثر به
+    import random
+    random.seed(1)
+    first = credentials.generate_vpn_password()
+    random.seed(1)
+    assert credentials.generate_vpn_password() != first
+    assert len(first) == 12 and first.isalnum()
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+
+from models import db, Room
+from services.db_writer import DatabaseWriter
+
+
+@pytest.fixture
+def writer(app):
+    db.create_all()
+    writer = DatabaseWriter(db)
+    writer.init_app(app)
+    yield writer
+    writer.close()
+
+
+def add_room(name):
+    db.session.add(Room(name=name, owner_username="host@example.com"))
+    return name
+
+
+def test_transaction_result_is_committed(writer):
+    assert writer.run(add_room, "first") == "first"
+    assert [room.name for room in Room.query.all()] == ["first"]
+    assert writer.stats()["executed"] == 1
+
+
+def test_exception_propagates_and_rolls_back(writer):
+    def add_then_fail():
+        add_room("broken")
+        db.session.flush()
+        raise ValueError("vpncmd failed")
+
+    with pytest.raises(ValueError, match="vpncmd failed"):
+        writer.run(add_then_fail)
+    assert Room.query.filter_by(name="broken").count() == 0
+    assert writer.stats()["failed"] == 1
+
+    # الكاتب يستمر بعد المعاملة الفاشلة
+    writer.run(add_room, "after")
+    assert [room.name for room in Room.query.all()] == ["after"]
+
+
+def test_writes_run_on_one_thread_in_order(writer):
+    threads = []
+
+    def record(n):
+        threads.append(threading.current_thread().name)
+        add_room(f"room {n}")
+
+    futures = [writer.submit(record, n) for n in range(20)]
+    for future in futures:
+        future.result(5)
+    assert set(threads) == {writer.name}
+    assert [row[0] for row in db.session.execute(text("SELECT name FROM room ORDER BY id"))] == \
+        [f"room {n}" for n in range(20)]
+
+
+def test_nested_submit_runs_inline(writer):
+    def outer():
+        add_room("outer")
+        return writer.run(add_room, "inner")
+
+    assert writer.run(outer) == "inner"
+    assert sorted(room.name for room in Room.query.all()) == ["inner", "outer"]
+
+
+def test_closed_writer_rejects_new_work(writer):
+    writer.run(add_room, "first")
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(add_room, "late")
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+import redis
+
+from services.idempotency import IdempotencyStore, RedisIdempotencyStore, IdempotencyConflict, IdempotencyInProgress
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_store(request, monkeypatch):
+    """مصنع مخازن؛ مخازن Redis المتعددة تتشارك نفس الخادم كما تتشاركه عمليات التطبيق"""
+    if request.param == "memory":
+        store = IdempotencyStore(wait_timeout=1)
+        return lambda: store
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    return lambda: RedisIdempotencyStore("redis://fake", wait_timeout=1, poll_interval=0.01)
+
+
+def response(body=b'{"room_id": 1}', status=200):
+    return (body, status, "application/json")
+
+
+def test_retry_returns_first_result(make_store):
+    calls = []
+
+    def create():
+        calls.append(1)
+        return response(), True
+
+    first, retry = make_store(), make_store()
+    assert first.execute("create_room:k1", "fp", create) == response()
+    # إعادة المحاولة قد تصل إلى عملية أخرى
+    assert retry.execute("create_room:k1", "fp", create) == response()
+    assert len(calls) == 1
+
+
+def test_different_request_with_same_key_conflicts(make_store):
+    store = make_store()
+    store.execute("join_room:k2", "fp1", lambda: (response(), True))
+    with pytest.raises(IdempotencyConflict):
+        make_store().execute("join_room:k2", "fp2", lambda: (response(), True))
+
+
+def test_failed_or_uncacheable_request_runs_again(make_store):
+    store = make_store()
+
+    def fail():
+        raise RuntimeError("vpncmd failed")
+
+    with pytest.raises(RuntimeError):
+        store.execute("join_room:k3", "fp", fail)
+    assert store.execute("join_room:k3", "fp", lambda: (response(b"busy", 429), False)) == response(b"busy", 429)
+    assert make_store().execute("join_room:k3", "fp", lambda: (response(), True)) == response()
+
+
+def test_concurrent_retry_waits_for_original(make_store):
+    started = threading.Event()
+    calls = []
+
+    def slow_create():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return response(), True
+
+    results = []
+    original = threading.Thread(target=lambda: results.append(make_store().execute("create_room:k4", "fp", slow_create)))
+    original.start()
+    started.wait(1)
+    results.append(make_store().execute("create_room:k4", "fp", slow_create))
+    original.join()
+
+    assert results == [response(), response()]
+    assert len(calls) == 1
+
+
+def test_retry_gives_up_after_wait_timeout(make_store):
+    # الطلب الأصلي عالق (أو توقفت عمليته): الطلب المكرر لا ينتظر حتى انتهاء pending_ttl
+    release = threading.Event()
+    started = threading.Event()
+
+    def stuck_create():
+        started.set()
+        release.wait(5)
+        return response(), True
+
+    original = threading.Thread(target=lambda: make_store().execute("create_room:k5", "fp", stuck_create))
+    original.start()
+    started.wait(1)
+    began = time.monotonic()
+    with pytest.raises(IdempotencyInProgress):
+        make_store().execute("create_room:k5", "fp", stuck_create)
+    assert time.monotonic() - began < 2
+    release.set()
+    original.join()
+
+
+def test_in_progress_returns_409_with_retry_after(monkeypatch):
+    from flask import Flask
+    import routes.rooms
+
+    class Busy:
+        def execute(self, key, fingerprint, func):
+            raise IdempotencyInProgress(retry_after=2)
+
+    monkeypatch.setattr(routes.rooms, "idempotency_store", Busy())
+    app = Flask(__name__)
+    app.add_url_rule("/create", "create", routes.rooms.idempotent(lambda: "ok"), methods=["POST"])
+    response = app.test_client().post("/create", headers={"Idempotency-Key": "k"})
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "2"
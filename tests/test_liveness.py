@@ -0,0 +1,33 @@
+from services.liveness import LivenessTable
+
+
+def table(**kwargs):
+    stale = []
+    return LivenessTable(stale.extend, timeout=10, capacity=2, **kwargs), stale
+
+
+def test_sweep_returns_only_silent_sessions():
+    liveness, _ = table()
+    liveness.register("s1")
+    slot = liveness.register("s2")
+
+    liveness.clock = 20
+    liveness.touch(slot)
+    assert liveness.sweep() == ["s1"]
+    # خانة الجلسة المتوقفة تُحرر ولا تُعاد في الفحص التالي
+    assert liveness.slot_of("s1") is None
+    assert liveness.sweep() == []
+    assert liveness.stats()["stale_total"] == 1
+
+
+def test_slots_are_reused_and_table_grows():
+    liveness, _ = table()
+    slots = {liveness.register(sid) for sid in ("s1", "s2", "s3")}
+    assert len(slots) == 3
+    assert liveness.stats()["capacity"] == 4
+
+    slot = liveness.slot_of("s2")
+    liveness.release("s2")
+    assert liveness.register("s4") == slot
+    # إعادة التسجيل تحتفظ بنفس الخانة
+    assert liveness.register("s4") == slot
@@ -0,0 +1,46 @@
+from models import db, Room
+
+
+def add_room(name):
+    room = Room(name=name, owner_username="host@example.com", max_players=8, current_players=1)
+    db.session.add(room)
+    db.session.commit()
+    return room
+
+
+def events(client):
+    return [(event['name'], event['args'][0]) for event in client.get_received()]
+
+
+def test_subscribe_sends_snapshot_then_changes(app_module):
+    room = add_room("first")
+    client = app_module.socketio.test_client(app_module.app)
+    # الاتصال وحده لا يرسل قائمة الغرف (اتصالات نوافذ الغرف لا تحتاجها)
+    assert events(client) == []
+
+    client.emit('subscribe_lobby')
+    [(name, data)] = events(client)
+    assert name == 'rooms_updated'
+    assert [r['room_name'] for r in data['rooms']] == ["first"]
+
+    room.current_players = 2
+    db.session.commit()
+    app_module.membership.notify("joined", room.id, "guest@example.com")
+    [(name, data)] = events(client)
+    assert name == 'room_changed' and data['room']['current_players'] == 2
+
+    room_id = room.id
+    db.session.delete(room)
+    db.session.commit()
+    app_module.membership.notify("room_deleted", room_id, "host@example.com")
+    assert events(client) == [('room_removed', {'room_id': room_id})]
+
+
+def test_unsubscribe_stops_updates(app_module):
+    room = add_room("second")
+    client = app_module.socketio.test_client(app_module.app)
+    client.emit('subscribe_lobby')
+    client.emit('unsubscribe_lobby')
+    client.get_received()
+    app_module.membership.notify("joined", room.id, "guest@example.com")
+    assert events(client) == []
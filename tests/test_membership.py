@@ -0,0 +1,152 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Room, RoomPlayer
+from services.credentials import encrypt_password
+from services.membership import MembershipService
+
+
+class FakeVPN:
+    """بديل SoftEtherVPN يسجل الأوامر بدلاً من استدعاء vpncmd"""
+
+    def __init__(self):
+        self.users = {}
+        self.commands = []
+        self.on_create = None
+
+    def create_users(self, hub_name, users):
+        self.commands.append(("create_users", hub_name, dict(users)))
+        self.users.update(users)
+        if self.on_create:
+            self.on_create()
+        return True
+
+    def delete_users(self, hub_name, usernames):
+        self.commands.append(("delete_users", hub_name, list(usernames)))
+        for username in usernames:
+            self.users.pop(username, None)
+        return True
+
+    def run_commands(self, operations):
+        self.commands.append(("run_commands", list(operations)))
+        return True
+
+
+@pytest.fixture
+def room(app):
+    db.create_all()
+    room = Room(name="room", owner_username="host@example.com", max_players=8, current_players=1)
+    db.session.add(room)
+    db.session.flush()
+    db.session.add(RoomPlayer(room_id=room.id, player_username="host@example.com", username="host",
+                              is_host=True, vpn_password_encrypted=encrypt_password("hostpass")))
+    db.session.commit()
+    return room.id
+
+
+def test_bulk_join_rejects_colliding_vpn_usernames(room):
+    vpn = FakeVPN()
+    results = MembershipService(vpn).bulk_join(room, ["bob@a.com", "bob@b.com", "host@other.com", "eve@a.com"])
+
+    assert results["bob@b.com"] == {"error": "VPN username already in use in this room"}
+    assert results["host@other.com"] == {"error": "VPN username already in use in this room"}
+    assert set(vpn.users) == {"bob", "eve"}
+    assert results["bob@a.com"]["vpn_password"] == vpn.users["bob"]
+
+    players = {p.player_username: p.username for p in RoomPlayer.query.filter_by(room_id=room)}
+    assert players == {"host@example.com": "host", "bob@a.com": "bob", "eve@a.com": "eve"}
+    assert db.session.get(Room, room).current_players == 3
+
+
+def test_bulk_join_deletes_vpn_users_when_commit_fails(room):
+    vpn = FakeVPN()
+
+    # انضمام متزامن يحفظ نفس اللاعب بعد إنشاء مستخدمي VPN وقبل حفظ الدفعة
+    def concurrent_join():
+        with db.engine.begin() as conn:
+            conn.execute(RoomPlayer.__table__.insert().values(
+                room_id=room, player_username="bob@a.com", username="bob", is_host=False))
+    vpn.on_create = concurrent_join
+
+    with pytest.raises(IntegrityError):
+        MembershipService(vpn).bulk_join(room, ["bob@a.com", "eve@a.com"])
+
+    assert vpn.commands[-1] == ("delete_users", "room_%d" % room, ["bob", "eve"])
+    assert vpn.users == {}
+
+
+def add_member(room_id, player_username):
+    db.session.add(RoomPlayer(room_id=room_id, player_username=player_username,
+                              username=player_username.split('@')[0], is_host=False,
+                              vpn_password_encrypted=encrypt_password("pass")))
+    db.session.commit()
+
+
+def test_join_deletes_old_room_hub_only_after_commit(room, monkeypatch):
+    old_room = Room(name="old", owner_username="alice@example.com", max_players=8, current_players=1)
+    db.session.add(old_room)
+    db.session.commit()
+    old_room_id = old_room.id
+    add_member(old_room_id, "alice@example.com")
+
+    vpn = FakeVPN()
+    service = MembershipService(vpn)
+
+    def failing_commit():
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(db.session, "commit", failing_commit)
+    with pytest.raises(RuntimeError):
+        service.join(room, "alice@example.com")
+    monkeypatch.undo()
+
+    # المعاملة تراجعت: الغرفة القديمة وهابها باقيان، والمستخدم الجديد حُذف
+    assert db.session.get(Room, old_room_id) is not None
+    assert not [c for c in vpn.commands if c[0] == "run_commands"]
+    assert vpn.commands[-1] == ("delete_users", "room_%d" % room, ["alice"])
+
+    vpn.commands.clear()
+    result = service.join(room, "alice@example.com")
+    assert result["rejoined"] is False
+    assert db.session.get(Room, old_room_id) is None
+    assert vpn.commands[-1] == ("run_commands", [(None, "HubDelete room_%d" % old_room_id)])
+
+
+def test_join_creates_vpn_user_before_any_write(room):
+    # لاعب ينتقل من غرفة أخرى: حذف عضويته القديمة لا يُجهز قبل انتهاء vpncmd
+    old_room = Room(name="old", owner_username="alice@example.com", max_players=8, current_players=1)
+    db.session.add(old_room)
+    db.session.commit()
+    add_member(old_room.id, "alice@example.com")
+    add_member(old_room.id, "carol@example.com")
+
+    flushes = []
+    listener = lambda session, context: flushes.append(1)  # noqa: E731
+    event.listen(db.session, "after_flush", listener)
+    state_at_create = []
+    vpn = FakeVPN()
+    vpn.on_create = lambda: state_at_create.append(
+        (len(flushes), list(db.session.new), list(db.session.deleted), list(db.session.dirty)))
+    try:
+        MembershipService(vpn).join(room, "alice@example.com")
+    finally:
+        event.remove(db.session, "after_flush", listener)
+
+    assert state_at_create == [(0, [], [], [])]
+    assert flushes
+    assert RoomPlayer.query.filter_by(player_username="alice@example.com").one().room_id == room
+
+
+def test_leave_runs_vpn_cleanup_after_commit(room, monkeypatch):
+    add_member(room, "bob@example.com")
+    vpn = FakeVPN()
+
+    def failing_commit():
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(db.session, "commit", failing_commit)
+    with pytest.raises(RuntimeError):
+        MembershipService(vpn).leave(room, "bob@example.com")
+    monkeypatch.undo()
+
+    assert vpn.commands == []
+    assert RoomPlayer.query.filter_by(room_id=room, player_username="bob@example.com").count() == 1
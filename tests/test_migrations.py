@@ -0,0 +1,58 @@
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask import current_app
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from models import db
+from database.migrations import BASELINE_REVISION, upgrade_database
+
+
+def schema_diff():
+    """الفروق بين النماذج ومخطط قاعدة البيانات كما يراها flask db migrate"""
+    with db.engine.connect() as conn:
+        context = MigrationContext.configure(conn, opts=current_app.extensions['migrate'].configure_args)
+        return compare_metadata(context, db.metadata)
+
+
+def current_revision():
+    with db.engine.connect() as conn:
+        return MigrationContext.configure(conn).get_current_revision()
+
+
+def test_migrations_match_models(app):
+    upgrade()
+    assert schema_diff() == []
+
+
+def test_new_database_is_created_and_stamped(app):
+    assert upgrade_database(db) == "created"
+    assert schema_diff() == []
+    assert upgrade_database(db) is None
+
+
+def test_unversioned_baseline_database_is_upgraded(app):
+    # قاعدة أنشأها create_all قبل إضافة الترحيلات: جداول المخطط الأساسي بدون سجل مراجعات
+    upgrade(revision=BASELINE_REVISION)
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE alembic_version"))
+        conn.execute(text("INSERT INTO room (id, name, owner_username) VALUES (1, 'room', 'host')"))
+        conn.execute(text("INSERT INTO chat_message (room_id, sender, message) VALUES (1, 'host', 'hello')"))
+
+    assert upgrade_database(db) == "upgraded"
+    assert schema_diff() == []
+    # إعادة إنشاء chat_message في SQLite (لحذف المفتاح الأجنبي) تحتفظ بالرسائل
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SELECT room_id, message FROM chat_message")).all() == [(1, 'hello')]
+
+
+def test_database_with_unknown_revision_is_upgraded(app):
+    # قاعدة رقاها flask db migrate داخل الحاوية بمراجعة غير موجودة في المستودع، وبمخطط النماذج الحالي
+    db.create_all()
+    with db.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)"))
+        conn.execute(text("INSERT INTO alembic_version VALUES ('0123456789ab')"))
+
+    upgrade_database(db)
+    assert schema_diff() == []
+    assert current_revision() != '0123456789ab'
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from services.player_broadcast import PlayerListBroadcaster
+from services.presence_store import PresenceRegistry
+
+
+class Emitted:
+    def __init__(self):
+        self.payloads = []
+        self.event = threading.Event()
+
+    def __call__(self, room_id, payload):
+        self.payloads.append(payload)
+        self.event.set()
+
+
+def broadcaster(window=0.05):
+    emitted = Emitted()
+    return PlayerListBroadcaster(emitted, PresenceRegistry(), window=window), emitted
+
+
+def wait_for_flush(players):
+    # لا يوجد إرسال ننتظره عند إلغاء التغييرات، فننتظر خلو الدفعات المعلقة ثم انتهاء معالجتها
+    for _ in range(100):
+        if not players.stats()["pending_rooms"]:
+            time.sleep(0.05)
+            return
+        time.sleep(0.02)
+    raise AssertionError("player changes were not flushed")
+
+
+def test_changes_in_one_window_share_a_delta():
+    players, emitted = broadcaster()
+    players.record("joined", 1, "a")
+    players.record("joined", 1, "b")
+    players.record("left", 1, "c")
+
+    assert emitted.event.wait(2)
+    assert emitted.payloads == [{"room_id": "1", "version": 1, "joined": ["a", "b"], "left": ["c"]}]
+
+
+def test_join_then_leave_in_one_window_emits_nothing():
+    players, emitted = broadcaster()
+    players.record("joined", 1, "a")
+    players.record("left", 1, "a")
+
+    wait_for_flush(players)
+    assert emitted.payloads == []
+    assert players.versions.room_version(1) == 0
+
+
+def test_versions_increase_across_windows():
+    players, emitted = broadcaster()
+    players.record("joined", 1, "a")
+    assert emitted.event.wait(2)
+    emitted.event.clear()
+    players.record("left", 1, "a")
+    assert emitted.event.wait(2)
+    assert [payload["version"] for payload in emitted.payloads] == [1, 2]
+
+
+def test_deleted_room_drops_version_without_emitting():
+    players, emitted = broadcaster()
+    players.versions.next_room_version(1)
+    players.record("joined", 1, "a")
+    players.record("room_deleted", 1, "a")
+
+    wait_for_flush(players)
+    assert emitted.payloads == []
+    assert players.versions.room_version(1) == 0
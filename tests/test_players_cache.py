@@ -0,0 +1,106 @@
+import pytest
+
+from models import db, Room, RoomPlayer
+from services.players_cache import RoomPlayersCache
+from services.sharding import RoomShards
+
+
+class Loader:
+    """بديل قاعدة البيانات يعيد لاعبي الغرفة ويعد مرات التحميل"""
+
+    def __init__(self, rooms):
+        self.rooms = rooms
+        self.calls = 0
+
+    def __call__(self, room_id):
+        self.calls += 1
+        return list(self.rooms.get(room_id, []))
+
+
+def test_changes_update_cached_room_without_reload():
+    load = Loader({"1": ["a"]})
+    cache = RoomPlayersCache()
+    assert cache.get(1, load) == ["a"]
+
+    cache.add(1, "b")
+    cache.remove("1", "a")
+    assert cache.get(1, load) == ["b"]
+    assert load.calls == 1
+
+
+def test_invalidate_reloads_from_database():
+    load = Loader({"1": ["a"]})
+    cache = RoomPlayersCache()
+    cache.get(1, load)
+
+    load.rooms["1"] = ["a", "c"]
+    cache.invalidate(1)
+    assert cache.get(1, load) == ["a", "c"]
+    assert load.calls == 2
+
+
+def test_change_during_load_is_not_cached():
+    cache = RoomPlayersCache()
+    rooms = {"1": ["a"]}
+
+    def load(room_id):
+        # لاعب ينضم بعد قراءة القائمة من قاعدة البيانات وقبل تخزينها
+        players = list(rooms[room_id])
+        rooms[room_id].append("b")
+        cache.add(room_id, "b")
+        return players
+
+    assert cache.get(1, load) == ["a"]
+    assert cache.get(1, lambda room_id: list(rooms[room_id])) == ["a", "b"]
+
+
+def test_least_recently_used_room_is_evicted():
+    load = Loader({"1": ["a"], "2": ["b"], "3": ["c"]})
+    cache = RoomPlayersCache(max_rooms=2)
+    cache.get(1, load)
+    cache.get(2, load)
+    cache.get(1, load)
+    cache.get(3, load)
+
+    assert cache.stats()["evictions"] == 1
+    cache.get(1, load)
+    assert load.calls == 3
+    cache.get(2, load)
+    assert load.calls == 4
+
+
+
+def add_player(room_id, username):
+    db.session.add(RoomPlayer(room_id=room_id, player_username=username, username=username.split("@")[0]))
+    db.session.commit()
+
+
+@pytest.fixture
+def room_id(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "room_shards", RoomShards())
+    room = Room(name="cached", owner_username="host@example.com", max_players=8, current_players=1)
+    db.session.add(room)
+    db.session.commit()
+    add_player(room.id, "host@example.com")
+    return room.id
+
+
+def test_membership_events_keep_app_cache_current(app_module, room_id):
+    assert app_module.get_players_for_room(room_id) == ["host@example.com"]
+
+    add_player(room_id, "guest@example.com")
+    app_module.membership.notify("joined", room_id, "guest@example.com")
+    assert app_module.get_players_for_room(room_id) == ["host@example.com", "guest@example.com"]
+
+    RoomPlayer.query.filter_by(room_id=room_id).delete()
+    db.session.commit()
+    app_module.membership.notify("room_deleted", room_id, "host@example.com")
+    assert app_module.get_players_for_room(room_id) == []
+
+
+def test_shared_rooms_bypass_app_cache(app_module, room_id, monkeypatch):
+    app_module.get_players_for_room(room_id)
+    monkeypatch.setattr(app_module, "room_shards", RoomShards(shared=True))
+    # عامل آخر أضاف اللاعب فلم يصل حدث العضوية إلى هذه العملية
+    add_player(room_id, "guest@example.com")
+    assert sorted(app_module.get_players_for_room(room_id)) == ["guest@example.com", "host@example.com"]
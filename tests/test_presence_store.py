@@ -0,0 +1,84 @@
+import fakeredis
+import pytest
+import redis
+
+from services.presence_store import PresenceRegistry, RedisPresenceStore
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, monkeypatch):
+    """نفس الاختبارات على السجل داخل العملية وعلى مخزن Redis المشترك"""
+    if request.param == "memory":
+        return PresenceRegistry()
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    return RedisPresenceStore("redis://fake")
+
+
+def test_room_and_user_indexes(store):
+    store.set_session("s1", 1, "a")
+    store.set_session("s2", 1, "b")
+    store.set_session("s3", 2, "a")
+
+    assert sorted(store.room_sessions(1)) == [("s1", "a"), ("s2", "b")]
+    assert sorted(store.user_sessions("a")) == [("s1", "1"), ("s3", "2")]
+
+    # الانتقال إلى غرفة أخرى يحدّث الفهرسين
+    store.set_session("s2", 2, "b")
+    assert store.room_sessions(1) == [("s1", "a")]
+    assert sorted(store.room_sessions(2)) == [("s2", "b"), ("s3", "a")]
+
+    assert store.remove_session("s1") == ("1", "a")
+    assert store.room_sessions(1) == []
+    assert store.user_sessions("a") == [("s3", "2")]
+    assert store.remove_session("s1") is None
+
+
+def test_disconnected_players_by_room(store):
+    store.mark_disconnected(1, "a", "s1")
+    store.mark_disconnected(2, "b", "s2")
+
+    assert store.get_disconnected(1, "a") == "s1"
+    assert store.room_disconnected(1) == [("a", "s1")]
+    assert store.clear_disconnected(1, "a")
+    assert not store.clear_disconnected(1, "a")
+    assert store.room_disconnected(1) == []
+    assert store.room_disconnected(2) == [("b", "s2")]
+
+
+def test_take_dirty_rooms_drains_changes(store):
+    store.set_session("s1", 1, "a")
+    store.mark_disconnected(2, "b", "s2")
+    store.mark_room_dirty(3)
+
+    assert store.take_dirty_rooms() == {"1", "2", "3"}
+    assert store.take_dirty_rooms() == set()
+
+    # الانتقال إلى غرفة جديدة يسجلها من جديد
+    store.set_session("s1", 4, "a")
+    assert store.take_dirty_rooms() == {"4"}
+
+
+def test_room_versions(store):
+    assert store.room_version(1) == 0
+    assert [store.next_room_version(1) for _ in range(3)] == [1, 2, 3]
+    store.drop_room_version(1)
+    assert store.room_version(1) == 0
+
+
+def test_redis_stores_share_state_across_workers(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    worker_a, worker_b = RedisPresenceStore("redis://fake"), RedisPresenceStore("redis://fake")
+
+    # انقطع اللاعب عند العامل الأول وعاد عبر العامل الثاني قبل انتهاء مهلة السماح
+    worker_a.set_session("s1", 1, "a")
+    worker_a.mark_disconnected(1, "a", "s1")
+    worker_b.set_session("s2", 1, "a")
+    assert worker_b.clear_disconnected(1, "a")
+
+    # مؤقت العامل الأول لا يجد الانقطاع المسجل فلا يطرد اللاعب
+    assert worker_a.get_disconnected(1, "a") is None
+    assert sorted(worker_a.room_sessions(1)) == [("s1", "a"), ("s2", "a")]
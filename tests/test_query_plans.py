@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import text
+
+from models import db
+from database.query_plans import seed, check_query_plans
+
+
+@pytest.fixture
+def seeded(app):
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("EXPLAIN QUERY PLAN خاص بـ SQLite")
+    db.create_all()
+    # حجم صغير يكفي ليختار SQLite الفهارس بعد ANALYZE، والفحص الكامل في check_query_plans.py
+    seed(db.session, scale=0.02)
+
+
+def test_hot_queries_use_indexes(seeded):
+    assert check_query_plans(db.session) == []
+
+
+def test_missing_index_fails(seeded):
+    db.session.execute(text("DROP INDEX ix_chat_message_room_id_timestamp"))
+    failed = {name for name, plan in check_query_plans(db.session)}
+    assert {"chat by time", "retention expired chunk"} <= failed
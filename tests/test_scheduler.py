@@ -0,0 +1,52 @@
+import threading
+
+from services.scheduler import TimerScheduler
+
+
+class Expired:
+    """يجمع دفعات المؤقتات المنتهية ويشير عند وصول أول دفعة"""
+
+    def __init__(self):
+        self.batches = []
+        self.event = threading.Event()
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+        self.event.set()
+
+
+def test_cancelled_timer_never_fires():
+    expired = Expired()
+    scheduler = TimerScheduler(expired, batch_window=0)
+    scheduler.schedule("a", 0.05, "a")
+    scheduler.schedule("b", 0.1, "b")
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    assert not scheduler.pending("a")
+
+    assert expired.event.wait(2)
+    assert expired.batches == [["b"]]
+    assert len(scheduler) == 0
+
+
+def test_reschedule_replaces_previous_timer():
+    expired = Expired()
+    scheduler = TimerScheduler(expired, batch_window=0)
+    scheduler.schedule("a", 0.05, "first")
+    scheduler.schedule("a", 0.1, "second")
+
+    assert expired.event.wait(2)
+    assert expired.batches == [["second"]]
+    assert scheduler.expired_total == 1
+
+
+def test_timers_within_window_expire_in_one_batch():
+    expired = Expired()
+    scheduler = TimerScheduler(expired, batch_window=0.5)
+    for n in range(5):
+        scheduler.schedule(n, 0.05 + n * 0.05, n)
+    scheduler.schedule("late", 5, "late")
+
+    assert expired.event.wait(2)
+    assert expired.batches == [[0, 1, 2, 3, 4]]
+    assert scheduler.pending("late")
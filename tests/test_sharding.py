@@ -0,0 +1,92 @@
+import json
+import subprocess
+import sys
+import threading
+
+import fakeredis
+import pytest
+import redis
+
+from conftest import ROOT
+from services.sharding import RoomShards, ShardRouter
+
+
+def test_owner_is_stable_across_processes():
+    # hash() في بايثون يتغير بين العمليات (PYTHONHASHSEED)، وكل العمليات يجب أن تتفق على المالك
+    room_ids = ["1", "2", "42", "1000", "99999"]
+    expected = [RoomShards(count=4).owner(room_id) for room_id in room_ids]
+    for seed in ("1", "2"):
+        output = subprocess.run(
+            [sys.executable, "-c", "import json; from services.sharding import RoomShards; "
+             f"print(json.dumps([RoomShards(count=4).owner(r) for r in {room_ids!r}]))"],
+            cwd=ROOT, env={"PYTHONHASHSEED": seed}, capture_output=True, text=True, check=True).stdout
+        assert json.loads(output) == expected
+    assert len(set(expected)) > 1
+
+
+def test_invalid_shard_is_rejected():
+    with pytest.raises(ValueError):
+        RoomShards(count=2, index=2)
+
+
+class FlakyPubSub:
+    """اشتراك ينقطع اتصاله عند أول استماع"""
+
+    def __init__(self, messages, fail):
+        self.messages = messages
+        self.fail = fail
+
+    def subscribe(self, channel):
+        pass
+
+    def listen(self):
+        if self.fail:
+            raise redis.ConnectionError("Connection closed by server")
+        yield from self.messages
+        threading.Event().wait()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def router(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    delivered = []
+    done = threading.Event()
+
+    def deliver(*event):
+        delivered.append(event)
+        done.set()
+
+    shards = RoomShards(count=2, index=0)
+    router = ShardRouter(shards, "redis://fake", deliver, retry_delay=0.01)
+    return router, delivered, done
+
+
+def test_router_resubscribes_after_connection_loss(router):
+    router, delivered, done = router
+    message = {"data": json.dumps(["joined", "7", "bob@example.com"])}
+    subscriptions = iter([FlakyPubSub([], fail=True), FlakyPubSub([message], fail=False)])
+    router._redis.pubsub = lambda **kwargs: next(subscriptions)
+
+    router.start()
+    assert done.wait(2)
+    assert delivered == [("joined", "7", "bob@example.com")]
+    assert router.stats()["reconnects"] == 1
+
+
+def test_route_publishes_to_owner_channel(router):
+    router, delivered, done = router
+    room_id = next(str(n) for n in range(100) if router.shards.owner(str(n)) == 1)
+    pubsub = router._redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("shard:1:membership")
+    assert router.route("left", room_id, "bob@example.com")
+    # أول get_message يستهلك تأكيد الاشتراك (ويعيد None)
+    message = pubsub.get_message(timeout=1) or pubsub.get_message(timeout=1)
+    assert json.loads(message["data"]) == ["left", room_id, "bob@example.com"]
+    # الغرف المحلية تُعالج في نفس العملية
+    local = next(str(n) for n in range(100) if router.shards.owner(str(n)) == 0)
+    assert not router.route("left", local, "bob@example.com")
@@ -0,0 +1,58 @@
+import pytest
+
+from services.socket_metrics import SocketEventMetrics
+
+
+def test_latency_buckets_and_percentiles():
+    metrics = SocketEventMetrics()
+    for _ in range(98):
+        metrics.record("send_message", 0.5, False)
+    metrics.record("send_message", 30, False)
+    metrics.record("send_message", 2000, True)
+
+    stats = metrics.stats()["events"]["send_message"]
+    assert stats["count"] == 100
+    assert stats["errors"] == 1
+    assert stats["latency_buckets_ms"]["1"] == 98
+    assert stats["latency_buckets_ms"]["50"] == 1
+    assert stats["latency_buckets_ms"]["inf"] == 1
+    assert stats["p50_ms"] == 1
+    assert stats["p99_ms"] == 50
+    # ما يتجاوز آخر حد يُقدّر بأعلى زمن مسجل
+    metrics.record("send_message", 3000, False)
+    assert metrics.stats()["events"]["send_message"]["p99_ms"] == 3000
+
+
+def test_instrument_counts_errors_and_samples_payloads():
+    metrics = SocketEventMetrics(payload_sample_rate=2)
+
+    def handler(data):
+        if data.get("fail"):
+            raise ValueError("bad")
+        return "ok"
+
+    wrapped = metrics.instrument("join", handler)
+    assert wrapped({"room_id": 1}) == "ok"
+    assert wrapped({"room_id": 1}) == "ok"
+    with pytest.raises(ValueError):
+        wrapped({"room_id": 2, "fail": True})
+
+    stats = metrics.stats()["events"]["join"]
+    assert stats["count"] == 3
+    assert stats["errors"] == 1
+    # حدث واحد من كل اثنين يُرمّز لقياس حجمه
+    assert stats["avg_payload_bytes"] == len('{"room_id": 1}')
+
+
+def test_room_rates_roll_per_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("services.socket_metrics.time.monotonic", lambda: now[0])
+    metrics = SocketEventMetrics(rate_window=10)
+    for _ in range(20):
+        metrics.record("send_message", 1, False, room_id="1")
+    metrics.record("send_message", 1, False, room_id="2")
+    assert metrics.stats()["room_events_per_second"] == {}
+
+    now[0] = 110.0
+    metrics.record("send_message", 1, False, room_id="2")
+    assert metrics.stats()["room_events_per_second"] == {"1": 2.0, "2": 0.2}
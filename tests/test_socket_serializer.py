@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+
+import pytest
+import socketio
+from werkzeug.serving import make_server
+
+from conftest import ROOT
+from services.socket_serializer import NegotiatedPacket, enable_msgpack_negotiation
+
+pytest.importorskip("msgpack")
+sys.path.insert(0, os.path.join(ROOT, "frontend"))
+from socket_serializer import create_client, connection_url  # noqa: E402
+
+
+def serve(sio):
+    http = make_server("127.0.0.1", 0, socketio.WSGIApp(sio), threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return http
+
+
+@pytest.fixture
+def server():
+    """خادم Socket.IO حقيقي بنفس إعداد app.py: حزم NegotiatedPacket مع تفعيل التفاوض"""
+    sio = socketio.Server(async_mode="threading", serializer=NegotiatedPacket)
+    assert enable_msgpack_negotiation(sio)
+    # ترميز كل حزمة new_message كما أُرسلت لكل مستقبل
+    sio.encodings = []
+    send_packet = sio._send_packet
+
+    def _send_packet(eio_sid, pkt):
+        send_packet(eio_sid, pkt)
+        if pkt.data and pkt.data[0] == "new_message":
+            sio.encodings.append(pkt.use_msgpack)
+
+    sio._send_packet = _send_packet
+
+    @sio.on("join")
+    def join(sid, data):
+        sio.enter_room(sid, data["room_id"])
+        return True
+
+    @sio.on("send_message")
+    def send_message(sid, data):
+        sio.emit("new_message", data, room=data["room_id"])
+
+    http = serve(sio)
+    yield sio, f"http://127.0.0.1:{http.server_port}"
+    http.shutdown()
+
+
+def connect(client, url, received):
+    done = threading.Event()
+
+    @client.on("new_message")
+    def on_message(data):
+        received.append(data)
+        done.set()
+
+    client.connect(url, transports=["polling"])
+    assert client.call("join", {"room_id": "1"}, timeout=5)
+    return done
+
+
+def test_json_and_msgpack_clients_share_a_room(server):
+    sio, server_url = server
+    json_client, msgpack_client = socketio.Client(), create_client()
+    json_received, msgpack_received = [], []
+    json_done = connect(json_client, server_url, json_received)
+    msgpack_done = connect(msgpack_client, connection_url(server_url), msgpack_received)
+    try:
+        # نفس البث يُرمز لكل مستقبل حسب ما طلبه، مع نص عربي وأرقام حتى يظهر أي خطأ في فك الترميز
+        message = {"room_id": "1", "sender": "a", "message": "مرحبا", "count": 3}
+        json_client.emit("send_message", message)
+        assert json_done.wait(5) and msgpack_done.wait(5)
+        assert json_received == [message]
+        assert msgpack_received == [message]
+        assert sorted(sio.encodings) == [False, True]
+
+        # والعكس: رسالة من عميل MessagePack تصل لعميل JSON
+        json_done.clear()
+        msgpack_client.emit("send_message", dict(message, sender="b"))
+        assert json_done.wait(5)
+        assert json_received[-1]["sender"] == "b"
+    finally:
+        json_client.disconnect()
+        msgpack_client.disconnect()
+
+
+def test_msgpack_client_falls_back_to_json():
+    # عميل يطلب MessagePack من خادم لم يفعّله يستمر بـ JSON
+    sio = socketio.Server(async_mode="threading", serializer=NegotiatedPacket)
+    received = []
+    done = threading.Event()
+
+    @sio.on("ping_room")
+    def ping_room(sid, data):
+        sio.emit("pong_room", data, to=sid)
+
+    http = serve(sio)
+    client = create_client()
+    client.on("pong_room", lambda data: (received.append(data), done.set()))
+    try:
+        client.connect(connection_url(f"http://127.0.0.1:{http.server_port}"), transports=["polling"])
+        client.emit("ping_room", {"n": 1})
+        assert done.wait(5)
+        assert received == [{"n": 1}]
+    finally:
+        client.disconnect()
+        http.shutdown()
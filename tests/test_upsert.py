@@ -0,0 +1,54 @@
+from models import db, Room, RoomPlayer, User, Friendship
+from database.upsert import insert_ignore, upsert
+
+
+def add_room():
+    room = Room(name="room", owner_username="host@example.com")
+    db.session.add(room)
+    db.session.commit()
+    return room.id
+
+
+def test_insert_ignore_adds_once(app):
+    db.create_all()
+    room_id = add_room()
+    values = {"room_id": room_id, "player_username": "a@example.com", "username": "a", "is_host": False}
+
+    assert insert_ignore(db.session, RoomPlayer, values, ["room_id", "player_username"]) is True
+    assert insert_ignore(db.session, RoomPlayer, dict(values, username="other"),
+                         ["room_id", "player_username"]) is False
+    db.session.commit()
+
+    players = RoomPlayer.query.filter_by(room_id=room_id).all()
+    assert [(p.player_username, p.username) for p in players] == [("a@example.com", "a")]
+
+
+def test_insert_ignore_friend_request(app):
+    db.create_all()
+    db.session.add_all([
+        User(id=1, username="a", email="a@example.com", password_hash="x"),
+        User(id=2, username="b", email="b@example.com", password_hash="x"),
+    ])
+    db.session.commit()
+
+    values = {"user_id": 1, "friend_id": 2, "status": "pending"}
+    assert insert_ignore(db.session, Friendship, values, ["user_id", "friend_id"]) is True
+    assert insert_ignore(db.session, Friendship, values, ["user_id", "friend_id"]) is False
+    db.session.commit()
+    assert Friendship.query.count() == 1
+
+
+def test_upsert_updates_existing_row(app):
+    db.create_all()
+    room_id = add_room()
+    conflict = ["room_id", "player_username"]
+    values = {"room_id": room_id, "player_username": "a@example.com", "username": "a", "is_host": False,
+              "vpn_password_encrypted": "first"}
+
+    upsert(db.session, RoomPlayer, values, conflict, ["username", "vpn_password_encrypted"])
+    upsert(db.session, RoomPlayer, dict(values, username="a2", vpn_password_encrypted="second"),
+           conflict, ["username", "vpn_password_encrypted"])
+    db.session.commit()
+
+    player = RoomPlayer.query.filter_by(room_id=room_id).one()
+    assert (player.username, player.vpn_password_encrypted, player.is_host) == ("a2", "second", False)